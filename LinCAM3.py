@@ -31,14 +31,61 @@ import webbrowser
 import operator
 import sys
 import shutil
+import string
 from collections import OrderedDict
+from contextlib import contextmanager
 import traceback
+import math
+from array import array
+import threading
+import Queue
+import uuid
+import time
+import urllib2
+import BaseHTTPServer
+import SocketServer
+import base64
+import itertools
+import hashlib
+#Modules next to this script that also work without Rhino
+if os.path.dirname(os.path.realpath(__file__)) not in sys.path: sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from lincam_sender import g_sender
+from lincam_metrics import append_metrics, read_metrics, summarize_metrics
+from lincam_workers import wait_for_worker, run_remote_job
 
 COMMAND_NAME = "LinCAM3"
 PLUGIN_NAME = "LinCAM"
 VERSION = "CG-2023-1"
 WEBPAGE = 'https://github.com/AcOscar/Rhino_LinCAM3'
 
+#Kind of move stored with every toolpath point, arcs add their direction to the state
+MOVE_RAPID = 0
+MOVE_PLUNGE = 1
+MOVE_CUT = 2
+MOVE_ARC_CW = 4
+MOVE_ARC_CCW = 8
+MOVE_STATES = {"rapid":MOVE_RAPID,"plunge":MOVE_PLUNGE,"cut":MOVE_CUT}
+#Increase when the toolpath generation changes so old cached toolpaths are computed again
+CACHE_VERSION = 4
+#Increase when the fields of the metrics log records change
+METRICS_VERSION = 2
+#Height over the floor of the level above for links that stay inside a pocket
+LINK_CLEARANCE = .5
+#Loop radius of the trochoidal pocketing as a fraction of the cutter diameter
+TROCHOID_LOOP_RADIUS = .4
+#Most preset variants a sweep ranks, only the fastest ones are made as whole jobs
+SWEEP_MAX_VARIANTS = 5000
+#Preset fields that count something, a sweep only gives them whole numbers
+SWEEP_WHOLE_FIELDS = ("entries","finish_entries","tool","rest_tool")
+#Preview detail of the toolpaths and its label
+PREVIEW_MODES = OrderedDict([("full","Completa"),("top","Primer nivel"),("none","Ninguna")])
+#AutoCAD color index of the operation colors, other colors are imported but no operation uses them
+ACI_COLORS = {1:(255,0,0),3:(0,255,0),5:(0,0,255),6:(255,0,255),7:(255,255,255)}
+SVG_COLORS = {'red':(255,0,0),'lime':(0,255,0),'blue':(0,0,255),'magenta':(255,0,255),'fuchsia':(255,0,255),'white':(255,255,255),'black':(0,0,0)}
+#DXF $INSUNITS codes as Rhino unit systems
+DXF_UNITS = {1:8,2:9,4:2,5:3,6:4}
+SVG_UNITS = {'mm':1.0,'cm':10.0,'in':25.4,'pt':25.4/72,'pc':25.4/6,'px':25.4/96,'':25.4/96}
+
 # SampleEtoRoomNumber dialog class
 class camDialog(forms.Form):
 
@@ -50,6 +97,8 @@ class camDialog(forms.Form):
         self.rhino_objects = None
         self.sorted_objects = None 
         self.model_objects = None
+        # Objects of the last code by curve id, for previews made on demand
+        self.last_objects = {}
         # Total machining time
         self.cut_time = 0
         # Total object
@@ -93,6 +142,19 @@ class camDialog(forms.Form):
         if self.user_data['selected_preset'] not in self.machining_settings: self.user_data['selected_preset'] = False
         #Check if there is any selected post if not assign the first one in the list.
         if not self.user_data['post']: self.user_data['post'] = sorted(self.postprocessors.keys())[-1]
+        if 'use_cache' not in self.user_data: self.user_data['use_cache'] = True
+        if 'congruent_parts' not in self.user_data: self.user_data['congruent_parts'] = True
+        if 'congruent_rotation' not in self.user_data: self.user_data['congruent_rotation'] = False
+        if 'serial_port' not in self.user_data: self.user_data['serial_port'] = 'COM3'
+        if 'baudrate' not in self.user_data: self.user_data['baudrate'] = 115200
+        if 'job_server' not in self.user_data: self.user_data['job_server'] = ''
+        if 'profile' not in self.user_data: self.user_data['profile'] = False
+        if 'common_line' not in self.user_data: self.user_data['common_line'] = False
+        if 'remove_duplicates' not in self.user_data: self.user_data['remove_duplicates'] = True
+        if self.user_data.get('preview_mode') not in PREVIEW_MODES: self.user_data['preview_mode'] = 'full'
+        #Program streaming to GRBL, the event stops it
+        self.sender_thread = None
+        self.sender_stop = threading.Event()
         
         # Form settings
         self.Title = self.command_name
@@ -137,6 +199,7 @@ class camDialog(forms.Form):
             self.initial_settings_file = os.path.join(settings_folder,"InitialSettings.json")
             self.postprocessors_file = os.path.join(settings_folder,"Postprocessors.json")
             self.language_file = os.path.join(settings_folder,"LangFile.json")
+            self.metrics_file = os.path.join(settings_folder,"Metrics.jsonl")
          
         except Exception as e: print(e)
     
@@ -216,6 +279,16 @@ class camDialog(forms.Form):
                    'file_name':rs.DocumentName().replace('.3dm','_gcode.nc') if rs.DocumentName() else False,
                    "selected_preset":self.machining_settings.keys()[0] if self.machining_settings else False,
                    "save_image":False,
+                   "use_cache":True,
+                   "congruent_parts":True,
+                   "congruent_rotation":False,
+                   "serial_port":"COM3",
+                   "baudrate":115200,
+                   "job_server":'',
+                   "profile":False,
+                   "common_line":False,
+                   "remove_duplicates":True,
+                   "preview_mode":'full',
                    }
         return data
     
@@ -252,20 +325,6 @@ class camDialog(forms.Form):
         rs.DeleteLayer(self.trash_layer)
         if original_layer: rs.CurrentLayer(original_layer)
     
-    def CleanLayer(self,layer,parent_layer=False):
-        if parent_layer: rs.LayerLocked(parent_layer,False)
-        if not rs.IsLayer(layer):rs.AddLayer(layer,parent=parent_layer)
-        else:
-            rs.LayerLocked(layer,False)
-            rs.DeleteObjects(rs.ObjectsByLayer(layer))
-        if parent_layer: rs.LayerLocked(parent_layer,True)
-        rs.LayerLocked(layer,True)
-        
-    def AddPreviewLayers(self):
-        self.CleanLayer(self.layer_preview)
-        self.CleanLayer(self.layer_cluster,self.layer_preview)
-        self.CleanLayer(self.layer_sorting,self.layer_preview)
-    
     def GetObjectsID(self,reg_json=False):
         if not self.rhino_objects: return False
         objects_id = []
@@ -294,6 +353,7 @@ class camDialog(forms.Form):
         # Remove the events added in the initializer
         #self.RemoveEvents()
         # Dispose of the form and remove it from the sticky dictionary
+        self.sender_stop.set()
         self.SaveData()
         if sc.sticky.has_key(self.command_name):
             form = sc.sticky[self.command_name]
@@ -350,6 +410,18 @@ class camDialog(forms.Form):
         self.SelectedPresetText = forms.Label(Text = preset_description)
         
         SaveButton.Click += self.make_code
+        ImportButton = forms.Button(Text = self.txt('Importar DXF/SVG'))
+        ImportButton.Click += self.import_file
+        MetricsButton = forms.Button(Text = self.txt('Estadisticas'))
+        MetricsButton.Click += self.show_metrics
+        QuoteButton = forms.Button(Text = self.txt('Cotizar'))
+        QuoteButton.Click += self.quote_code
+        FileButtons = forms.DynamicLayout()
+        FileButtons.Spacing = drawing.Size(3, 3)
+        SweepButton = forms.Button(Text = self.txt('Optimizar rutina'))
+        SweepButton.Click += self.sweep_presets
+        FileButtons.AddRow(ImportButton,QuoteButton,SweepButton,MetricsButton)
+        SenderControls = self.CreateSenderControls()
         #Progress bar for slow computers
         self.progressbar = forms.ProgressBar()
         self.progressbar.MinValue = 0
@@ -377,14 +449,31 @@ class camDialog(forms.Form):
         
         layout.AddRow(None)
         layout.AddRow(None)
+        layout.AddRow(FileButtons)
         layout.AddRow(SaveButton)
         layout.AddRow(self.progressbar)
+        layout.AddRow(SenderControls)
         layout.AddRow(None)
         layout.AddRow(Console)
         
         
         self.Content = layout
     
+    def CreateSenderControls(self):
+        
+        layout = forms.DynamicLayout()
+        layout.Spacing = drawing.Size(3, 3)
+        self.serial_port_input = forms.TextBox(Text = self.user_data['serial_port'])
+        self.baudrate_input = forms.TextBox(Text = str(self.user_data['baudrate']))
+        self.send_button = forms.Button(Text = self.txt('Enviar a GRBL'))
+        self.send_button.Click += self.send_code
+        layout.AddRow(self.Icon('upload.png'),forms.Label(Text = self.txt('Puerto:')),self.serial_port_input,self.baudrate_input,self.send_button)
+        #Empty server makes the code on this computer
+        self.job_server_input = forms.TextBox(Text = self.user_data['job_server'])
+        self.job_server_input.PlaceholderText = 'http://127.0.0.1:8765'
+        layout.AddRow(self.Icon('cloud.png'),forms.Label(Text = self.txt('Servidor:')),self.job_server_input)
+        return layout
+    
     def CreateConsole(self):
         
         layout = forms.DynamicLayout()
@@ -455,7 +544,7 @@ class camDialog(forms.Form):
         
         layout = forms.DynamicLayout()
         layout.Spacing = drawing.Size(10, 3)
-        ordered_checkboxes = ['sorting','sort_closest','autocluster','save_image']
+        ordered_checkboxes = ['sorting','sort_closest','autocluster','save_image','use_cache','congruent_parts','congruent_rotation','common_line','remove_duplicates','profile']
         self.checkbox_inputs = {}
         for name in ordered_checkboxes:
             values = self.machining_input['CHECKBOX_INPUT'][name]
@@ -465,6 +554,17 @@ class camDialog(forms.Form):
             image = self.Icon(values['image'])
             self.checkbox_inputs[name] = checkbox
             layout.AddRow(image,checkbox)
+        #Preview detail, the full path of an object can be drawn later with the detail button
+        self.preview_mode_input = forms.DropDown()
+        self.preview_mode_input.DataStore = [self.txt(label) for label in PREVIEW_MODES.values()]
+        self.preview_mode_input.SelectedIndex = PREVIEW_MODES.keys().index(self.user_data['preview_mode'])
+        self.preview_mode_input.DropDownClosed += self.set_preview_mode
+        DetailButton = forms.Button(Text = self.txt('Detalle'))
+        DetailButton.Click += self.show_detail
+        preview_layout = forms.DynamicLayout()
+        preview_layout.Spacing = drawing.Size(3, 3)
+        preview_layout.AddRow(forms.Label(Text = self.txt('Vista previa:')),self.preview_mode_input,DetailButton)
+        layout.AddRow(self.Icon('show.png'),preview_layout)
         return layout                 
             
     def CreateSelectControls(self):
@@ -574,8 +674,20 @@ class camDialog(forms.Form):
             if in_value <= 0:in_value = 0.01
         if var_name in ["xy_dist"]:
             if in_value < .1 or in_value > 1:in_value = .5
+        if var_name in ["ramp_angle"]:
+            if in_value < 0 or in_value >= 90:in_value = 0.0
+        if var_name in ["engagement"]:
+            if in_value < .02 or in_value > .5:in_value = .15
         if var_name in ["depth"]:
             if in_value > -.01:in_value = in_value * -1
+        if var_name in ["tool"]:
+            in_value = int(in_value) if in_value >= 1 else 1
+        if var_name in ["peck","dwell"]:
+            if in_value < 0:in_value = 0.0
+        if var_name in ["tool_diam","chain_gap","rest_diam"]:
+            if in_value < 0:in_value = 0.0
+        if var_name in ["rest_tool"]:
+            in_value = int(in_value) if in_value >= 1 else 0
         return in_value            
     
     def ValidateName(self,name,input_dict):
@@ -603,7 +715,7 @@ class camDialog(forms.Form):
         for comp, values in self.machining_input['MACHINING_INPUT'].items():
             var_names = [i[0] for i in values]
             input_names = [self.txt(i[1]) for i in values]
-            input_values = [0 for i in var_names] if not preset_name else [self.machining_settings[preset_name][comp][i] for i in var_names]
+            input_values = [0 for i in var_names] if not preset_name else [self.machining_settings[preset_name][comp].get(i,0) for i in var_names]
             dialog_data[comp] = [[input_names[i],input_values[i]] for i in range(len(values))]
         
         title = self.txt('Editar rutina de corte') if edit else self.txt('Nueva rutina de corte')
@@ -635,8 +747,8 @@ class camDialog(forms.Form):
             post_description = self.postprocessors[post_name]['description'] if edit else ''
             dialog_input = []
             for input_data in self.machining_input['POST_INPUT']:
-                data = post_data[input_data['var']] if edit else input_data['value']
-                if input_data['type'] == 'list' and edit:
+                data = post_data.get(input_data['var'],input_data['value']) if edit else input_data['value']
+                if input_data['type'] == 'list' and isinstance(data,list):
                     data = ','.join(data)
                 dialog_input.append([self.txt(input_data['name']),data])
             dialog_data = {'Code':dialog_input}
@@ -645,9 +757,7 @@ class camDialog(forms.Form):
             dialog = editDialog(title,post_name,post_description,dialog_data,'post',messages,language=self.language,language_text=self.language_text)
             rc = dialog.ShowModal(Rhino.UI.RhinoEtoApp.MainWindow)
             if rc:
-                if edit: del self.postprocessors[self.user_data['post']]
                 new_settings = {}
-                new_name = self.ValidateName(dialog.GetName(),self.postprocessors)
                 new_settings['description'] = dialog.GetDescription()
                 dialog_values = dialog.GetSettings('Code')
                 for i in range(len(dialog_values)):
@@ -659,6 +769,12 @@ class camDialog(forms.Form):
                     else:
                         value = dialog_values[i].strip()
                     new_settings[post_input['var']] = value
+                post_errors = validate_post(new_settings,self.machining_input['POST_INPUT'])
+                if post_errors:
+                    self.ConsoleLog('Error: %s: %s' % (self.txt("Postprocesador invalido"),', '.join(post_errors)))
+                    return
+                if edit: del self.postprocessors[self.user_data['post']]
+                new_name = self.ValidateName(dialog.GetName(),self.postprocessors)
                 self.postprocessors.update({new_name:new_settings})
                 self.user_data['post'] = new_name
                 self.ConsoleLog('%s: %s' % (self.txt('Postprocesadores actualizados'),new_name))
@@ -705,89 +821,26 @@ class camDialog(forms.Form):
         if not self.user_data['selected_preset']:
             self.ConsoleLog('Error: %s' % self.txt("No hay rutina seleccionada"))
             return False
+        post_errors = validate_post(self.postprocessors[self.user_data['post']],self.machining_input['POST_INPUT'])
+        if post_errors:
+            self.ConsoleLog('Error: %s: %s' % (self.txt("Postprocesador invalido"),', '.join(post_errors)))
+            return False
+        tool_conflicts = self.GetJob().GetToolConflicts()
+        if tool_conflicts:
+            self.ConsoleLog('Error: %s: %s' % (self.txt("Herramienta con varios diametros"),', '.join(['T%s (%s)' % (tool,', '.join([str(diameter) for diameter in diameters])) for tool,diameters in tool_conflicts])))
+            return False
         return True
     
-    def SaveImages(self,file_path):
-        save_path_2 = file_path.replace('.nc',"_top.png")
-        save_path = file_path.replace('.nc',"_perspective.png")
-        persp_view = "Perspective"
-        top_view = "Top"
-        desire_width = 1800
-        views = rs.ViewNames()
-        if views:
-            persp_view = views[0]
-            top_view = views[1]
-            width,height = rs.ViewSize(persp_view)
-            scale = int(desire_width/width)
-            image_size = (width*scale,height*scale)
-            rs.CreatePreviewImage(save_path, view=persp_view, size=image_size, flags=2, wireframe=False)
-            width,height = rs.ViewSize(top_view)
-            scale = int(desire_width/width)
-            rs.CreatePreviewImage(save_path_2, view=top_view, size=image_size, flags=2, wireframe=False)
-            return save_path,save_path_2
-        return False
+    def SaveReport(self,job,object_list,file_path):
+        #Job sheet next to the program, drawn from the toolpaths without the viewports
+        report = job.GetReport(object_list,os.path.basename(file_path))
+        base = os.path.splitext(file_path)[0]
+        saved_files = [report.save_svg('%s_sheet.svg' % base)]
+        try: saved_files.append(report.save_png('%s_sheet.png' % base))
+        except Exception as e: self.ConsoleLog('%s: %s' % (self.txt('Error en la imagen'),e))
+        return saved_files
     # Create all of the functions used by controls
     
-    def ExtractCeroPoint(self):
-         #Gets cero point from rhino objects and deletes it from self list
-        rhino_objects = self.rhino_objects
-        if "cero_point" in rhino_objects.iterkeys():
-            cero_point = rhino_objects["cero_point"]
-            del rhino_objects["cero_point"]
-        else: cero_point = (0,0,0)
-        #Add tag to new cero
-        dot = rs.AddTextDot("+",cero_point)
-        rs.ObjectLayer(dot,self.layer_sorting)
-        rs.ObjectColor(dot,(200,200,200))
-        return cero_point,rhino_objects
-    
-    def GetModelObjects(self):
-        model_objects = {}
-        cero_point,rhino_objects = self.ExtractCeroPoint()
-        for colorcode, objects in rhino_objects.iteritems():
-            if objects:
-                model_objects[colorcode] =[]
-                preset = self.machining_settings[self.user_data["selected_preset"]]
-                post = self.postprocessors[self.user_data['post']]
-                general_settings = preset['cnc'] # or else use gooold --> self.general_settings
-                for rh_object in objects:
-                    if rs.IsObject(rh_object):
-                        if colorcode == "points":
-                            color = rs.ObjectColor(rh_object)
-                            rgb = (rs.ColorRedValue(color),rs.ColorGreenValue(color),rs.ColorBlueValue(color))
-                            if rgb == (0,255,0):
-                                print('verde')
-                            curve = g_curve(rh_object,preset["barrenado"],general_settings,0,False,cero_point,colorcode,post)
-                        if colorcode == "curves_open":
-                            curve = g_curve(rh_object,preset["grabado"],general_settings,0,False,cero_point,colorcode,post)
-                        if colorcode == "curves_pocketing":
-                            curve = g_curve(rh_object,preset["desbaste"],general_settings,-1,True,cero_point,colorcode,post)
-                            #rs.ObjectLayer(curve.cut_curve,self.preview_layer_name)
-                        if colorcode == "curves_outside":
-                            curve = g_curve(rh_object,preset["corte"],general_settings,1,False,cero_point,colorcode,post)
-                            #rs.ObjectLayer(curve.cut_curve,self.preview_layer_name)
-                        if colorcode == "curves_inside":
-                            curve = g_curve(rh_object,preset["corte"],general_settings,-1,False,cero_point,colorcode,post)
-                            #rs.ObjectLayer(curve.cut_curve,self.preview_layer_name)
-                        model_objects[colorcode].append(curve)
-        return model_objects
-    
-    def GetSortedObjectsList(self):
-        
-        object_list = []
-        for type,objects in self.model_objects.items():
-            for obj in objects:
-                point = obj.start_point
-                object_list.append([obj,point[0],point[1]])
-        return [i[0] for i in sorted(object_list, key = operator.itemgetter(2, 1))]
-    
-    def GetObjectsList(self):
-        object_list = []
-        for type,objects in self.model_objects.items():
-            for obj in objects:
-                object_list.append(obj)
-        return object_list
-    
     def GetRhinoNameList(self):
         try:
             object_list = []
@@ -799,126 +852,69 @@ class camDialog(forms.Form):
             return object_list
         except Exception as e: print(e)
     
-    def SortClosest(self,rh_objects):
-
-        closest_list = []
-        test_object = rh_objects[0]
-        closest_list.append(test_object)
-        while True:
-            if len(rh_objects) == 0:
-                break
-            rh_objects.pop(rh_objects.index(test_object))
-            if len(rh_objects) == 0:
-                break
-            closest_point_index = rs.PointArrayClosestPoint([i.start_point for i in rh_objects],test_object.point)
-            closest_object = rh_objects[closest_point_index]
-            closest_list.append(closest_object)
-            test_object = closest_object
-        return closest_list
-
-    
-    def SortClusters(self,object_list):
-        outside_curves = [obj for obj in object_list if obj.cam_type == 'curves_outside']
-        test_curves = [obj for obj in object_list if obj.cam_type != 'curves_outside']     
-        cluster_list = []
-        count = 0
-        for out_crv in outside_curves:
-            
-            for test_crv in test_curves:
-                if rs.PointInPlanarClosedCurve(test_crv.point,out_crv.curve) and test_crv not in cluster_list:
-                    cluster_list.append(test_crv)
-                    test_crv.asignedcluster = count
-                    out_crv.iscluster = True
-            if out_crv.iscluster:
-                out_crv.asignedcluster = count
-                cluster_dot = rs.AddTextDot("%s: %s"% (self.txt('Pieza'),count),out_crv.point)
-                rs.ObjectLayer(cluster_dot,self.layer_cluster)
-                count+=1
-            cluster_list.append(out_crv)
-            
-        for test_crv in test_curves:
-            if test_crv not in cluster_list: cluster_list.append(test_crv)
-        
-        return cluster_list
-    
-    def GetGCodeString(self,object_list):
-        gcode = []
-        post = self.postprocessors[self.user_data['post']]
-        if post["header"]: gcode += post["header"]
-        
-        general_settings = self.machining_settings[self.user_data["selected_preset"]]['cnc'] # or else use good old self.general_settings
-        
-        if post['spindle']: gcode.append('%s%s' % (post['spindle'],int(general_settings['spindle'])))
-        gcode.append("%s Z%s %s%s" % (post['rapid'],general_settings["sec_plane"],post['feed'],int(general_settings["feed_rapid"])))
-
-        for obj in object_list:
-            gcode += obj.gcode
-        if post["footer"]: gcode += post["footer"]
-        return gcode
-    
-    def GetGCodeTime(self,object_list):
-        gcode_time = 0
-        last_point = False
-        for obj in object_list:
-            obj_time,last_point = obj.get_cut_time(last_point)
-            gcode_time+= obj_time
-        return round(gcode_time*60/100,2)
-            
-    def SetProgressBar(self,index):
-        value = int(((index+1)*self.progressbar.MaxValue)/self.objects_count)
+    def SetProgressBar(self,index,count):
+        value = int(((index+1)*self.progressbar.MaxValue)/count)
         if self.progressbar.Value != value:
             self.progressbar.Value = value    
             rs.Redraw()
         
     def SetObjectsByColor(self,objects):
         if not objects: return False
-        points = []
-        cero_point = False
-        curves_inside = []
-        curves_outside = []
-        curves_open = []
-        curves_pocketing = []
-        curve_material = False
-        obj_count = 0
-        valid_objects = []
-        for object in objects:
-            if rs.IsCurve(object):
-                color = rs.ObjectColor(object)
-                rgb = (rs.ColorRedValue(color),rs.ColorGreenValue(color),rs.ColorBlueValue(color))
-                if rs.IsCurveClosed(object):
-                    if rgb == (0,0,255):
-                        obj_count += 1
-                        curves_inside.append(object)
-                    if rgb == (255,0,0):
-                        obj_count += 1
-                        curves_outside.append(object)
-                    if rgb == (255,0,255):
-                        obj_count += 1
-                        curves_pocketing.append(object)
-                if rgb == (0,255,0):
-                    obj_count += 1
-                    curves_open.append(object)
-                
-                valid_objects.append(object)
-            if rs.IsPoint(object):
-                color = rs.ObjectColor(object)
-                rgb = (rs.ColorRedValue(color),rs.ColorGreenValue(color),rs.ColorBlueValue(color))
-                if rgb == (255,255,255):
-                    cero_point = object
-                else:
-                    points.append(object)
-                    obj_count += 1
-                valid_objects.append(object)
-                
-        if obj_count:
-            self.rhino_objects = {"points":points,"curves_open":curves_open,"curves_pocketing":curves_pocketing,"curves_inside":curves_inside,"curves_outside":curves_outside,"curve_material":curve_material}
-            if cero_point: self.rhino_objects['cero_point'] = cero_point
+        rhino_objects,valid_objects = get_objects_by_color(objects)
+        if rhino_objects: self.rhino_objects = rhino_objects
         
         #Uncomment if using old selection method
         #self.SelectObjectsText.Text = '%s %s' % (obj_count, self.txt('Objetos agregados'))
         
         return valid_objects
     
+    def import_file(self,sender,e):
+        file_path = rs.OpenFileName(self.txt('Importar DXF/SVG'),'DXF/SVG (*.dxf;*.svg)|*.dxf;*.svg||',self.user_data['file_path'] or None)
+        if not file_path: return
+        rs.EnableRedraw(False)
+        try:
+            importer = g_importer(file_path,'%s_Import' % self.plugin_name)
+            objects = importer.run()
+        except Exception as e:
+            rs.EnableRedraw(True)
+            self.ConsoleLog('Error: %s' % e)
+            return
+        rs.UnselectAllObjects()
+        if objects: rs.SelectObjects(objects)
+        rs.EnableRedraw(True)
+        self.ConsoleLog('%s: %s' % (self.txt('Objetos importados'),len(objects)))
+        if importer.skipped: self.ConsoleLog('%s: %s' % (self.txt('Entidades ignoradas'),', '.join('%s (%s)' % (kind,count) for kind,count in sorted(importer.skipped.items()))))
+    
+    def GetJob(self,profiler=False):
+        return camJob(self.machining_settings,self.postprocessors,self.user_data,self.rhino_objects,self.plugin_name,self.command_name,self.ConsoleLog,self.txt,self.SetProgressBar,profiler)
+    
+    def SaveMetrics(self,job,object_list):
+        #The metrics log never stops the code from being saved
+        try: append_metrics(self.metrics_file,job.GetMetrics(object_list))
+        except Exception as e: self.ConsoleLog('%s: %s' % (self.txt('Error en el registro de metricas'),e))
+    
+    def show_metrics(self,sender,e):
+        records = read_metrics([self.metrics_file],30)
+        if not records:
+            self.ConsoleLog(self.txt('Sin registros en los ultimos 30 dias'))
+            return
+        for group_by in ('preset','operation'):
+            self.ConsoleLog('%s (%s, 30 %s):' % (self.txt('Estadisticas'),self.txt(group_by),self.txt('dias')))
+            for name,row in summarize_metrics(records,group_by):
+                self.ConsoleLog('  %s: %s %s, %s %s, %s s, %s min' % (name,row['runs'],self.txt('trabajos'),row['objects'],self.txt('objetos'),
+                                                                     round(row['compute_s'],1),round(row['machine_min'],1)))
+        self.ConsoleLog('%s (%s):' % (self.txt('Estadisticas'),self.txt('semana')))
+        for (week,name),row in summarize_metrics(records,'preset','week'):
+            self.ConsoleLog('  %s %s: %s %s, %s min' % (week,name,row['runs'],self.txt('trabajos'),round(row['machine_min'],1)))
+    
+    def LogProfile(self,profiler,file_path):
+        trace_path = profiler.save('%s_profile.json' % os.path.splitext(file_path)[0])
+        self.ConsoleLog('%s: %s' % (self.txt('Perfil guardado'),trace_path))
+        for name,calls,milliseconds in profiler.get_hot_spots():
+            self.ConsoleLog('  %s x%s: %s ms' % (name,calls,milliseconds))
+        self.ConsoleLog('  %s' % ', '.join('%s %s' % (name,value) for name,value in profiler.counters.items()))
+        self.ConsoleLog('  %s: %s MB' % (self.txt('Memoria maxima'),round(profiler.memory_peak/1048576.0,1)))
+    
     def make_code(self,sender,e):
         
         rgbobjs = self.SetObjectsByColor(rs.SelectedObjects())
@@ -928,33 +924,252 @@ class camDialog(forms.Form):
         try:
             if not self.CheckPreconditions(): return
             file_path = self.SelectFileName()
-            rs.EnableRedraw(False)
-            self.AddPreviewLayers()
-            
-            self.model_objects = self.GetModelObjects()
-            object_list = self.GetSortedObjectsList() if self.user_data['sorting'] else self.GetObjectsList()
-            if self.user_data['sort_closest']: object_list = self.SortClosest(object_list)
-            if self.user_data['autocluster']: object_list = self.SortClusters(object_list)
-            self.objects_count = len(object_list)
-            for obj in object_list:
-                index = object_list.index(obj)
-                sort_dot = rs.AddTextDot(str(index +1),obj.start_point)
-                rs.ObjectLayer(sort_dot,self.layer_sorting)
-                obj.process()
-                rs.ObjectLayer(obj.preview,self.layer_preview)
-                self.SetProgressBar(index)
-            rs.EnableRedraw(True)
-           
-            if self.user_data['save_image']: self.SaveImages(file_path)
-            gcode = '\n'.join(self.GetGCodeString(object_list))
-            gcode_time = self.GetGCodeTime(object_list)
-            with open(file_path,'w') as f:
-                f.write(gcode)
-            self.ConsoleLog('%s: %s' % (self.txt('Archivo guardado'),file_path))
+            self.user_data['job_server'] = self.job_server_input.Text.strip()
+            if self.user_data['job_server']: return self.RunServerJob(file_path)
+            #Stage timers are always kept for the metrics log, the method wrappers only when profiling
+            profiler = g_profiler()
+            if self.user_data['profile']: profiler.install()
+            try:
+                rs.EnableRedraw(False)
+                job = self.GetJob(profiler)
+                object_list = job.Process()
+                self.model_objects = job.model_objects
+                self.objects_count = len(object_list)
+                self.last_objects = dict((str(item),obj) for obj in object_list for item in obj.chain or [obj.curve])
+                rs.EnableRedraw(True)
+                
+                saved_files = job.WriteGCode(object_list,file_path)
+                with profiler.span('cut_time'): gcode_time = job.GetGCodeTime(object_list)
+                if self.user_data['save_image']: report_files = self.SaveReport(job,object_list,file_path)
+            finally:
+                profiler.uninstall()
+            self.ConsoleLog('%s: %s' % (self.txt('Archivo guardado'),saved_files[-1]))
+            if len(saved_files) > 2: self.ConsoleLog('%s: %s' % (self.txt('Programa dividido en archivos'),len(saved_files)-1))
+            if self.user_data['save_image']: self.ConsoleLog('%s: %s' % (self.txt('Hoja de trabajo'),', '.join([os.path.basename(path) for path in report_files])))
             self.ConsoleLog('%s: %s %s' % (self.txt('Tiempo de corte aproximado'),gcode_time,self.txt('minutos')))
+            if job.congruent_count: self.ConsoleLog('%s: %s/%s' % (self.txt('Piezas iguales reutilizadas'),job.congruent_count,self.objects_count))
+            self.LogDuplicates(job)
+            if job.chains: self.ConsoleLog('%s: %s (%s %s)' % (self.txt('Cadenas de grabado'),len(job.chains),sum([len(items) for items in job.chains.values()]),self.txt('curvas')))
+            if job.loop_count: self.ConsoleLog('%s: %s' % (self.txt('Niveles escritos una sola vez'),job.loop_count))
+            if job.rest_count: self.ConsoleLog('%s: %s' % (self.txt('Regiones de restos'),job.rest_count))
+            if job.common_count: self.ConsoleLog('%s: %s' % (self.txt('Piezas con corte comun'),job.common_count))
+            if job.cached_count: self.ConsoleLog('%s: %s/%s' % (self.txt('Trayectorias reutilizadas'),job.cached_count,self.objects_count))
+            tool_changes = job.GetToolChanges(object_list)
+            if tool_changes: self.ConsoleLog('%s: %s' % (self.txt('Cambios de herramienta'),tool_changes))
+            if self.user_data['profile']: self.LogProfile(profiler,file_path)
+            self.SaveMetrics(job,object_list)
         except Exception as e:
             print(e)
-            
+    
+    def LogDuplicates(self,job):
+        #Ids go to the command line so the copies can be found and deleted
+        if job.duplicates:
+            self.ConsoleLog('%s: %s' % (self.txt('Duplicados ignorados'),len(job.duplicates)))
+            print('%s: %s' % (self.txt('Duplicados ignorados'),', '.join([str(item) for item in job.duplicates])))
+        if job.overlaps:
+            self.ConsoleLog('%s: %s' % (self.txt('Lineas traslapadas'),len(set(job.overlaps))))
+            print('%s: %s' % (self.txt('Lineas traslapadas'),', '.join([str(item) for item in set(job.overlaps)])))
+    
+    def quote_code(self,sender,e):
+        #Time estimate of the selection without file, preview or program
+        if not self.SetObjectsByColor(rs.SelectedObjects()):
+            self.ConsoleLog(self.txt('Error: Selecciona al menos una curva'))
+            return
+        if not self.CheckPreconditions(): return
+        try:
+            rs.EnableRedraw(False)
+            job = self.GetJob()
+            quote = job.Quote()
+        except Exception as e:
+            self.ConsoleLog('Error: %s' % e)
+            return
+        finally:
+            rs.EnableRedraw(True)
+        cached = ' (%s)' % self.txt('guardada') if quote['cached'] else ''
+        self.ConsoleLog('%s%s: %s %s, %s %s' % (self.txt('Cotizacion'),cached,round(quote['minutes'],1),self.txt('minutos'),quote['objects'],self.txt('objetos')))
+        self.ConsoleLog(', '.join(['%s %s' % (self.txt(OPERATION_NAMES.get(name,name)),round(minutes,1)) for name,minutes in sorted(quote['operations'].items())]))
+        clusters = sorted([(int(name),minutes) for name,minutes in quote['clusters'].items()])
+        self.ConsoleLog(', '.join(['%s %s' % ('%s %s' % (self.txt('Pieza'),name) if name >= 0 else self.txt('Sin pieza'),round(minutes,1)) for name,minutes in clusters]))
+        self.LogDuplicates(job)
+    
+    def GetSweepGrid(self):
+        #Values around the preset for the operations of the selection, as section.name=value,value;...
+        preset = self.machining_settings[self.user_data['selected_preset']]
+        sections = set([PRESET_SECTIONS[colorcode] for colorcode,items in self.rhino_objects.items() if items and colorcode in PRESET_SECTIONS])
+        grid = []
+        for section,name in (('desbaste','xy_dist'),('desbaste','entries'),('desbaste','circular_pocketing'),('corte','entries'),('corte','plunge')):
+            if section not in sections: continue
+            value = preset[section].get(name,0)
+            if name == 'xy_dist': values = [round(value*.75,2),value,min(round(value*1.25,2),.9)]
+            elif name == 'entries': values = [max(1,value-1),value,value+1]
+            elif name == 'plunge': values = [round(value*.5,1),value,value*2]
+            else: values = [0,1]
+            if isinstance(value,int): values = [int(round(item)) for item in values]
+            grid.append('%s.%s=%s' % (section,name,','.join([str(item) for item in sorted(set(values))])))
+        return '; '.join(grid)
+    
+    def GetSweepValue(self,preset,section,name,value):
+        #The value checked like the settings dialog does and with the type the preset keeps for the field.
+        #Counts and (0,1) switches only take whole numbers.
+        current = preset[section].get(name,0.0)
+        label = dict(self.machining_input['MACHINING_INPUT'].get(section,[])).get(name,'')
+        number = float(value)
+        switch = '(0,1)' in label
+        whole = switch or isinstance(current,int) or name in SWEEP_WHOLE_FIELDS
+        if whole and number != int(number) or switch and number not in (0,1): raise ValueError('%s.%s=%s' % (section,name,value))
+        number = self.ValidateData(number,name)
+        return type(current)(number) if isinstance(current,(int,float)) else number
+    
+    def ParseSweepGrid(self,text,preset):
+        #{(section,name):[values]}, ValueError for unknown sections and values that are not numbers of the field type
+        grid = OrderedDict()
+        for item in text.split(';'):
+            if not item.strip(): continue
+            key,values = item.split('=')
+            section,name = key.strip().split('.')
+            if section not in preset: raise ValueError('%s.%s' % (section,name))
+            grid[(section,name)] = [self.GetSweepValue(preset,section,name,value.strip()) for value in values.split(',')]
+        return grid
+    
+    def sweep_presets(self,sender,e):
+        #Compares preset variants on the selection and saves the fastest one as a new preset
+        if not self.SetObjectsByColor(rs.SelectedObjects()):
+            self.ConsoleLog(self.txt('Error: Selecciona al menos una curva'))
+            return
+        if not self.CheckPreconditions(): return
+        text = rs.StringBox(self.txt('Valores a comparar (seccion.variable=valor,valor;...)'),self.GetSweepGrid(),self.txt('Optimizar rutina'))
+        if not text: return
+        try:
+            grid = self.ParseSweepGrid(text,self.machining_settings[self.user_data['selected_preset']])
+            if reduce(operator.mul,[len(values) for values in grid.values()],1) > SWEEP_MAX_VARIANTS: raise ValueError(self.txt('Demasiadas variantes'))
+            rs.EnableRedraw(False)
+            rows = self.GetJob().Sweep(grid)
+        except Exception as e:
+            self.ConsoleLog('Error: %s' % e)
+            return
+        finally:
+            rs.EnableRedraw(True)
+        #Every variant goes to the command line, the made ones with their real time, the best one to the console
+        for row in rows:
+            made = '%s min, %s %s, %s %s, ' % (round(row['minutes'],2),row['retracts'],self.txt('retracciones'),row['lines'],self.txt('lineas')) if 'minutes' in row else ''
+            print('%s%s %s min: %s' % (made,self.txt('estimado'),round(row['estimate'],2),', '.join(['%s.%s=%s' % (section,name,value) for (section,name),value in row['changes'].items()])))
+        best = rows[0]
+        self.ConsoleLog('%s: %s %s (%s)' % (self.txt('Variantes'),len(rows),self.txt('evaluadas'),self.txt('ver linea de comandos')))
+        self.ConsoleLog('%s: %s min, %s %s, %s %s' % (self.txt('Mejor'),best['minutes'],best['retracts'],self.txt('retracciones'),best['lines'],self.txt('lineas')))
+        self.ConsoleLog(', '.join(['%s.%s=%s' % (section,name,value) for (section,name),value in best['changes'].items()]))
+        if rs.MessageBox(self.txt('Guardar la mejor variante como rutina nueva?'), 4 | 32) != 6: return
+        new_settings = best['preset']
+        new_settings['descripcion'] = ', '.join(['%s.%s=%s' % (section,name,value) for (section,name),value in best['changes'].items()])
+        new_name = self.ValidateName('%s %s' % (self.user_data['selected_preset'],self.txt('optimizada')),self.machining_settings)
+        self.machining_settings[new_name] = new_settings
+        self.user_data['selected_preset'] = new_name
+        self.UpdateSettingsDropdown()
+        self.ConsoleLog('%s: %s' % (self.txt('Rutina actualizada'),new_name))
+    
+    def GetServerJobData(self):
+        #Selected geometry as JSON with the preset and postprocessor in use
+        objects = {}
+        for colorcode,items in self.rhino_objects.items():
+            if colorcode in ('cero_point','curve_material') or not items: continue
+            objects[colorcode] = [rs.coercegeometry(item).ToJSON(None) for item in items if rs.IsObject(item)]
+        cero_point = self.rhino_objects.get('cero_point')
+        return {'preset':self.user_data['selected_preset'],
+                'post':self.user_data['post'],
+                'preset_data':self.machining_settings[self.user_data['selected_preset']],
+                'post_data':self.postprocessors[self.user_data['post']],
+                'options':dict((name,self.user_data[name]) for name in JOB_OPTIONS if name not in ('use_cache','preview_mode')),
+                'objects':objects,
+                'cero_point':list(rs.PointCoordinates(cero_point)) if cero_point else None}
+    
+    def ServerRequest(self,path,data=None):
+        request = urllib2.Request(self.user_data['job_server'].rstrip('/') + path,json.dumps(data) if data is not None else None,{'Content-Type':'application/json'})
+        return json.loads(urllib2.urlopen(request,timeout=30).read())
+    
+    def RunServerJob(self,file_path):
+        #Sends the selection to the job server and waits for the program, Esc stops waiting
+        try:
+            job_id = self.ServerRequest('/jobs',self.GetServerJobData())['id']
+            self.ConsoleLog('%s: %s' % (self.txt('Trabajo enviado al servidor'),job_id))
+            while True:
+                job = self.ServerRequest('/jobs/%s' % job_id)
+                if job['status'] in ('done','error'): break
+                if sc.escape_test(False):
+                    self.ConsoleLog(self.txt('Espera cancelada'))
+                    return
+                time.sleep(.5)
+        except urllib2.URLError as e:
+            self.ConsoleLog('Error: %s: %s' % (self.txt('Servidor'),e))
+            return
+        if job['status'] == 'error':
+            self.ConsoleLog('Error: %s' % job['message'])
+            return
+        with open(file_path,'w') as f:
+            f.write(job['gcode'])
+        self.ConsoleLog('%s: %s' % (self.txt('Archivo guardado'),file_path))
+        self.ConsoleLog('%s: %s %s' % (self.txt('Tiempo de corte aproximado'),job['time'],self.txt('minutos')))
+        if job['tool_changes']: self.ConsoleLog('%s: %s' % (self.txt('Cambios de herramienta'),job['tool_changes']))
+    
+    def GetSavedFiles(self):
+        #Program files of the last saved code in run order, read from the manifest when it was split
+        if not self.user_data['file_path'] or not self.user_data['file_name']: return []
+        file_path = os.path.join(self.user_data['file_path'],self.user_data['file_name'])
+        manifest_path = '%s_manifest.json' % os.path.splitext(file_path)[0]
+        manifest = self.read_json_file(manifest_path)
+        if manifest and os.path.getmtime(manifest_path) >= (os.path.getmtime(file_path) if os.path.isfile(file_path) else 0):
+            return [os.path.join(self.user_data['file_path'],chunk['file']) for chunk in manifest['files']]
+        return [file_path] if os.path.isfile(file_path) else []
+    
+    def AskOnUi(self,text,buttons):
+        #Message boxes open on the UI thread, the sender thread waits for the answer
+        answer = []
+        forms.Application.Instance.Invoke(System.Action(lambda: answer.append(rs.MessageBox(text,buttons))))
+        return answer[0] if answer else None
+    
+    def OnSenderHold(self,reason):
+        return self.AskOnUi('%s: %s\n%s' % (self.txt('Pausa (feed hold)'),reason,self.txt('Continuar?')), 4 | 32) == 6
+    
+    def SenderLog(self,text):
+        #Called from the sender thread, the console is updated on the UI thread
+        forms.Application.Instance.AsyncInvoke(System.Action(lambda: self.ConsoleLog(text)))
+    
+    def send_code(self,sender,e):
+        #While a program is streaming the same button stops it
+        if self.sender_thread and self.sender_thread.is_alive():
+            self.sender_stop.set()
+            return
+        files = self.GetSavedFiles()
+        if not files:
+            self.ConsoleLog('Error: %s' % self.txt('Primero genera el codigo'))
+            return
+        self.user_data['serial_port'] = self.serial_port_input.Text.strip()
+        try: self.user_data['baudrate'] = int(self.baudrate_input.Text)
+        except ValueError: pass
+        self.sender_stop.clear()
+        self.send_button.Text = self.txt('Detener envio')
+        self.sender_thread = threading.Thread(target=self.SendFiles,args=(files,self.user_data['serial_port'],self.user_data['baudrate']))
+        self.sender_thread.daemon = True
+        self.sender_thread.start()
+    
+    def SendFiles(self,files,port_name,baudrate):
+        #Runs on the sender thread so the blocking port reads never freeze Rhino
+        port = None
+        try:
+            port = g_serial_port(port_name,baudrate)
+            grbl = g_sender(port,self.SenderLog,self.txt,self.sender_stop.is_set,self.OnSenderHold)
+            grbl.wake_up()
+            for file_path in files:
+                if file_path != files[0] and self.AskOnUi('%s: %s' % (self.txt('Siguiente archivo'),os.path.basename(file_path)), 1 | 32) != 1: break
+                with open(file_path,'r') as f:
+                    total = sum(1 for line in f)
+                    f.seek(0)
+                    self.SenderLog('%s: %s' % (self.txt('Enviando'),os.path.basename(file_path)))
+                    if not grbl.stream(f,total): break
+            self.SenderLog('%s: %s %s, %s %s' % (self.txt('Envio terminado') if not grbl.stopped else self.txt('Envio detenido'),grbl.acknowledged,self.txt('lineas'),len(grbl.errors),self.txt('errores')))
+        except Exception as e:
+            self.SenderLog('Error: %s' % e)
+        finally:
+            if port: port.close()
+            forms.Application.Instance.AsyncInvoke(System.Action(lambda: setattr(self.send_button,'Text',self.txt('Enviar a GRBL'))))
     
     def edit_postprocessors(self,sender,e):
         self.CreatePostprocessor(edit=True)
@@ -984,6 +1199,23 @@ class camDialog(forms.Form):
         for name,value in self.general_inputs.items():
             self.general_settings[name] = value['input'].Value
             
+    def set_preview_mode(self,sender,e):
+        self.user_data['preview_mode'] = PREVIEW_MODES.keys()[self.preview_mode_input.SelectedIndex]
+    
+    def show_detail(self,sender,e):
+        #Full toolpath of the selected curves of the last code
+        objects = [self.last_objects[str(item)] for item in rs.SelectedObjects() or [] if str(item) in self.last_objects]
+        if not objects:
+            self.ConsoleLog(self.txt('Selecciona curvas del ultimo codigo generado'))
+            return
+        rs.EnableRedraw(False)
+        rs.LayerLocked(self.layer_preview,False)
+        for obj in objects:
+            obj.set_preview('full')
+            if obj.preview: rs.ObjectLayer(obj.preview,self.layer_preview)
+        rs.LayerLocked(self.layer_preview,True)
+        rs.EnableRedraw(True)
+    
     def set_user_data(self,sender,e):
         for name,value in self.checkbox_inputs.items():
             self.user_data[name] = True if value.Checked else False
@@ -1176,73 +1408,2663 @@ class editDialog(forms.Dialog[bool]):
             return self.language_text[txt][self.language]
     ## End of Dialog Class ##
 
-class g_curve():    
-    def __init__(self,curve,input_data,general_input,compensation,pocketing,cero_point,cam_type=False,post=False):
-        #Initial needed values
-        self.input_data = input_data
-        self.general_input = general_input
-        self.compensation = compensation
-        self.pocketing = pocketing
-        self.curve  = curve #Original curve nothing modifies it, the self.nurbs_curve is used.
-        self.nurbs_curve  = curve
-        self.cero_point = cero_point
-        self.cam_type = cam_type
-        self.post = post if post else self.get_default_post()
-        #Calculated outside values
-        self.asignedcluster = -1
-        self.iscluster = False
-        #Some other values
-        self.color_palette = {"cut":(153,204,255),"plunge":(254,184,0),"point":(153,204,255),"rapid":(200,200,200)}
-        self.geometry_type = "point"  if rs.IsPoint(self.nurbs_curve) else "curve" if rs.IsCurveClosed(self.nurbs_curve) else "open_curve" 
-        self.point = self.curve if rs.IsPoint(self.nurbs_curve) else rs.CurveAreaCentroid(self.nurbs_curve)[0] if rs.IsCurveClosed(self.nurbs_curve) else rs.CurveStartPoint(self.nurbs_curve)   # Centroide curva original
-        self.start_point = rs.PointCoordinates(self.nurbs_curve,False) if rs.IsPoint(self.nurbs_curve) else rs.CurveStartPoint(self.nurbs_curve)
-        self.cut_curve = self.get_cut_curve()
-        self.gcode_points = []
-        self.time = 0
-        
-    def get_default_post(self):
-        return {
-            "footer": [
-                "M5"
-            ], 
-            "feed": "F", 
-            "description": "Arduino GRBL\r\nTinyG ", 
-            "round_tol": 2, 
-            "cut": "G01", 
-            "spindle": "", 
-            "rapid": "G00", 
-            "header": [
-                "G21", 
-                "G90", 
-                "G54", 
-                "M3"
-            ]
-        }
+#Functions of rhinoscriptsyntax that add or remove document objects, counted by the profiler
+PROFILE_RS_CALLS = ("AddLine","AddPolyline","AddCurve","AddArc3Pt","AddCircle","AddPoint","AddTextDot","CopyObject","CopyObjects",
+                    "OffsetCurve","JoinCurves","ExplodeCurves","SplitCurve","ExtendCurveLength","DeleteObject","DeleteObjects")
+#Methods of g_curve timed by the profiler
+PROFILE_CURVE_METHODS = ("process","get_cut_curve","OffsetCurve","get_cut_path_closed","get_cut_path_open","get_cut_path_point",
+                         "make_pocket_curves","get_g_code","get_drill_code")
+
+class g_profiler(object):
+    #Stage timers and document counters of one job, saved as a Chrome trace (chrome://tracing or ui.perfetto.dev).
+    #Disabled profilers do nothing so the pipeline can always call them, the method wrappers only run once installed.
     
-    def round_point(self,point):
-        return (round(point[0],self.post['round_tol']),round(point[1],self.post['round_tol']),round(point[2],self.post['round_tol'])) 
+    def __init__(self,enabled=True):
+        self.enabled = enabled
+        self.events = []
+        self.counters = OrderedDict()
+        self.totals = {}
+        self.stages = OrderedDict()
+        self.memory_peak = 0
+        self.patched = []
+        self.clock = System.Diagnostics.Stopwatch.StartNew() if enabled else None
     
-    def process(self):
-        
-        if rs.IsPoint(self.nurbs_curve):
-            self.preview = self.get_cut_path_point(self.cut_curve)
-        elif self.compensation == 0:# and not rs.IsCurveClosed(self.nurbs_curve):
-            self.preview =  self.get_cut_path_open(self.cut_curve) 
-
-        else:
-            if self.input_data["finish_pass"] and not self.input_data["finish_entries"]:
-                #Creates a finishing pass on the last level
-                self.preview =  self.get_cut_path_closed(self.cut_curve,finish_pass=self.input_data["finish_pass"])
-            elif self.input_data["finish_pass"]:
-                #Creates a finishing pass equal to the cut curve but with a different offset
-                 crv_finish_offset = self.get_cut_curve(self.compensation,(self.general_input['cut_diam']*.5)+self.input_data["finish_pass"])
+    def now(self):
+        #Microseconds since the job started
+        return self.clock.Elapsed.TotalMilliseconds*1000
+    
+    def memory(self):
+        memory = System.GC.GetTotalMemory(False)
+        if memory > self.memory_peak:
+            self.memory_peak = memory
+            self.events.append({"name":"memory","ph":"C","ts":self.now(),"pid":1,"tid":1,"args":{"MB":round(memory/1048576.0,2)}})
+        return memory
+    
+    def count(self,name,value=1):
+        if self.enabled: self.counters[name] = self.counters.get(name,0) + value
+    
+    def add_span(self,name,category,start,args):
+        duration = self.now() - start
+        self.events.append({"name":name,"cat":category,"ph":"X","ts":start,"dur":duration,"pid":1,"tid":1,"args":args})
+        calls,total = self.totals.get(name,(0,0))
+        self.totals[name] = (calls+1,total+duration)
+        if category == 'stage': self.stages[name] = self.stages.get(name,0) + duration/1000.0
+        self.memory()
+    
+    @contextmanager
+    def span(self,name,category='stage',**args):
+        if not self.enabled:
+            yield
+            return
+        start = self.now()
+        try: yield
+        finally: self.add_span(name,category,start,args)
+    
+    def counted(self,name,function):
+        profiler = self
+        def wrapper(*args,**kwargs):
+            #Lists of objects count one per object
+            value = len(args[0]) if name.endswith('Objects') and args and isinstance(args[0],(list,tuple)) else 1
+            profiler.count(name,value)
+            return function(*args,**kwargs)
+        return wrapper
+    
+    def timed(self,name,function):
+        profiler = self
+        def wrapper(obj,*args,**kwargs):
+            start = profiler.now()
+            try: return function(obj,*args,**kwargs)
+            finally: profiler.add_span(name,'g_curve',start,{'operation':obj.cam_type,'object':str(obj.curve)})
+        return wrapper
+    
+    def patch(self,owner,name,wrapper):
+        original = owner.__dict__[name] if isinstance(owner,type) else getattr(owner,name)
+        self.patched.append((owner,name,original))
+        setattr(owner,name,wrapper)
+    
+    def install(self):
+        #Wraps the hot functions until uninstall, only one profiled job may run at a time
+        if not self.enabled or self.patched: return
+        for name in PROFILE_RS_CALLS:
+            if hasattr(rs,name): self.patch(rs,name,self.counted(name,getattr(rs,name)))
+        for name in PROFILE_CURVE_METHODS:
+            self.patch(g_curve,name,self.timed('g_curve.%s' % name,g_curve.__dict__[name]))
+    
+    def uninstall(self):
+        for owner,name,original in reversed(self.patched): setattr(owner,name,original)
+        self.patched = []
+    
+    def get_hot_spots(self,count=5):
+        #(name,calls,milliseconds) of the spans that took the most time
+        spots = sorted(self.totals.items(),key=lambda item:item[1][1],reverse=True)[:count]
+        return [(name,calls,round(total/1000.0,1)) for name,(calls,total) in spots]
+    
+    def save(self,file_path):
+        self.memory()
+        other_data = dict(self.counters)
+        other_data['memory_peak_mb'] = round(self.memory_peak/1048576.0,2)
+        other_data['working_set_peak_mb'] = round(System.Diagnostics.Process.GetCurrentProcess().PeakWorkingSet64/1048576.0,2)
+        with open(file_path,'w') as f:
+            json.dump({"traceEvents":self.events,"displayTimeUnit":"ms","otherData":other_data},f)
+        return file_path
+
+class camJob(object):
+    #CAM pipeline of one selection without any form, used by the dialog and by the job server
+    
+    def __init__(self,machining_settings,postprocessors,user_data,rhino_objects,plugin_name=PLUGIN_NAME,command_name=COMMAND_NAME,log=False,translate=False,progress=False,profiler=False):
+        self.machining_settings = machining_settings
+        self.postprocessors = postprocessors
+        self.user_data = user_data
+        self.rhino_objects = dict(rhino_objects)
+        self.plugin_name = plugin_name
+        self.cache_section = "%s_cache" % command_name
+        self.quote_section = "%s_quote" % command_name
+        self.log = log
+        self.translate = translate
+        self.progress = progress
+        self.profiler = profiler or g_profiler(False)
+        #Preview layer names
+        self.layer_preview = 'CAM_Preview'
+        self.layer_sorting = "Tags orden"
+        self.layer_cluster = "Tags cluster"
+        #Closed curves on this layer are clamps or fixtures, links never cross them at the clearance plane
+        self.layer_fixtures = "CAM_Fixtures"
+        #Hidden layer with the engraving chains, see ChainOpenCurves
+        self.layer_chains = "CAM_Chains"
+        #Hidden layer with the pocket regions left for the rest tool, see GetRestRegions
+        self.layer_rest = "CAM_Rest"
+        self.cero_coordinates = (0,0,0)
+        self.preview_mode = user_data.get('preview_mode','full')
+        self.viewport = None
+        self.model_objects = None
+        self.congruent_count = 0
+        self.cached_count = 0
+        self.common_count = 0
+        #Objects left out by RemoveDuplicates
+        self.duplicates = []
+        self.overlaps = []
+        #Chain curve: joined open curves, and the cut order of the open curves when they are chained
+        self.chains = {}
+        self.chain_order = {}
+        #Rest regions made from each pocket
+        self.rest_count = 0
+        #Size of the last program made and its times
+        self.gcode_size = {'lines':0,'bytes':0,'files':0}
+        self.gcode_times = None
+        #Z level repetitions written once in the last program
+        self.loop_count = 0
+    
+    def txt(self,txt):
+        return self.translate(txt) if self.translate else txt
+    
+    def ConsoleLog(self,logText):
+        if self.log: self.log(logText)
+        else: print(logText)
+    
+    def Process(self):
+        #Makes the toolpath of every object and returns them in cut order
+        profiler = self.profiler
+        view = sc.doc.Views.ActiveView if self.preview_mode == 'top' else None
+        self.viewport = view.ActiveViewport if view else None
+        with profiler.span('preview_layers'): self.AddPreviewLayers()
+        with profiler.span('model_objects'): self.model_objects = self.GetModelObjects()
+        with profiler.span('sorting'): object_list = self.GetOrderedObjects()
+        with profiler.span('common_lines'):
+            self.common_count = self.SetCommonLines(object_list) if self.user_data.get('common_line',False) else 0
+        with profiler.span('congruent_parts'):
+            self.congruent_count = self.SetCongruentParts(object_list) if self.user_data.get('congruent_parts',False) else 0
+        self.cached_count = 0
+        for index,obj in enumerate(object_list):
+            if self.IsDotVisible(obj.start_point):
+                sort_dot = rs.AddTextDot(str(index +1),obj.start_point)
+                rs.ObjectLayer(sort_dot,self.layer_sorting)
+            with profiler.span('toolpath','object',index=index+1,operation=obj.cam_type,object=str(obj.curve)):
+                if obj.master:
+                    #Masters come first so their preview is already reduced
+                    obj.copy_master()
+                elif self.GetCachedToolpath(obj):
+                    self.cached_count += 1
+                    if self.preview_mode == 'top': obj.set_preview(self.preview_mode)
+                else:
+                    obj.process(self.preview_mode == 'full')
+                    self.SetCachedToolpath(obj)
+                    if self.preview_mode == 'top': obj.set_preview(self.preview_mode)
+            if obj.preview: rs.ObjectLayer(obj.preview,self.layer_preview)
+            profiler.count('toolpath_points',len(obj.points))
+            if self.progress: self.progress(index,len(object_list))
+        with profiler.span('cache_purge'): self.PurgeToolpathCache()
+        empty = [obj for obj in object_list if not obj.drill_cycle and not len(obj.points)]
+        if empty:
+            self.ConsoleLog('%s: %s' % (self.txt('Objetos sin trayectoria omitidos'),len(empty)))
+            object_list = [obj for obj in object_list if obj not in empty]
+        with profiler.span('links'): self.SetLinks(object_list)
+        return object_list
+    
+    def GetOrderedObjects(self):
+        #Model objects in cut order
+        object_list = self.GetSortedObjectsList() if self.user_data['sorting'] else self.GetObjectsList()
+        if self.user_data['sort_closest']: object_list = self.SortClosest(object_list)
+        if self.user_data['autocluster']: object_list = self.SortClusters(object_list)
+        return self.KeepChainOrder(self.SortTools(object_list))
+    
+    def Quote(self):
+        #Estimated minutes per operation and per part without toolpaths, preview or program, see g_curve.get_quote_times.
+        #Quotes are kept in the document by drawing and preset.
+        self.preview_mode = 'none'
+        self.model_objects = self.GetModelObjects()
+        object_list = self.GetOrderedObjects()
+        if not self.user_data['autocluster']: self.SortClusters(list(object_list))
+        preset = self.machining_settings[self.user_data['selected_preset']]
+        options = [self.user_data[name] for name in ('sorting','sort_closest','autocluster')]
+        key = hashlib.md5(json.dumps([CACHE_VERSION,self.GetGeometryHash(object_list),preset,options],sort_keys=True)).hexdigest()
+        cached = rs.GetDocumentData(self.quote_section,key)
+        if cached:
+            quote = json.loads(cached)
+            quote['cached'] = True
+            return quote
+        times = [0,0,0]
+        operations = {}
+        clusters = {}
+        for obj,link_time in zip(object_list,self.GetLinkTimes(object_list)):
+            obj_times = obj.get_quote_times()
+            obj_times[MOVE_RAPID] += link_time
+            minutes = sum(obj_times)*60/100
+            times = [total+obj_time for total,obj_time in zip(times,obj_times)]
+            operations[obj.cam_type] = operations.get(obj.cam_type,0) + minutes
+            clusters[str(obj.asignedcluster)] = clusters.get(str(obj.asignedcluster),0) + minutes
+        quote = {'objects':len(object_list),
+                 'minutes':sum(times)*60/100,
+                 'times':dict((name,times[kind]*60/100) for name,kind in MOVE_STATES.items()),
+                 'operations':operations,
+                 'clusters':clusters}
+        rs.SetDocumentData(self.quote_section,key,json.dumps(quote))
+        quote['cached'] = False
+        return quote
+    
+    def GetLinkTimes(self,object_list):
+        #Travel between the objects in the quote with the links of SetLinks from the curve ends. The objects start
+        #and end at the clearance plane, only the links that go up to the safe plane add the way up and down.
+        c = self.cero_coordinates
+        starts = [(obj.start_point[0]-c[0],obj.start_point[1]-c[1],0) for obj in object_list]
+        ends = [(point[0]-c[0],point[1]-c[1],0) for point in [obj.start_point if obj.geometry_type != "open_curve" else rs.CurveEndPoint(obj.curve) for obj in object_list]]
+        retracts = self.GetLinkRetracts(object_list,starts,ends)
+        times = [0] if object_list else []
+        for index in range(1,len(object_list)):
+            obj = object_list[index]
+            distance = rs.Distance(ends[index-1],starts[index]) + (2*(obj.sec_plane-obj.clear_plane) if retracts[index] else 0)
+            times.append(distance/obj.general_input['feed_rapid'])
+        return times
+    
+    def GetRetracts(self,object_list):
+        #Moves up to the safe plane, on the links and inside the toolpaths
+        retracts = len([obj for obj in object_list[1:] if obj.link_retract])
+        for obj in object_list:
+            toolpath = obj.toolpath
+            for index in range(1,len(toolpath)):
+                z = toolpath.point(index)[2]
+                if z >= obj.sec_plane - 1e-6 and z > toolpath.point(index-1)[2]: retracts += 1
+        return retracts
+    
+    def Sweep(self,grid,verify=3):
+        #Preset variants of the selected preset for every combination of the grid {(section,name):[values]}.
+        #All are ranked with the quote estimate and the fastest ones are made for real for their time, retracts
+        #and lines. Everything runs on copies of the selection in headless documents. Returns the rows, the made
+        #ones first and fastest first, then the rest by estimate.
+        base = self.machining_settings[self.user_data['selected_preset']]
+        geometry = self.GetSelectionGeometry()
+        rows = []
+        with headless_document() as doc:
+            job = self.GetHeadlessJob(doc,geometry,base)
+            job.AddPreviewLayers()
+            job.model_objects = job.GetModelObjects()
+            object_list = job.GetOrderedObjects()
+            link_minutes = sum(job.GetLinkTimes(object_list))*60/100
+            for values in itertools.product(*grid.values()):
+                changes = OrderedDict(zip(grid.keys(),values))
+                preset = json.loads(json.dumps(base))
+                for (section,name),value in changes.items(): preset[section][name] = value
+                minutes = link_minutes + sum([sum(obj.get_quote_times(job.GetSectionInput(preset,obj.cam_type))) for obj in object_list])*60/100
+                rows.append({'changes':changes,'preset':preset,'estimate':minutes})
+        rows.sort(key=lambda row:row['estimate'])
+        for index,row in enumerate(rows[:verify]):
+            if self.progress: self.progress(index,min(verify,len(rows)))
+            row.update(self.RunVariant(geometry,row['preset']))
+        rows[:verify] = sorted(rows[:verify],key=lambda row:row['minutes'])
+        return rows
+    
+    def GetSelectionGeometry(self):
+        #Copies of the selected geometry and the zero point, read from the document in use before another one is active
+        geometry = dict((colorcode,[rs.coercegeometry(item).Duplicate() for item in items if rs.IsObject(item)]) for colorcode,items in self.rhino_objects.items() if items and colorcode in PRESET_SECTIONS)
+        cero_point = self.rhino_objects.get('cero_point',(0,0,0))
+        return geometry,tuple(cero_point if isinstance(cero_point,tuple) else rs.PointCoordinates(cero_point))
+    
+    def GetHeadlessJob(self,doc,geometry,preset):
+        #Job on the selection copies added to the headless document, with the preset in place of the selected one
+        objects,cero_point = geometry
+        user_data = dict(self.user_data)
+        user_data.update({'selected_preset':'sweep','use_cache':False,'preview_mode':'none'})
+        rhino_objects = dict((colorcode,[doc.Objects.Add(item.Duplicate()) for item in items]) for colorcode,items in objects.items())
+        rhino_objects['cero_point'] = rs.AddPoint(cero_point)
+        return camJob({'sweep':preset},self.postprocessors,user_data,rhino_objects)
+    
+    def RunVariant(self,geometry,preset):
+        #Whole job with other preset settings, the document in use is not touched
+        with headless_document() as doc:
+            job = self.GetHeadlessJob(doc,geometry,preset)
+            object_list = job.Process()
+            gcode = job.GetGCodeString(object_list)
+            return {'minutes':job.GetGCodeTime(object_list),'lines':len(gcode),'retracts':job.GetRetracts(object_list)}
+    
+    def IsDotVisible(self,point):
+        #Order and cluster dots, only the ones inside the active view unless the preview is full
+        if self.preview_mode == 'full': return True
+        if self.preview_mode == 'none' or not self.viewport: return False
+        return self.viewport.IsVisible(rs.coerce3dpoint(point))
+    
+    def CleanLayer(self,layer,parent_layer=False):
+        if parent_layer: rs.LayerLocked(parent_layer,False)
+        if not rs.IsLayer(layer):rs.AddLayer(layer,parent=parent_layer)
+        else:
+            rs.LayerLocked(layer,False)
+            rs.DeleteObjects(rs.ObjectsByLayer(layer))
+        if parent_layer: rs.LayerLocked(parent_layer,True)
+        rs.LayerLocked(layer,True)
+    
+    def CleanHiddenLayer(self,layer):
+        #Layer of working curves made again on every run, hidden so they can not be selected
+        if not rs.IsLayer(layer): rs.AddLayer(layer,visible=False)
+        else: rs.DeleteObjects(rs.ObjectsByLayer(layer))
+    
+    def AddPreviewLayers(self):
+        self.CleanLayer(self.layer_preview)
+        self.CleanLayer(self.layer_cluster,self.layer_preview)
+        self.CleanLayer(self.layer_sorting,self.layer_preview)
+    
+    def GetCachedToolpath(self,obj):
+        #Loads the toolpath stored in the document if the geometry and the settings did not change
+        if not self.user_data['use_cache']: return False
+        data = rs.GetDocumentData(self.cache_section,self.GetCacheEntry(obj))
+        if not data: return False
+        data = json.loads(data)
+        if data.get('version') != CACHE_VERSION or data.get('key') != obj.get_cache_key(): return False
+        obj.load_cache(data,self.preview_mode == 'full')
+        return True
+    
+    def SetCachedToolpath(self,obj):
+        if not self.user_data['use_cache']: return
+        rs.SetDocumentData(self.cache_section,self.GetCacheEntry(obj),json.dumps(obj.dump_cache()))
+    
+    def GetCacheEntry(self,obj):
+        #Chains and rest regions are made again on every run so they are stored under the curves they come from
+        if obj.rest_entry: return obj.rest_entry
+        return str(obj.chain[0] if obj.chain else obj.curve)
+    
+    def PurgeToolpathCache(self):
+        #Removes the toolpaths of objects that are no longer in the document
+        for entry in rs.GetDocumentData(self.cache_section) or []:
+            if not rs.IsObject(entry.split('_')[0]): rs.DeleteDocumentData(self.cache_section,entry)
+    
+    def ExtractCeroPoint(self):
+         #Gets cero point from rhino objects and deletes it from self list
+        rhino_objects = self.rhino_objects
+        if "cero_point" in rhino_objects.iterkeys():
+            cero_point = rhino_objects["cero_point"]
+            del rhino_objects["cero_point"]
+        else: cero_point = (0,0,0)
+        self.cero_coordinates = cero_point if isinstance(cero_point,tuple) else rs.PointCoordinates(cero_point)
+        #Add tag to new cero
+        if self.preview_mode != 'none':
+            dot = rs.AddTextDot("+",cero_point)
+            rs.ObjectLayer(dot,self.layer_sorting)
+            rs.ObjectColor(dot,(200,200,200))
+        return cero_point,rhino_objects
+    
+    def GetToolSettings(self,preset,operation):
+        #Each operation can use its own tool, 0 as diameter keeps the cnc cutter
+        tool_settings = dict(preset['cnc'])
+        input_data = preset[operation]
+        tool_settings['tool'] = int(input_data.get('tool',1)) if input_data.get('tool',1) else 1
+        if input_data.get('tool_diam',0): tool_settings['cut_diam'] = input_data['tool_diam']
+        return tool_settings
+    
+    def GetModelObjects(self):
+        model_objects = {}
+        rest_objects = []
+        self.CleanHiddenLayer(self.layer_rest)
+        cero_point,rhino_objects = self.ExtractCeroPoint()
+        if self.user_data.get('remove_duplicates',True): rhino_objects = self.RemoveDuplicates(rhino_objects)
+        engraving = self.machining_settings[self.user_data["selected_preset"]]["grabado"]
+        if "curves_open" in rhino_objects: rhino_objects["curves_open"] = self.ChainOpenCurves(rhino_objects["curves_open"] or [],engraving.get('chain_gap',0),engraving.get('chain_lift',0))
+        for colorcode, objects in rhino_objects.iteritems():
+            if objects:
+                model_objects[colorcode] =[]
+                preset = self.machining_settings[self.user_data["selected_preset"]]
+                post = self.postprocessors[self.user_data['post']]
+                for rh_object in objects:
+                    if rs.IsObject(rh_object):
+                        if colorcode == "points":
+                            color = rs.ObjectColor(rh_object)
+                            rgb = (rs.ColorRedValue(color),rs.ColorGreenValue(color),rs.ColorBlueValue(color))
+                            if rgb == (0,255,0):
+                                print('verde')
+                            curve = g_curve(rh_object,preset["barrenado"],self.GetToolSettings(preset,"barrenado"),0,False,cero_point,colorcode,post)
+                        if colorcode == "curves_open":
+                            curve = g_curve(rh_object,preset["grabado"],self.GetToolSettings(preset,"grabado"),0,False,cero_point,colorcode,post)
+                            curve.chain = self.chains.get(rh_object,[])
+                        if colorcode == "curves_pocketing":
+                            curve = g_curve(rh_object,preset["desbaste"],self.GetToolSettings(preset,"desbaste"),-1,True,cero_point,colorcode,post)
+                            #rs.ObjectLayer(curve.cut_curve,self.preview_layer_name)
+                            if self.IsRestMachining(preset): rest_objects += self.GetRestObjects(curve,preset,cero_point,post)
+                        if colorcode == "curves_outside":
+                            curve = g_curve(rh_object,preset["corte"],self.GetToolSettings(preset,"corte"),1,False,cero_point,colorcode,post)
+                            #rs.ObjectLayer(curve.cut_curve,self.preview_layer_name)
+                        if colorcode == "curves_inside":
+                            curve = g_curve(rh_object,preset["corte"],self.GetToolSettings(preset,"corte"),-1,False,cero_point,colorcode,post)
+                            #rs.ObjectLayer(curve.cut_curve,self.preview_layer_name)
+                        model_objects[colorcode].append(curve)
+        self.rest_count = len(rest_objects)
+        if rest_objects: model_objects["curves_rest"] = rest_objects
+        return model_objects
+    
+    def IsRestMachining(self,preset):
+        #Rest tool given and smaller than the pocket tool
+        rest_diam = preset["desbaste"].get('rest_diam',0)
+        return 0 < rest_diam < self.GetToolSettings(preset,"desbaste")['cut_diam']
+    
+    def GetRestInput(self,preset):
+        #Pocket settings for the rest tool, plain offset pocketing without finishing pass.
+        #Without rest tool number the one after every tool of the preset is used so it is a tool change of its own.
+        rest_input = dict(preset["desbaste"])
+        tools = [self.GetToolSettings(preset,section)['tool'] for section in set(PRESET_SECTIONS.values())]
+        rest_input.update({'tool':int(rest_input.get('rest_tool',0)) or max(tools) + 1,'tool_diam':rest_input['rest_diam'],
+                           'finish_pass':0,'finish_entries':0,'circular_pocketing':0,'adaptive_pocketing':0})
+        return rest_input
+    
+    def GetToolConflicts(self):
+        #Tool numbers with more than one diameter in the operations of the selection, as [(tool,[diameters])].
+        #The tools are grouped by number so the program would cut with the wrong diameter.
+        preset = self.machining_settings[self.user_data['selected_preset']]
+        sections = set([PRESET_SECTIONS[colorcode] for colorcode,items in self.rhino_objects.items() if items and colorcode in PRESET_SECTIONS])
+        diameters = {}
+        for section in sections:
+            tool_settings = self.GetToolSettings(preset,section)
+            diameters.setdefault(tool_settings['tool'],set()).add(round(tool_settings['cut_diam'],4))
+        if 'desbaste' in sections and self.IsRestMachining(preset):
+            rest_input = self.GetRestInput(preset)
+            diameters.setdefault(rest_input['tool'],set()).add(round(rest_input['tool_diam'],4))
+        return sorted([(tool,sorted(values)) for tool,values in diameters.items() if len(values) > 1])
+    
+    def GetSectionInput(self,preset,cam_type):
+        return self.GetRestInput(preset) if cam_type == "curves_rest" else preset[PRESET_SECTIONS[cam_type]]
+    
+    def GetRestRegions(self,pocket,rest_diam):
+        #Material the pocket tool leaves in the corners as closed curves in the rest layer. The pocket tool clears the
+        #opening of the pocket, shrunk and grown back by its radius. Grown a little more it overlaps the walls so the
+        #difference keeps only the corners. Each corner is grown by the rest radius over the cleared area and cut back
+        #to the pocket, so the rest pocket overlaps the cleared area without going past the walls.
+        radius = pocket.general_input['cut_diam']*.5
+        rest_radius = rest_diam*.5
+        overlap = max(sc.doc.ModelAbsoluteTolerance*10,.01)
+        inset = pocket.get_cut_curve(-1,radius)
+        if not inset: return []
+        if rs.CurveArea(inset)[0] >= rs.CurveArea(pocket.curve)[0] - overlap:
+            #The offset failed and gave back the pocket, the pocket tool does not fit
+            rs.DeleteObject(inset)
+            return []
+        cleared = pocket.get_cut_curve(1,radius+overlap,inset)
+        rs.DeleteObject(inset)
+        if not cleared: return []
+        corners = rs.CurveBooleanDifference(pocket.curve,cleared) or []
+        rs.DeleteObject(cleared)
+        regions = []
+        for corner in corners:
+            #Slivers along the walls are only numeric noise
+            if not rs.IsCurveClosed(corner) or rs.CurveArea(corner)[0] < rest_radius**2*.01:
+                rs.DeleteObject(corner)
+                continue
+            grown = pocket.get_cut_curve(1,rest_radius,corner)
+            rs.DeleteObject(corner)
+            if not grown: continue
+            regions += rs.CurveBooleanIntersection(grown,pocket.curve) or []
+            rs.DeleteObject(grown)
+        #A region inside another is a hole, a contour with holes can not be cut as a single rest pocket
+        nested = set()
+        for region in regions:
+            for other in regions:
+                if other != region and rs.PlanarClosedCurveContainment(region,other) == 2: nested.update([region,other])
+        if nested:
+            self.ConsoleLog('%s: %s' % (self.txt('Regiones de restos con huecos omitidas'),len(nested)))
+            rs.DeleteObjects(list(nested))
+        kept = [region for region in regions if region not in nested]
+        for region in kept: rs.ObjectLayer(region,self.layer_rest)
+        return kept
+    
+    def GetRestObjects(self,pocket,preset,cero_point,post):
+        #Pockets of the rest regions cut with the rest tool, cached under the pocket and their index
+        rest_input = self.GetRestInput(preset)
+        tool_settings = self.GetToolSettings(dict(preset,desbaste=rest_input),"desbaste")
+        rest_objects = []
+        for index,region in enumerate(self.GetRestRegions(pocket,rest_input['tool_diam'])):
+            curve = g_curve(region,rest_input,tool_settings,-1,True,cero_point,"curves_rest",post)
+            curve.rest_entry = "%s_rest_%s" % (pocket.curve,index)
+            rest_objects.append(curve)
+        return rest_objects
+    
+    def GetDuplicateKey(self,item):
+        #Centroid, length and end points, points are their own centroid
+        if rs.IsPoint(item):
+            point = rs.PointCoordinates(item)
+            return point,0,[point]
+        center = rs.CurveAreaCentroid(item)[0] if rs.IsCurveClosed(item) and rs.IsCurvePlanar(item) else rs.CurveMidPoint(item)
+        return center,rs.CurveLength(item),[rs.CurveStartPoint(item),rs.CurveEndPoint(item)]
+    
+    def IsDuplicate(self,item,other,tolerance):
+        #Exact check of two curves with the same key, every sample of one is on the other
+        if rs.IsPoint(item): return True
+        if rs.IsCurveClosed(item) != rs.IsCurveClosed(other): return False
+        if not rs.IsCurveClosed(item):
+            start,end = rs.CurveStartPoint(item),rs.CurveEndPoint(item)
+            other_start,other_end = rs.CurveStartPoint(other),rs.CurveEndPoint(other)
+            if not ((rs.Distance(start,other_start) < tolerance and rs.Distance(end,other_end) < tolerance) or
+                    (rs.Distance(start,other_end) < tolerance and rs.Distance(end,other_start) < tolerance)): return False
+        for point in rs.DivideCurve(item,16,create_points=False,return_points=True):
+            if rs.Distance(point,rs.EvaluateCurve(other,rs.CurveClosestPoint(other,point))) > tolerance: return False
+        return True
+    
+    def RemoveDuplicates(self,rhino_objects):
+        #Leaves out stacked copies of the same operation and open lines lying on another one, the first selected stays.
+        #Copies are found in a grid of their centroids, only neighbouring cells with the same length are compared.
+        tolerance = max(sc.doc.ModelAbsoluteTolerance*10,.01)
+        cell_size = max(tolerance*100,1.0)
+        self.duplicates = []
+        self.overlaps = []
+        filtered = {}
+        for colorcode,items in rhino_objects.items():
+            if not items or not isinstance(items,list):
+                filtered[colorcode] = items
+                continue
+            cells = {}
+            kept = []
+            for item in items:
+                if not rs.IsObject(item): continue
+                center,length,ends = self.GetDuplicateKey(item)
+                cell = (int(math.floor(center[0]/cell_size)),int(math.floor(center[1]/cell_size)))
+                duplicate = False
+                for x in (cell[0]-1,cell[0],cell[0]+1):
+                    for y in (cell[1]-1,cell[1],cell[1]+1):
+                        for other,other_center,other_length in cells.get((x,y),[]):
+                            if abs(length-other_length) > tolerance or rs.Distance(center,other_center) > tolerance: continue
+                            if self.IsDuplicate(item,other,tolerance):
+                                duplicate = True
+                                break
+                        if duplicate: break
+                    if duplicate: break
+                if duplicate:
+                    self.duplicates.append(item)
+                    continue
+                cells.setdefault(cell,[]).append((item,center,length))
+                kept.append(item)
+            if colorcode == 'curves_open': kept = self.RemoveOverlappingLines(kept,tolerance)
+            filtered[colorcode] = kept
+        return filtered
+    
+    def RemoveOverlappingLines(self,items,tolerance):
+        #Lines inside a longer line on the same axis are dropped, partial overlaps are only reported
+        lines = [(item,rs.CurveStartPoint(item),rs.CurveEndPoint(item)) for item in items if rs.IsLine(item)]
+        lines.sort(key=lambda line:-rs.Distance(line[1],line[2]))
+        cell_size = max(max([rs.Distance(start,end) for item,start,end in lines] or [1.0]),1.0)
+        cells = {}
+        covered = set()
+        for item,start,end in lines:
+            checked = set()
+            for cell in self.GetCells(start,end,cell_size):
+                for other,other_start,other_end in cells.get(cell,[]):
+                    if other in checked: continue
+                    checked.add(other)
+                    if point_segment_distance(start,other_start,other_end) < tolerance and point_segment_distance(end,other_start,other_end) < tolerance and abs(start[2]-other_start[2]) < tolerance:
+                        covered.add(item)
+                    else:
+                        interval = get_common_interval(other_start,other_end,start,end,0,tolerance)
+                        if interval and rs.Distance(interval[0],interval[1]) > tolerance: self.overlaps.append(item)
+            if item in covered:
+                self.duplicates.append(item)
+                continue
+            for cell in self.GetCells(start,end,cell_size): cells.setdefault(cell,[]).append((item,start,end))
+        return [item for item in items if item not in covered]
+    
+    def GetChainEnds(self,items):
+        #Start and end point of every open curve as tuples
+        ends = {}
+        for item in items:
+            start,end = rs.CurveStartPoint(item),rs.CurveEndPoint(item)
+            ends[item] = ((start.X,start.Y,start.Z),(end.X,end.Y,end.Z))
+        return ends
+    
+    def GetChains(self,items,gap):
+        #Open curves joined end to end through a grid of their end points, [(curve,reversed)] per chain.
+        #Each chain grows from its tail and then from its head with the closest free end within the gap.
+        ends = self.GetChainEnds(items)
+        cell_size = max(gap,sc.doc.ModelAbsoluteTolerance)
+        def get_cell(point): return (int(math.floor(point[0]/cell_size)),int(math.floor(point[1]/cell_size)))
+        cells = {}
+        for item in items:
+            for side in (0,1): cells.setdefault(get_cell(ends[item][side]),[]).append((item,side))
+        free = set(items)
+        def closest(point):
+            found,found_distance = None,gap
+            cell = get_cell(point)
+            for x in (cell[0]-1,cell[0],cell[0]+1):
+                for y in (cell[1]-1,cell[1],cell[1]+1):
+                    for item,side in cells.get((x,y),[]):
+                        if item not in free: continue
+                        distance = math.sqrt(sum([(a-b)**2 for a,b in zip(point,ends[item][side])]))
+                        if distance <= found_distance: found,found_distance = (item,side),distance
+            return found
+        chains = []
+        for item in items:
+            if item not in free: continue
+            free.discard(item)
+            chain = [(item,False)]
+            while True:
+                last,reverse = chain[-1]
+                found = closest(ends[last][0 if reverse else 1])
+                if not found: break
+                free.discard(found[0])
+                chain.append((found[0],found[1] == 1))
+            while True:
+                first,reverse = chain[0]
+                found = closest(ends[first][1 if reverse else 0])
+                if not found: break
+                free.discard(found[0])
+                chain.insert(0,(found[0],found[1] == 0))
+            chains.append(chain)
+        return chains,ends
+    
+    def SortChains(self,chains,ends):
+        #Nearest chain first from the zero point, a chain made of several curves can be cut backwards
+        cero = self.cero_coordinates
+        position = (cero[0],cero[1],cero[2])
+        def chain_ends(chain):
+            first,first_reverse = chain[0]
+            last,last_reverse = chain[-1]
+            return ends[first][1 if first_reverse else 0],ends[last][0 if last_reverse else 1]
+        def reversed_chain(chain): return [(item,not reverse) for item,reverse in reversed(chain)]
+        def distance(a,b): return (a[0]-b[0])**2 + (a[1]-b[1])**2
+        pending = list(chains)
+        ordered = []
+        while pending:
+            best,best_distance,best_reverse = None,None,False
+            for chain in pending:
+                start,end = chain_ends(chain)
+                for point,reverse in [(start,False)] + ([(end,True)] if len(chain) > 1 else []):
+                    if best is None or distance(position,point) < best_distance: best,best_distance,best_reverse = chain,distance(position,point),reverse
+            pending.remove(best)
+            chain = reversed_chain(best) if best_reverse else best
+            ordered.append(chain)
+            position = chain_ends(chain)[1]
+        return ordered
+    
+    def SplitChainGaps(self,chain,ends):
+        #Runs of the chain whose curves touch, the tool goes up to the clearance plane between them
+        runs = [[chain[0]]]
+        for item,reverse in chain[1:]:
+            last,last_reverse = runs[-1][-1]
+            gap_start,gap_end = ends[last][0 if last_reverse else 1],ends[item][1 if reverse else 0]
+            if math.sqrt(sum([(a-b)**2 for a,b in zip(gap_start,gap_end)])) > sc.doc.ModelAbsoluteTolerance: runs.append([])
+            runs[-1].append((item,reverse))
+        return runs
+    
+    def AddChainCurve(self,chain,ends):
+        #One curve in the chains layer made of copies of the members and short lines over their gaps
+        pieces = []
+        for index,(item,reverse) in enumerate(chain):
+            if index:
+                last,last_reverse = chain[index-1]
+                gap_start,gap_end = ends[last][0 if last_reverse else 1],ends[item][1 if reverse else 0]
+                if math.sqrt(sum([(a-b)**2 for a,b in zip(gap_start,gap_end)])) > sc.doc.ModelAbsoluteTolerance: pieces.append(rs.AddLine(gap_start,gap_end))
+            piece = rs.CopyObject(item)
+            if reverse: rs.ReverseCurve(piece)
+            pieces.append(piece)
+        joined = rs.JoinCurves(pieces,True)
+        if not joined or len(joined) != 1:
+            if joined: rs.DeleteObjects(joined)
+            else: rs.DeleteObjects(pieces)
+            return False
+        chain_curve = joined[0]
+        first,reverse = chain[0]
+        start = ends[first][1 if reverse else 0]
+        if not rs.IsCurveClosed(chain_curve) and rs.Distance(rs.CurveStartPoint(chain_curve),start) > rs.Distance(rs.CurveEndPoint(chain_curve),start): rs.ReverseCurve(chain_curve)
+        rs.ObjectLayer(chain_curve,self.layer_chains)
+        return chain_curve
+    
+    def ChainOpenCurves(self,items,gap,lift=False):
+        #Open curves touching within the gap are cut as one curve without going up between them, with lift
+        #only the curves that touch are joined and the rest of the chain follows one curve after the other.
+        #The joined curves live in a hidden layer cleaned on every run, the drawing is not touched.
+        self.CleanHiddenLayer(self.layer_chains)
+        self.chains = {}
+        self.chain_order = {}
+        if gap <= 0: return items
+        open_items = [item for item in items if rs.IsCurve(item) and not rs.IsCurveClosed(item)]
+        if len(open_items) < 2: return items
+        chains,ends = self.GetChains(open_items,gap)
+        chained = []
+        for sorted_chain in self.SortChains(chains,ends):
+            for chain in self.SplitChainGaps(sorted_chain,ends) if lift else [sorted_chain]:
+                chain_curve = self.AddChainCurve(chain,ends) if len(chain) > 1 else False
+                if chain_curve:
+                    self.chains[chain_curve] = [item for item,reverse in chain]
+                    chained.append(chain_curve)
+                else: chained += [item for item,reverse in chain]
+        self.chain_order = dict((item,index) for index,item in enumerate(chained))
+        return chained + [item for item in items if item not in ends]
+    
+    def KeepChainOrder(self,object_list):
+        #The other sortings move the open curves, they take back the nearest first order of the chains
+        #in the places each part and tool gives them
+        groups = OrderedDict()
+        for index,obj in enumerate(object_list):
+            if obj.cam_type == 'curves_open' and obj.curve in self.chain_order: groups.setdefault((obj.asignedcluster,obj.tool),[]).append(index)
+        ordered = list(object_list)
+        for indexes in groups.values():
+            objects = sorted([object_list[index] for index in indexes],key=lambda obj: self.chain_order[obj.curve])
+            for index,obj in zip(indexes,objects): ordered[index] = obj
+        return ordered
+    
+    def GetSortedObjectsList(self):
+        
+        object_list = []
+        for type,objects in self.model_objects.items():
+            for obj in objects:
+                point = obj.start_point
+                object_list.append([obj,point[0],point[1]])
+        return [i[0] for i in sorted(object_list, key = operator.itemgetter(2, 1))]
+    
+    def GetObjectsList(self):
+        object_list = []
+        for type,objects in self.model_objects.items():
+            for obj in objects:
+                object_list.append(obj)
+        return object_list
+    
+    def SortClosest(self,rh_objects):
+
+        closest_list = []
+        test_object = rh_objects[0]
+        closest_list.append(test_object)
+        while True:
+            if len(rh_objects) == 0:
+                break
+            rh_objects.pop(rh_objects.index(test_object))
+            if len(rh_objects) == 0:
+                break
+            closest_point_index = rs.PointArrayClosestPoint([i.start_point for i in rh_objects],test_object.point)
+            closest_object = rh_objects[closest_point_index]
+            closest_list.append(closest_object)
+            test_object = closest_object
+        return closest_list
+    
+    def SortClusters(self,object_list):
+        outside_curves = [obj for obj in object_list if obj.cam_type == 'curves_outside']
+        test_curves = [obj for obj in object_list if obj.cam_type != 'curves_outside']     
+        cluster_list = []
+        count = 0
+        for out_crv in outside_curves:
+            
+            for test_crv in test_curves:
+                if rs.PointInPlanarClosedCurve(test_crv.point,out_crv.curve) and test_crv not in cluster_list:
+                    cluster_list.append(test_crv)
+                    test_crv.asignedcluster = count
+                    out_crv.iscluster = True
+            if out_crv.iscluster:
+                out_crv.asignedcluster = count
+                if self.IsDotVisible(out_crv.point):
+                    cluster_dot = rs.AddTextDot("%s: %s"% (self.txt('Pieza'),count),out_crv.point)
+                    rs.ObjectLayer(cluster_dot,self.layer_cluster)
+                count+=1
+            cluster_list.append(out_crv)
+            
+        for test_crv in test_curves:
+            if test_crv not in cluster_list: cluster_list.append(test_crv)
+        
+        return cluster_list
+    
+    def SortTools(self,object_list):
+        #Groups the operations by tool keeping the previous order inside each group.
+        #The group holding the outside cuts goes last so parts are released at the end.
+        #Rest pockets go after the other pockets, the outside cuts of a pocket tool are kept apart to stay last.
+        rest_tools = set([obj.tool for obj in object_list if obj.cam_type == 'curves_rest'])
+        tool_groups = OrderedDict()
+        for obj in object_list:
+            tool = (obj.tool,bool(rest_tools) and obj.tool not in rest_tools and obj.cam_type == 'curves_outside')
+            if tool not in tool_groups: tool_groups[tool] = []
+            tool_groups[tool].append(obj)
+        if len(tool_groups) < 2: return object_list
+        first_index = {tool:object_list.index(objects[0]) for tool,objects in tool_groups.items()}
+        release_tools = [tool for tool,objects in tool_groups.items() if [obj for obj in objects if obj.cam_type == 'curves_outside']]
+        ordered_tools = sorted(tool_groups.keys(), key = lambda tool: (tool in release_tools,tool[0] in rest_tools,first_index[tool]))
+        sorted_list = []
+        for tool in ordered_tools:
+            sorted_list += tool_groups[tool]
+        return sorted_list
+    
+    def GetLineSegments(self,curve):
+        #(start,end) of the straight segments of a curve without adding them to the document
+        segments = []
+        for segment in rs.coercecurve(curve).DuplicateSegments():
+            if segment.IsLinear(sc.doc.ModelAbsoluteTolerance):
+                start,end = segment.PointAtStart,segment.PointAtEnd
+                segments.append(((start.X,start.Y,start.Z),(end.X,end.Y,end.Z)))
+        return segments
+    
+    def GetCells(self,start,end,cell_size):
+        #Cells of a grid touched by the bounding box of a segment
+        x0,x1 = sorted([int(math.floor(start[0]/cell_size)),int(math.floor(end[0]/cell_size))])
+        y0,y1 = sorted([int(math.floor(start[1]/cell_size)),int(math.floor(end[1]/cell_size))])
+        return [(x,y) for x in range(x0,x1+1) for y in range(y0,y1+1)]
+    
+    def SetCommonLines(self,object_list):
+        #Outside parts nested one cutter diameter apart cut their facing lines once, the later part leaves out the
+        #middle line the earlier ones already cut. Segments are indexed in a grid so each one meets only its neighbours.
+        parts = [obj for obj in object_list if obj.cam_type == 'curves_outside' and not obj.input_data.get('finish_pass',0)]
+        if len(parts) < 2: return 0
+        tolerance = max(sc.doc.ModelAbsoluteTolerance*2,.01)
+        cell_size = max(max([obj.general_input['cut_diam'] for obj in parts])*20,1.0)
+        cells = {}
+        for obj in parts:
+            diam = obj.general_input['cut_diam']
+            segments = self.GetLineSegments(obj.curve)
+            common_cut = []
+            for start,end in segments:
+                #Lines one diameter away are in the cells of the segment grown by a diameter
+                grown = ((min(start[0],end[0])-diam,min(start[1],end[1])-diam),(max(start[0],end[0])+diam,max(start[1],end[1])+diam))
+                checked = set()
+                for cell in self.GetCells(grown[0],grown[1],cell_size):
+                    for item in cells.get(cell,[]):
+                        if item in checked: continue
+                        checked.add(item)
+                        other,other_start,other_end = item
+                        if other.tool != obj.tool or other.general_input['cut_diam'] != diam or other.input_data != obj.input_data: continue
+                        interval = get_common_interval(other_start,other_end,start,end,diam,tolerance)
+                        if interval: common_cut.append(interval)
+            obj.common_cut = common_cut
+            for start,end in segments:
+                for cell in self.GetCells(start,end,cell_size): cells.setdefault(cell,[]).append((obj,start,end))
+        return len([obj for obj in parts if obj.common_cut])
+    
+    def SetCongruentParts(self,object_list):
+        #Curves with the same shape and settings reuse the toolpath of the first one found.
+        masters = {}
+        for obj in object_list:
+            signature = obj.get_shape_signature(self.user_data['congruent_rotation'])
+            if not signature: continue
+            if signature in masters: obj.master = masters[signature]
+            else: masters[signature] = obj
+        return len([obj for obj in object_list if obj.master])
+    
+    def GetToolChangeCode(self,post,obj):
+        #Fills the postprocessor tool change block, the numbers are rounded as the moves and unknown fields raise ValueError
+        formatter = get_formatter(post)
+        values = {'tool':obj.tool,
+                  'diam':formatter.number(obj.general_input['cut_diam']),
+                  'spindle':int(obj.general_input['spindle']),
+                  'sec_plane':formatter.number(obj.general_input['sec_plane'])}
+        gcode = self.GetTemplateLines(post.get('tool_change',[]),TOOL_CHANGE_FIELDS,values)
+        if post['spindle']: gcode.append('%s%s' % (post['spindle'],int(obj.general_input['spindle'])))
+        return formatter.format_comment('T%s D%s' % (obj.tool,values['diam'])) + gcode
+    
+    def GetLinkRegion(self,curve):
+        #Bounding box and outline on XY, the links are tested without adding anything to the document
+        polygon = curve_polygon(curve)
+        return (min([p[0] for p in polygon]),min([p[1] for p in polygon]),max([p[0] for p in polygon]),max([p[1] for p in polygon]),polygon)
+    
+    def GetFixtureRegions(self):
+        if not rs.IsLayer(self.layer_fixtures): return []
+        fixtures = rs.ObjectsByLayer(self.layer_fixtures)
+        return [self.GetLinkRegion(crv) for crv in fixtures if rs.IsCurve(crv) and rs.IsCurveClosed(crv)] if fixtures else []
+    
+    def IsLinkSafe(self,pt1,pt2,regions):
+        #A link is safe at the clearance plane if it does not touch any cut part or fixture
+        c = self.cero_coordinates
+        start = (pt1[0]+c[0],pt1[1]+c[1])
+        end = (pt2[0]+c[0],pt2[1]+c[1])
+        for min_x,min_y,max_x,max_y,polygon in regions:
+            if max(start[0],end[0]) < min_x or min(start[0],end[0]) > max_x: continue
+            if max(start[1],end[1]) < min_y or min(start[1],end[1]) > max_y: continue
+            if segment_touches_polygon(start,end,polygon): return False
+        return True
+    
+    def SetLinks(self,object_list):
+        #Decides once which links go up to the safe plane, the program and the times only read link_retract
+        retracts = self.GetLinkRetracts(object_list,[obj.toolpath.point(0) for obj in object_list],[obj.toolpath.point(-1) for obj in object_list])
+        for obj,link_retract in zip(object_list,retracts): obj.link_retract = link_retract
+    
+    def GetLinkRetracts(self,object_list,starts,ends):
+        #Whether the link into each object goes up to the safe plane, from the start and end points of the objects.
+        #Links between tools or that touch a part already cut or a fixture retract, the region of an object is added
+        #after linking out of it.
+        multiple_tools = len(set([obj.tool for obj in object_list])) > 1
+        regions = self.GetFixtureRegions()
+        retracts = []
+        last_index = None
+        for index,obj in enumerate(object_list):
+            linked = last_index is not None and not (multiple_tools and obj.tool != object_list[last_index].tool)
+            retracts.append(not (linked and self.IsLinkSafe(ends[last_index],starts[index],regions)))
+            if last_index is not None and object_list[last_index].cam_type in ['curves_outside','curves_inside']:
+                regions.append(self.GetLinkRegion(object_list[last_index].curve))
+            last_index = index
+        return retracts
+    
+    def GetLinkCode(self,post,obj):
+        #Short links stay at the clearance plane, the rest go up to the safe plane, see SetLinks
+        if not obj.link_retract: return []
+        start = obj.toolpath.point(0)
+        formatter = get_formatter(post)
+        return [formatter.format_move(z=obj.sec_plane),formatter.format_move(x=start[0],y=start[1])]
+    
+    def GetGCodeStart(self,post):
+        #Lines at the start of the program and of every split file
+        gcode = []
+        formatter = get_formatter(post)
+        general_settings = self.machining_settings[self.user_data["selected_preset"]]['cnc'] # or else use good old self.general_settings
+        if post["header"]: gcode += post["header"]
+        gcode += formatter.format_comment('%s %s' % (self.plugin_name,self.user_data["selected_preset"]))
+        if post['spindle']: gcode.append('%s%s' % (post['spindle'],int(general_settings['spindle'])))
+        gcode.append(formatter.format_move(z=general_settings["sec_plane"],feed=general_settings["feed_rapid"]))
+        return gcode
+    
+    def GetGCodeEnd(self,post):
+        general_settings = self.machining_settings[self.user_data["selected_preset"]]['cnc']
+        gcode = [get_formatter(post).format_move(z=general_settings["sec_plane"])]
+        if post["footer"]: gcode += post["footer"]
+        return gcode
+    
+    def GetTemplateLines(self,lines,fields,values):
+        #Postprocessor lines with {field} names, checked by validate_post so unknown fields raise ValueError here
+        return [compile_template(line,fields) % values for line in lines if line]
+    
+    def GetLoopCode(self,post,obj):
+        #Object code with the repeated Z levels written once in incremental moves, inside a loop or as subprograms
+        #called count times. Returns the code and the subprograms, the expanded code is kept for controllers without them.
+        code = obj.get_gcode()
+        if obj.drill_cycle or len(code) != len(obj.points): return code,[]
+        formatter = get_formatter(post)
+        toolpath = obj.toolpath
+        gcode = []
+        subprograms = []
+        position = 0
+        for anchor,length,count in formatter.find_loops(toolpath):
+            values = {'number':LOOP_FIRST_NUMBER + self.loop_count,'count':count}
+            body = self.GetTemplateLines(post.get('loop_start',[]),LOOP_FIELDS,values) + formatter.format_incremental(toolpath,anchor+1,anchor+1+length) + self.GetTemplateLines(post.get('loop_end',[]),LOOP_FIELDS,values)
+            call = self.GetTemplateLines(post.get('loop_call',[]),LOOP_FIELDS,values)
+            gcode += code[position:anchor+1]
+            if call:
+                gcode += call
+                subprograms += body
+            else: gcode += body
+            position = anchor + 1 + length*count
+            self.loop_count += 1
+        gcode += code[position:]
+        return gcode,subprograms
+    
+    def GetToolResumeCode(self,post,obj,multiple_tools):
+        #Tool and spindle of the object again at the start of a split file
+        if multiple_tools: return self.GetToolChangeCode(post,obj)
+        return ['%s%s' % (post['spindle'],int(obj.general_input['spindle']))] if post['spindle'] else []
+    
+    def GetGCodeBlocks(self,object_list):
+        #Yields the code of each object, whether the machine is at the safe plane when it starts, its subprograms
+        #and the lines that restore its tool when a split file starts with it
+        post = self.postprocessors[self.user_data['post']]
+        loops = bool([line for line in post.get('loop_start',[]) if line])
+        self.loop_count = 0
+        multiple_tools = len(set([obj.tool for obj in object_list])) > 1
+        current_tool = None
+        active_cycle = False
+        for obj in object_list:
+            tool_change = multiple_tools and obj.tool != current_tool
+            link_code = self.GetLinkCode(post,obj)
+            #Canned drilling cycles stay active while the holes share the same cycle and the links are short
+            if active_cycle and (tool_change or link_code or obj.drill_modal != active_cycle):
+                yield [post.get('drill_cancel','G80')],False,[],[]
+                active_cycle = False
+            gcode = []
+            if tool_change:
+                gcode += self.GetToolChangeCode(post,obj)
+                current_tool = obj.tool
+            gcode += link_code
+            subprograms = []
+            if active_cycle: gcode.append(obj.drill_position)
+            elif loops:
+                code,subprograms = self.GetLoopCode(post,obj)
+                gcode += code
+            else: gcode += obj.get_gcode()
+            active_cycle = obj.drill_modal
+            yield gcode,bool(tool_change or link_code),subprograms,[] if tool_change else self.GetToolResumeCode(post,obj,multiple_tools)
+        if active_cycle: yield [post.get('drill_cancel','G80')],False,[],[]
+    
+    def GetGCodeString(self,object_list):
+        post = self.postprocessors[self.user_data['post']]
+        with self.profiler.span('gcode'):
+            gcode = self.GetGCodeStart(post)
+            subprograms = []
+            for lines,safe,block_subprograms,resume in self.GetGCodeBlocks(object_list):
+                gcode += lines
+                subprograms += block_subprograms
+            gcode += self.GetGCodeEnd(post) + subprograms
+        self.profiler.count('gcode_lines',len(gcode))
+        gcode = get_formatter(post).number_lines(gcode)
+        self.gcode_size = {'lines':len(gcode),'bytes':sum([len(line)+1 for line in gcode]),'files':1}
+        return gcode
+    
+    def WriteGCode(self,object_list,file_path):
+        #The program is written while it is made, split files are listed in a manifest
+        post = self.postprocessors[self.user_data['post']]
+        writer = g_program_writer(file_path,get_formatter(post),self.GetGCodeStart(post),self.GetGCodeEnd(post),
+                                  int(post.get('max_lines',0)),int(post.get('max_kb',0))*1024)
+        try:
+            with self.profiler.span('gcode'):
+                for lines,safe,subprograms,resume in self.GetGCodeBlocks(object_list):
+                    writer.add_block(lines,safe,subprograms,resume)
+                    self.profiler.count('gcode_lines',len(lines))
+        finally:
+            saved_files = writer.close()
+        for chunk in writer.chunks:
+            if chunk['oversized']: self.ConsoleLog('%s: %s' % (self.txt('Archivo mayor que el limite, un objeto no cabe en un archivo'),chunk['file']))
+        self.gcode_size = {'lines':sum([chunk['lines'] for chunk in writer.chunks]),'bytes':sum([chunk['bytes'] for chunk in writer.chunks]),'files':len(writer.chunks)}
+        return saved_files
+    
+    def GetToolChanges(self,object_list):
+        tools = [obj.tool for obj in object_list]
+        if len(set(tools)) < 2: return 0
+        return len([i for i in range(len(tools)) if i == 0 or tools[i] != tools[i-1]])
+    
+    def GetGCodeTimes(self,object_list):
+        #Approximate minutes of the rapid, plunge and cut moves of the job and of each operation
+        if self.gcode_times and self.gcode_times[0] is object_list: return self.gcode_times[1]
+        times = [0,0,0]
+        operations = {}
+        last_point = False
+        for obj in object_list:
+            if last_point and obj.link_retract:
+                #Retract to the safe plane and travel over it
+                hello = obj.toolpath.point(0)
+                up = (last_point[0],last_point[1],obj.sec_plane)
+                over = (hello[0],hello[1],obj.sec_plane)
+                times[MOVE_RAPID] += (rs.Distance(last_point,up)+rs.Distance(up,over)+rs.Distance(over,hello))/obj.general_input['feed_rapid']
+                last_point = hello
+            obj_times,last_point = obj.get_cut_times(last_point)
+            times = [total+obj_time for total,obj_time in zip(times,obj_times)]
+            operations[obj.cam_type] = operations.get(obj.cam_type,0) + sum(obj_times)*60/100
+        gcode_times = dict((name,times[kind]*60/100) for name,kind in MOVE_STATES.items()),operations
+        self.gcode_times = (object_list,gcode_times)
+        return gcode_times
+    
+    def GetGCodeTime(self,object_list):
+        return round(sum(self.GetGCodeTimes(object_list)[0].values()),2)
+    
+    def GetReport(self,object_list,title):
+        #Job sheet of the toolpaths, see g_report
+        times,operation_times = self.GetGCodeTimes(object_list)
+        operations = []
+        for name in OPERATION_NAMES.keys() + sorted(set(operation_times) - set(OPERATION_NAMES)):
+            objects = [obj for obj in object_list if obj.cam_type == name]
+            if not objects: continue
+            tools = sorted(set([obj.tool for obj in objects]))
+            operations.append((name,{'objects':len(objects),'tools':', '.join([str(tool) for tool in tools]),'minutes':operation_times.get(name,0)}))
+        header = [title,
+                  '%s  |  %s: %s  |  %s: %s' % (time.strftime('%Y-%m-%d %H:%M'),self.txt('Rutina'),self.user_data['selected_preset'],self.txt('Post'),self.user_data['post']),
+                  '%s: %s  |  %s: %s min  |  %s: %s  |  %s: %s' % (self.txt('Objetos'),len(object_list),self.txt('Tiempo de corte aproximado'),round(sum(times.values()),1),
+                                                              self.txt('Cambios de herramienta'),self.GetToolChanges(object_list),self.txt('Lineas'),self.gcode_size['lines'])]
+        with self.profiler.span('report'):
+            return g_report(translate=self.txt).build(object_list,self.cero_coordinates,header,times,operations)
+    
+    def GetGeometryHash(self,object_list):
+        #Same drawing gives the same hash whatever the selection order
+        hashes = sorted([hashlib.md5(json.dumps([obj.cam_type,obj.get_geometry_values()])).hexdigest() for obj in object_list])
+        return hashlib.md5(''.join(hashes)).hexdigest()
+    
+    def GetMetrics(self,object_list):
+        #Record of the run for the metrics log
+        times,operation_times = self.GetGCodeTimes(object_list)
+        operations = {}
+        for obj in object_list:
+            operation = operations.setdefault(obj.cam_type,{'objects':0,'minutes':round(operation_times.get(obj.cam_type,0),2),'compute_ms':0})
+            operation['objects'] += 1
+        for event in self.profiler.events:
+            if event['name'] == 'toolpath' and event['args']['operation'] in operations:
+                operations[event['args']['operation']]['compute_ms'] += round(event['dur']/1000.0,1)
+        stages = OrderedDict((name,round(milliseconds,1)) for name,milliseconds in self.profiler.stages.items())
+        return OrderedDict([('version',METRICS_VERSION),
+                            ('time',round(time.time(),1)),
+                            ('date',time.strftime('%Y-%m-%d %H:%M:%S')),
+                            ('station',System.Environment.MachineName),
+                            ('plugin_version',VERSION),
+                            ('preset',self.user_data['selected_preset']),
+                            ('post',self.user_data['post']),
+                            ('geometry_hash',self.GetGeometryHash(object_list)),
+                            ('objects',len(object_list)),
+                            ('operations',operations),
+                            ('congruent',self.congruent_count),
+                            ('cached',self.cached_count),
+                            ('duplicates',len(self.duplicates)),
+                            ('chains',len(self.chains)),
+                            ('rest',self.rest_count),
+                            ('loops',self.loop_count),
+                            ('stages',stages),
+                            ('compute_ms',round(sum(stages.values()),1)),
+                            ('gcode',self.gcode_size),
+                            ('machine_minutes',dict((name,round(minutes,2)) for name,minutes in times.items())),
+                            ('tool_changes',self.GetToolChanges(object_list))])
+
+#Worker processes of the job server when LINCAM_WORKERS is not set
+DEFAULT_WORKERS = 2
+#Command line of a worker process, Rhino runs this script on start
+RUNSCRIPT_ARGS = '/nosplash /runscript="_-RunPythonScript ""%s"""'
+#Options of server jobs that do not send them
+JOB_OPTIONS = {"sorting":True,"sort_closest":False,"autocluster":True,"congruent_parts":True,"congruent_rotation":False,"use_cache":False,"preview_mode":"none","common_line":False,"remove_duplicates":True}
+
+class camServer(object):
+    #Local job server, stations send geometry as JSON over HTTP and get the G-code back.
+    #rhinoscriptsyntax works on the one active document of a process, so a Rhino process makes one job at a time.
+    #With workers the server starts that many Rhino processes as job servers on the next ports, each with its own
+    #document, and a thread per worker hands it the queued jobs one at a time. Without workers the jobs run one
+    #at a time in a headless document on the thread that called Serve. Requests are answered on their own threads.
+    
+    def __init__(self,machining_settings,postprocessors,address=('127.0.0.1',8765),max_jobs=50,metrics_file=False,workers=0):
+        self.machining_settings = machining_settings
+        self.postprocessors = postprocessors
+        self.address = address
+        self.max_jobs = max_jobs
+        self.metrics_file = metrics_file
+        self.queue = Queue.Queue(max_jobs)
+        self.jobs = OrderedDict()
+        self.jobs_lock = threading.Lock()
+        self.httpd = None
+        #Worker processes, worker n serves on the port n+1 after the server port
+        self.workers = workers
+        self.worker_processes = [None]*workers
+        self.stop = threading.Event()
+    
+    def Submit(self,data):
+        #Returns the job id, False when the queue is full
+        if data.get('preset') not in self.machining_settings and not data.get('preset_data'): raise ValueError('preset')
+        if data.get('post') not in self.postprocessors and not data.get('post_data'): raise ValueError('post')
+        #Geometry comes as Rhino JSON objects or as a DXF/SVG file path readable by the server
+        if not data.get('objects') and not (data.get('file') and os.path.isfile(data['file'])): raise ValueError('objects')
+        job_id = uuid.uuid4().hex
+        with self.jobs_lock:
+            try: self.queue.put_nowait((job_id,data))
+            except Queue.Full: return False
+            self.jobs[job_id] = {'status':'queued','submitted':time.time()}
+            #Only the last finished jobs are kept
+            finished = [key for key,job in self.jobs.items() if job['status'] in ('done','error')]
+            for key in finished[:max(0,len(finished)-self.max_jobs)]: del self.jobs[key]
+        return job_id
+    
+    def GetJob(self,job_id):
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def GetStatus(self):
+        with self.jobs_lock:
+            states = [job['status'] for job in self.jobs.values()]
+        return {'workers':self.workers,'queued':states.count('queued'),'running':states.count('running'),'done':states.count('done'),'error':states.count('error')}
+    
+    def SetJob(self,job_id,**values):
+        with self.jobs_lock:
+            if job_id in self.jobs: self.jobs[job_id].update(values)
+    
+    def RunNext(self,timeout=1,worker=None):
+        #Runs the next queued job here or on the worker, waits at most timeout seconds so the serving loop can be stopped
+        try: job_id,data = self.queue.get(True,timeout)
+        except Queue.Empty: return
+        self.SetJob(job_id,status='running',started=time.time(),worker=worker)
+        try:
+            result = self.RunJob(data) if worker is None else self.RunWorkerJob(worker,data)
+            self.SetJob(job_id,status='done',finished=time.time(),**result)
+        except Exception as e:
+            self.SetJob(job_id,status='error',finished=time.time(),message=str(e),trace=traceback.format_exc())
+        finally:
+            self.queue.task_done()
+    
+    def RunJob(self,data):
+        preset_name = data['preset']
+        post_name = data['post']
+        machining_settings = {preset_name:data.get('preset_data') or self.machining_settings[preset_name]}
+        postprocessors = {post_name:data.get('post_data') or self.postprocessors[post_name]}
+        user_data = dict(JOB_OPTIONS)
+        user_data.update(data.get('options',{}))
+        user_data.update({'selected_preset':preset_name,'post':post_name,'use_cache':False,'preview_mode':'none'})
+        geometry = dict((colorcode,[Rhino.Runtime.CommonObject.FromJSON(item) for item in items]) for colorcode,items in data.get('objects',{}).items())
+        
+        with headless_document() as doc:
+            if data.get('file'): rhino_objects = get_objects_by_color(g_importer(data['file']).run())[0] or {}
+            else: rhino_objects = dict((colorcode,[doc.Objects.Add(item) for item in items]) for colorcode,items in geometry.items())
+            if data.get('cero_point'): rhino_objects['cero_point'] = rs.AddPoint(data['cero_point'])
+            job = camJob(machining_settings,postprocessors,user_data,rhino_objects,profiler=g_profiler())
+            tool_conflicts = job.GetToolConflicts()
+            if tool_conflicts: raise ValueError('tool with more than one diameter: %s' % ', '.join(['T%s %s' % (tool,diameters) for tool,diameters in tool_conflicts]))
+            object_list = job.Process()
+            gcode = job.GetGCodeString(object_list)
+            gcode_time = job.GetGCodeTime(object_list)
+            tool_changes = job.GetToolChanges(object_list)
+            if self.metrics_file:
+                try: append_metrics(self.metrics_file,job.GetMetrics(object_list))
+                except Exception as e: print(e)
+        return {'gcode':'\n'.join(gcode),'time':gcode_time,'tool_changes':tool_changes,'objects':len(object_list)}
+    
+    def GetWorkerAddress(self,worker):
+        return (self.address[0],self.address[1]+worker+1)
+    
+    def StartWorker(self,worker):
+        #Rhino process running this script as a job server without workers, True once it answers
+        executable = System.Diagnostics.Process.GetCurrentProcess().MainModule.FileName
+        info = System.Diagnostics.ProcessStartInfo(executable,RUNSCRIPT_ARGS % os.path.realpath(__file__))
+        info.UseShellExecute = False
+        info.EnvironmentVariables['LINCAM_SERVER'] = '%s:%s' % self.GetWorkerAddress(worker)
+        info.EnvironmentVariables['LINCAM_WORKERS'] = '0'
+        self.worker_processes[worker] = System.Diagnostics.Process.Start(info)
+        return wait_for_worker(self.GetWorkerAddress(worker),stop=self.stop)
+    
+    def RunWorkerJob(self,worker,data):
+        #The worker gets the preset and postprocessor of this server, a worker that exited is started again
+        process = self.worker_processes[worker]
+        if (process is None or process.HasExited) and not self.StartWorker(worker): raise RuntimeError('worker %s did not start' % worker)
+        data = dict(data)
+        data['preset_data'] = data.get('preset_data') or self.machining_settings[data['preset']]
+        data['post_data'] = data.get('post_data') or self.postprocessors[data['post']]
+        return run_remote_job(self.GetWorkerAddress(worker),data)
+    
+    def ServeWorker(self,worker):
+        #The worker starts with the server so the first job does not wait for Rhino
+        if not self.StartWorker(worker): print('Worker %s did not start' % worker)
+        while not self.stop.is_set(): self.RunNext(1,worker)
+    
+    def StopWorkers(self):
+        self.stop.set()
+        for process in self.worker_processes:
+            if process is not None and not process.HasExited: process.Kill()
+    
+    def Serve(self):
+        #Blocks until the process is stopped, the requests are answered on a thread and the jobs run on the workers or on this one
+        server = self
+        class JobHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def SendJson(self,code,data):
+                body = json.dumps(data)
+                self.send_response(code)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_POST(self):
+                if self.path.rstrip('/') != '/jobs': return self.SendJson(404,{'error':'not found'})
+                try:
+                    data = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length',0))))
+                    job_id = server.Submit(data)
+                except (ValueError,KeyError) as e: return self.SendJson(400,{'error':str(e)})
+                if not job_id: return self.SendJson(503,{'error':'queue full'})
+                self.SendJson(202,{'id':job_id})
+            
+            def do_GET(self):
+                path = self.path.rstrip('/')
+                if path == '/status': return self.SendJson(200,server.GetStatus())
+                job = server.GetJob(path[len('/jobs/'):]) if path.startswith('/jobs/') else None
+                if not job: return self.SendJson(404,{'error':'not found'})
+                self.SendJson(200,job)
+            
+            def log_message(self,format,*args):
+                pass
+        
+        class ThreadedServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+        
+        self.httpd = ThreadedServer(self.address,JobHandler)
+        http_thread = threading.Thread(target=self.httpd.serve_forever)
+        http_thread.daemon = True
+        http_thread.start()
+        for worker in range(self.workers):
+            worker_thread = threading.Thread(target=self.ServeWorker,args=(worker,))
+            worker_thread.daemon = True
+            worker_thread.start()
+        print('%s job server on http://%s:%s, %s' % (PLUGIN_NAME,self.address[0],self.address[1],'%s workers' % self.workers if self.workers else 'one job at a time'))
+        try:
+            while True:
+                if self.workers: time.sleep(1)
+                else: self.RunNext()
+        except KeyboardInterrupt: pass
+        finally:
+            self.StopWorkers()
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+@contextmanager
+def headless_document():
+    #rhinoscriptsyntax works on a new document without views until the block ends. The active document is
+    #global, so it is only swapped on the main thread where the user commands also run.
+    if Rhino.RhinoApp.InvokeRequired: raise RuntimeError('headless documents can only be used on the main thread')
+    doc = Rhino.RhinoDoc.CreateHeadless(None)
+    active_doc = sc.doc
+    sc.doc = doc
+    try: yield doc
+    finally:
+        sc.doc = active_doc
+        doc.Dispose()
+
+def get_objects_by_color(objects):
+    #Splits curves and points by the color of their operation, False when there is nothing to machine
+    points = []
+    cero_point = False
+    curves_inside = []
+    curves_outside = []
+    curves_open = []
+    curves_pocketing = []
+    curve_material = False
+    obj_count = 0
+    valid_objects = []
+    for object in objects:
+        if rs.IsCurve(object):
+            color = rs.ObjectColor(object)
+            rgb = (rs.ColorRedValue(color),rs.ColorGreenValue(color),rs.ColorBlueValue(color))
+            if rs.IsCurveClosed(object):
+                if rgb == (0,0,255):
+                    obj_count += 1
+                    curves_inside.append(object)
+                if rgb == (255,0,0):
+                    obj_count += 1
+                    curves_outside.append(object)
+                if rgb == (255,0,255):
+                    obj_count += 1
+                    curves_pocketing.append(object)
+            if rgb == (0,255,0):
+                obj_count += 1
+                curves_open.append(object)
+            
+            valid_objects.append(object)
+        if rs.IsPoint(object):
+            color = rs.ObjectColor(object)
+            rgb = (rs.ColorRedValue(color),rs.ColorGreenValue(color),rs.ColorBlueValue(color))
+            if rgb == (255,255,255):
+                cero_point = object
+            else:
+                points.append(object)
+                obj_count += 1
+            valid_objects.append(object)
+    
+    rhino_objects = False
+    if obj_count:
+        rhino_objects = {"points":points,"curves_open":curves_open,"curves_pocketing":curves_pocketing,"curves_inside":curves_inside,"curves_outside":curves_outside,"curve_material":curve_material}
+        if cero_point: rhino_objects['cero_point'] = cero_point
+    return rhino_objects,valid_objects
+
+class g_importer(object):
+    #Reads DXF and SVG files one entity at a time, each entity goes to the document as soon as it is read
+    #with the color of its operation so the file is never held in memory.
+    
+    def __init__(self,file_path,layer=False):
+        self.file_path = file_path
+        self.layer = layer
+        self.objects = []
+        self.skipped = {}
+        self.scale = 1.0
+    
+    def run(self):
+        #Returns the ids of the new objects
+        if self.layer and not rs.IsLayer(self.layer): rs.AddLayer(self.layer)
+        extension = os.path.splitext(self.file_path)[1].lower()
+        entities = self.iter_dxf_entities() if extension == '.dxf' else self.iter_svg_entities() if extension == '.svg' else []
+        for entity in entities:
+            self.objects += self.add_entity(entity)
+        return self.objects
+    
+    def add_entity(self,entity):
+        #Returns the ids of the curves, segments that do not join give more than one
+        kind,rgb = entity[0],entity[-1]
+        if kind == 'point': object_id = rs.AddPoint(self.scaled(entity[1]))
+        elif kind == 'line': object_id = rs.AddLine(self.scaled(entity[1]),self.scaled(entity[2]))
+        elif kind == 'circle': object_id = rs.AddCircle(self.scaled(entity[1]),entity[2]*self.scale)
+        elif kind == 'arc': object_id = rs.AddArc3Pt(self.scaled(entity[1]),self.scaled(entity[2]),self.scaled(entity[3]))
+        elif kind == 'nurbs': object_id = rs.AddNurbsCurve([self.scaled(pt) for pt in entity[1]],entity[2],entity[3],entity[4])
+        elif kind == 'interpolated': object_id = rs.AddInterpCurve([self.scaled(pt) for pt in entity[1]])
+        elif kind == 'segments': object_id = self.add_segments(entity[1],entity[2])
+        else: object_id = None
+        object_ids = [crv for crv in (object_id if isinstance(object_id,list) else [object_id]) if crv]
+        for object_id in object_ids:
+            rs.ObjectColor(object_id,rgb)
+            if self.layer: rs.ObjectLayer(object_id,self.layer)
+        return object_ids
+    
+    def scaled(self,point):
+        return (point[0]*self.scale,point[1]*self.scale,point[2]*self.scale if len(point) > 2 else 0)
+    
+    def get_polyline_segments(self,vertices,closed):
+        #Vertices are (x,y,z,bulge), a bulge is the tangent of a quarter of the arc angle
+        segments = []
+        count = len(vertices) if closed else len(vertices)-1
+        for index in range(count):
+            start = vertices[index]
+            end = vertices[(index+1) % len(vertices)]
+            if start[:3] == end[:3]: continue
+            if start[3]: segments.append(('arc',start[:3],end[:3],self.bulge_middle(start,end)))
+            else: segments.append(('line',start[:3],end[:3]))
+        return segments
+    
+    def add_segments(self,segments,closed=False):
+        #Lines, arcs and beziers of one contiguous run joined in as few curves as possible
+        if not segments: return None
+        if len(segments) > 1 and not [segment for segment in segments if segment[0] != 'line']:
+            points = [segments[0][1]] + [segment[2] for segment in segments]
+            return rs.AddPolyline([self.scaled(pt) for pt in points])
+        curves = []
+        for segment in segments:
+            if segment[0] == 'line': curves.append(rs.AddLine(self.scaled(segment[1]),self.scaled(segment[2])))
+            elif segment[0] == 'arc': curves.append(rs.AddArc3Pt(self.scaled(segment[1]),self.scaled(segment[2]),self.scaled(segment[3])))
+            elif segment[0] == 'bezier':
+                degree = len(segment[1])-1
+                curves.append(rs.AddNurbsCurve([self.scaled(pt) for pt in segment[1]],[0]*degree+[1]*degree,degree))
+        curves = [crv for crv in curves if crv]
+        if len(curves) < 2: return curves[0] if curves else None
+        joined = rs.JoinCurves(curves,True)
+        return list(joined) if joined else None
+    
+    def bulge_middle(self,start,end):
+        #Middle point of the arc, positive bulges turn counterclockwise
+        dx,dy = end[0]-start[0],end[1]-start[1]
+        sagitta = start[3]*math.hypot(dx,dy)*.5
+        length = math.hypot(dx,dy)
+        return ((start[0]+end[0])*.5+sagitta*dy/length,(start[1]+end[1])*.5-sagitta*dx/length,(start[2]+end[2])*.5)
+    
+    def skip(self,kind):
+        self.skipped[kind] = self.skipped.get(kind,0)+1
+    
+    def iter_dxf_pairs(self):
+        with open(self.file_path,'r') as f:
+            while True:
+                code = f.readline()
+                value = f.readline()
+                if not value: return
+                yield int(code),value.strip()
+    
+    def iter_dxf_entities(self):
+        #Header units, layer colors and then one entity at a time
+        layer_colors = {}
+        section = None
+        header_name = None
+        entity = None
+        polyline = None
+        for code,value in self.iter_dxf_pairs():
+            if code == 0:
+                if entity:
+                    #Block definitions are only drawn through inserts, which are not read
+                    if entity['type'] == 'LAYER':
+                        layer_colors[entity.get(2,'0')] = abs(int(entity.get(62,7)))
+                    elif entity['type'] == 'VERTEX' and polyline:
+                        polyline['vertices'].append((entity.get(10,0),entity.get(20,0),entity.get(30,0),entity.get(42,0)))
+                    elif entity['type'] == 'POLYLINE' and section == 'ENTITIES':
+                        polyline = entity
+                        polyline['vertices'] = []
+                    elif section == 'ENTITIES':
+                        item = self.get_dxf_entity(entity,layer_colors)
+                        if item: yield item
+                if value == 'SEQEND' and polyline:
+                    item = self.get_dxf_entity(polyline,layer_colors)
+                    polyline = None
+                    if item: yield item
+                entity = {'type':value,'lists':{},'bulges':{}} if value not in ('SECTION','ENDSEC','SEQEND','EOF','TABLE','ENDTAB') else None
+                continue
+            if code == 2 and value in ('HEADER','TABLES','BLOCKS','ENTITIES','OBJECTS','CLASSES') and entity is None:
+                section = value
+                continue
+            if section == 'HEADER':
+                if code == 9: header_name = value
+                elif code == 70 and header_name == '$INSUNITS' and int(value) in DXF_UNITS:
+                    self.scale = rs.UnitScale(rs.UnitSystem(),DXF_UNITS[int(value)])
+                continue
+            if entity is None: continue
+            if code == 42 and entity['type'] == 'LWPOLYLINE':
+                #The bulge belongs to the last vertex read
+                entity['bulges'][len(entity['lists'].get(10,[]))-1] = float(value)
+            elif code in (10,20,30,11,21,31,38,40,41,42,50,51,210,220,230):
+                number = float(value)
+                #Repeated codes are kept in order, the first value is also kept alone
+                entity['lists'].setdefault(code,[]).append(number)
+                entity.setdefault(code,number)
+            elif code in (62,70,71,420): entity[code] = int(value)
+            elif code in (2,8): entity[code] = value
+    
+    def get_dxf_color(self,entity,layer_colors):
+        if 420 in entity: return ((entity[420] >> 16) & 255,(entity[420] >> 8) & 255,entity[420] & 255)
+        aci = entity.get(62,256)
+        if aci in (0,256): aci = layer_colors.get(entity.get(8,'0'),7)
+        return ACI_COLORS.get(aci,(128,128,128))
+    
+    def get_dxf_entity(self,entity,layer_colors):
+        item = self.get_dxf_ocs_entity(entity,layer_colors)
+        #Entities drawn from below are mirrored, the object coordinate system of a -Z extrusion has -X
+        if item and entity.get(230,1) < 0 and entity['type'] in ('CIRCLE','ARC','LWPOLYLINE'):
+            mirror = lambda pt: (-pt[0],pt[1],-pt[2])
+            if item[0] == 'circle': item = ('circle',mirror(item[1]),item[2],item[3])
+            elif item[0] == 'arc': item = ('arc',mirror(item[1]),mirror(item[2]),mirror(item[3]),item[4])
+            else: item = ('segments',[(segment[0],)+tuple([mirror(pt) for pt in segment[1:]]) for segment in item[1]],item[2],item[3])
+        return item
+    
+    def get_dxf_ocs_entity(self,entity,layer_colors):
+        kind = entity['type']
+        rgb = self.get_dxf_color(entity,layer_colors)
+        lists = entity['lists']
+        if kind == 'POINT': return ('point',(entity.get(10,0),entity.get(20,0),entity.get(30,0)),rgb)
+        if kind == 'LINE': return ('line',(entity.get(10,0),entity.get(20,0),entity.get(30,0)),(entity.get(11,0),entity.get(21,0),entity.get(31,0)),rgb)
+        if kind == 'CIRCLE': return ('circle',(entity.get(10,0),entity.get(20,0),entity.get(30,0)),entity.get(40,0),rgb)
+        if kind == 'ARC':
+            cx,cy,cz,radius = entity.get(10,0),entity.get(20,0),entity.get(30,0),entity.get(40,0)
+            start_angle = math.radians(entity.get(50,0))
+            end_angle = math.radians(entity.get(51,0))
+            if end_angle <= start_angle: end_angle += 2*math.pi
+            middle_angle = (start_angle+end_angle)*.5
+            point = lambda angle: (cx+radius*math.cos(angle),cy+radius*math.sin(angle),cz)
+            return ('arc',point(start_angle),point(end_angle),point(middle_angle),rgb)
+        if kind == 'LWPOLYLINE':
+            xs,ys = lists.get(10,[]),lists.get(20,[])
+            elevation = entity.get(38,0)
+            vertices = [(xs[i],ys[i],elevation,entity['bulges'].get(i,0)) for i in range(len(xs))]
+            return ('segments',self.get_polyline_segments(vertices,bool(entity.get(70,0) & 1)),bool(entity.get(70,0) & 1),rgb)
+        if kind == 'POLYLINE':
+            return ('segments',self.get_polyline_segments(entity['vertices'],bool(entity.get(70,0) & 1)),bool(entity.get(70,0) & 1),rgb)
+        if kind == 'SPLINE':
+            points = zip(lists.get(10,[]),lists.get(20,[]),lists.get(30,[0]*len(lists.get(10,[]))))
+            if points:
+                #DXF knots have one more value at each end than Rhino knots
+                knots = lists.get(40,[])[1:-1]
+                weights = lists.get(41) if entity.get(70,0) & 4 else None
+                return ('nurbs',points,knots,entity.get(71,3),weights,rgb)
+            fit_points = zip(lists.get(11,[]),lists.get(21,[]),lists.get(31,[0]*len(lists.get(11,[]))))
+            if fit_points: return ('interpolated',fit_points,rgb)
+        self.skip(kind)
+        return None
+    
+    def iter_svg_entities(self):
+        #System.Xml reads the file as a stream, transforms and colors are inherited through a stack
+        import clr
+        clr.AddReference('System.Xml')
+        import System.Xml
+        settings = System.Xml.XmlReaderSettings()
+        settings.DtdProcessing = System.Xml.DtdProcessing.Ignore
+        reader = System.Xml.XmlReader.Create(self.file_path,settings)
+        stack = []
+        height = 0
+        try:
+            while reader.Read():
+                if reader.NodeType == System.Xml.XmlNodeType.EndElement:
+                    if stack: stack.pop()
+                    continue
+                if reader.NodeType != System.Xml.XmlNodeType.Element: continue
+                attributes = {}
+                if reader.HasAttributes:
+                    while reader.MoveToNextAttribute(): attributes[reader.LocalName] = reader.Value
+                    reader.MoveToElement()
+                name = reader.LocalName
+                parent = stack[-1] if stack else {'matrix':(1,0,0,1,0,0),'stroke':None,'fill':None,'hidden':False}
+                style = dict([[part.strip() for part in item.split(':',1)] for item in attributes.get('style','').split(';') if ':' in item])
+                #Definitions are only drawn through references, which are not read
+                hidden = parent['hidden'] or name in ('defs','clipPath','mask','symbol','marker','pattern') or style.get('display',attributes.get('display')) == 'none'
+                state = {'matrix':self.svg_multiply(parent['matrix'],self.svg_transform(attributes.get('transform',''))),
+                         'stroke':style.get('stroke',attributes.get('stroke',parent['stroke'])),
+                         'fill':style.get('fill',attributes.get('fill',parent['fill'])),
+                         'hidden':hidden}
+                if name == 'svg' and not stack:
+                    height = self.svg_size(attributes,state)
+                    state['matrix'] = self.svg_multiply((1,0,0,-1,0,height),state['matrix'])
+                if not reader.IsEmptyElement: stack.append(state)
+                if hidden: continue
+                for item in self.get_svg_entities(name,attributes,state): yield item
+        finally:
+            reader.Close()
+    
+    def svg_size(self,attributes,state):
+        #Millimeters per user unit from width and viewBox, returns the height to flip the y axis
+        def length(text):
+            text = text.strip()
+            unit = text.lstrip('0123456789.+-eE')
+            return float(text[:len(text)-len(unit)]),unit
+        view_box = [float(value) for value in attributes.get('viewBox','').replace(',',' ').split()]
+        scale = SVG_UNITS['px']
+        if 'width' in attributes and not attributes['width'].endswith('%'):
+            width,unit = length(attributes['width'])
+            scale = SVG_UNITS.get(unit,SVG_UNITS['px'])
+            if len(view_box) == 4 and view_box[2]: scale *= width/view_box[2]
+        self.scale = scale*rs.UnitScale(rs.UnitSystem(),2)
+        if len(view_box) == 4:
+            state['matrix'] = self.svg_multiply(state['matrix'],(1,0,0,1,-view_box[0],-view_box[1]))
+            return view_box[3]
+        return length(attributes['height'])[0] if 'height' in attributes and not attributes['height'].endswith('%') else 0
+    
+    def svg_numbers(self,text):
+        numbers = []
+        for token in text.replace(',',' ').replace('-',' -').replace('e -','e-').replace('E -','E-').split():
+            #Tokens like .5.5 hold two numbers
+            parts = token.split('.')
+            if len(parts) > 2:
+                numbers.append(float('.'.join(parts[:2])))
+                numbers += [float('.'+part) for part in parts[2:]]
+            else: numbers.append(float(token))
+        return numbers
+    
+    def svg_transform(self,text):
+        matrix = (1,0,0,1,0,0)
+        for item in text.split(')'):
+            if '(' not in item: continue
+            name,values = item.split('(')
+            name = name.strip(' ,')
+            values = self.svg_numbers(values)
+            if name == 'matrix' and len(values) == 6: step = tuple(values)
+            elif name == 'translate': step = (1,0,0,1,values[0],values[1] if len(values) > 1 else 0)
+            elif name == 'scale': step = (values[0],0,0,values[1] if len(values) > 1 else values[0],0,0)
+            elif name == 'rotate':
+                angle = math.radians(values[0])
+                step = (math.cos(angle),math.sin(angle),-math.sin(angle),math.cos(angle),0,0)
+                if len(values) == 3: step = self.svg_multiply(self.svg_multiply((1,0,0,1,values[1],values[2]),step),(1,0,0,1,-values[1],-values[2]))
+            elif name == 'skewX': step = (1,0,math.tan(math.radians(values[0])),1,0,0)
+            elif name == 'skewY': step = (1,math.tan(math.radians(values[0])),0,1,0,0)
+            else: continue
+            matrix = self.svg_multiply(matrix,step)
+        return matrix
+    
+    def svg_multiply(self,m1,m2):
+        a1,b1,c1,d1,e1,f1 = m1
+        a2,b2,c2,d2,e2,f2 = m2
+        return (a1*a2+c1*b2,b1*a2+d1*b2,a1*c2+c1*d2,b1*c2+d1*d2,a1*e2+c1*f2+e1,b1*e2+d1*f2+f1)
+    
+    def svg_color(self,text):
+        if not text: return None
+        text = text.strip().lower()
+        if text == 'none': return None
+        if text in SVG_COLORS: return SVG_COLORS[text]
+        if text.startswith('#') and len(text) == 4: return tuple([int(c*2,16) for c in text[1:]])
+        if text.startswith('#') and len(text) == 7: return (int(text[1:3],16),int(text[3:5],16),int(text[5:7],16))
+        if text.startswith('rgb('): return tuple([int(float(v)) for v in text[4:-1].split(',')][:3])
+        return (128,128,128)
+    
+    def get_svg_entities(self,name,attributes,state):
+        matrix = state['matrix']
+        point = lambda x,y: (matrix[0]*x+matrix[2]*y+matrix[4],matrix[1]*x+matrix[3]*y+matrix[5],0)
+        rgb = self.svg_color(state['stroke'])
+        value = lambda key: float(attributes.get(key,0) or 0)
+        if name == 'circle' and not rgb and self.svg_color(state['fill']):
+            #Filled circles without stroke are drill points
+            return [('point',point(value('cx'),value('cy')),self.svg_color(state['fill']))]
+        if not rgb: 
+            if name in ('line','polyline','polygon','rect','circle','ellipse','path'): self.skip(name)
+            return []
+        if name == 'line': return [('line',point(value('x1'),value('y1')),point(value('x2'),value('y2')),rgb)]
+        if name in ('polyline','polygon'):
+            numbers = self.svg_numbers(attributes.get('points',''))
+            points = [point(numbers[i],numbers[i+1]) for i in range(0,len(numbers)-1,2)]
+            if name == 'polygon' and points: points.append(points[0])
+            return [('segments',[('line',points[i],points[i+1]) for i in range(len(points)-1)],name == 'polygon',rgb)]
+        if name == 'rect':
+            x,y,w,h = value('x'),value('y'),value('width'),value('height')
+            points = [point(x,y),point(x+w,y),point(x+w,y+h),point(x,y+h),point(x,y)]
+            return [('segments',[('line',points[i],points[i+1]) for i in range(4)],True,rgb)]
+        if name in ('circle','ellipse'):
+            cx,cy = value('cx'),value('cy')
+            rx = value('r') if name == 'circle' else value('rx')
+            ry = value('r') if name == 'circle' else value('ry')
+            scale_x,scale_y = math.hypot(matrix[0],matrix[1]),math.hypot(matrix[2],matrix[3])
+            if name == 'circle' and abs(scale_x-scale_y) < 1e-9 and abs(matrix[0]*matrix[2]+matrix[1]*matrix[3]) < 1e-9:
+                return [('circle',point(cx,cy),rx*scale_x,rgb)]
+            points = [point(cx+rx*math.cos(math.radians(angle)),cy+ry*math.sin(math.radians(angle))) for angle in range(0,361,5)]
+            return [('segments',[('line',points[i],points[i+1]) for i in range(len(points)-1)],True,rgb)]
+        if name == 'path':
+            #One curve for each subpath so holes and separate outlines stay apart
+            return [('segments',segments,closed,rgb) for segments,closed in self.svg_path(attributes.get('d',''),point) if segments]
+        return []
+    
+    def svg_path(self,text,point):
+        #Segments and closed flag of each subpath, every move starts a new one. Arcs are sampled as lines
+        tokens = []
+        for char in text:
+            if char.isalpha() and char not in 'eE': tokens.append(char)
+            elif tokens: tokens[-1] += char
+        subpaths = []
+        segments = []
+        x,y = 0,0
+        start = (0,0)
+        control = None
+        for token in tokens:
+            command,numbers = token[0],self.svg_numbers(token[1:])
+            relative = command.islower()
+            command = command.upper()
+            if command == 'Z':
+                if (x,y) != start: segments.append(('line',point(x,y),point(*start)))
+                if segments: subpaths.append((segments,True))
+                segments = []
+                x,y = start
+                continue
+            size = {'M':2,'L':2,'H':1,'V':1,'C':6,'S':4,'Q':4,'T':2,'A':7}.get(command,0)
+            if not size: continue
+            for index in range(0,len(numbers)-size+1,size):
+                values = numbers[index:index+size]
+                ox,oy = (x,y) if relative else (0,0)
+                if command == 'M' and index == 0:
+                    if segments: subpaths.append((segments,False))
+                    segments = []
+                    x,y = ox+values[0],oy+values[1]
+                    start = (x,y)
+                    continue
+                if command in ('M','L','T'):
+                    end = (ox+values[0],oy+values[1])
+                    if command == 'T':
+                        c1 = (2*x-control[0],2*y-control[1]) if control else (x,y)
+                        segments.append(('bezier',[point(x,y),point(*c1),point(*end)]))
+                        control = c1
+                    else: segments.append(('line',point(x,y),point(*end)))
+                elif command in ('H','V'):
+                    end = (ox+values[0],y) if command == 'H' else (x,oy+values[0])
+                    segments.append(('line',point(x,y),point(*end)))
+                elif command in ('C','S'):
+                    if command == 'C': c1 = (ox+values[0],oy+values[1]); values = values[2:]
+                    else: c1 = (2*x-control[0],2*y-control[1]) if control else (x,y)
+                    c2 = (ox+values[0],oy+values[1])
+                    end = (ox+values[2],oy+values[3])
+                    segments.append(('bezier',[point(x,y),point(*c1),point(*c2),point(*end)]))
+                    control = c2
+                elif command == 'Q':
+                    c1 = (ox+values[0],oy+values[1])
+                    end = (ox+values[2],oy+values[3])
+                    segments.append(('bezier',[point(x,y),point(*c1),point(*end)]))
+                    control = c1
+                elif command == 'A':
+                    end = (ox+values[5],oy+values[6])
+                    arc_points = self.svg_arc((x,y),end,values[0],values[1],values[2],values[3],values[4])
+                    segments += [('line',point(*arc_points[i]),point(*arc_points[i+1])) for i in range(len(arc_points)-1)]
+                if command not in ('C','S','Q','T'): control = None
+                x,y = end
+        if segments: subpaths.append((segments,False))
+        return subpaths
+    
+    def svg_arc(self,start,end,rx,ry,rotation,large_arc,sweep):
+        #Endpoint to center conversion of the SVG specification, the arc is returned every 5 degrees
+        if not rx or not ry or start == end: return [start,end]
+        angle = math.radians(rotation)
+        cos_a,sin_a = math.cos(angle),math.sin(angle)
+        dx,dy = (start[0]-end[0])*.5,(start[1]-end[1])*.5
+        x1,y1 = cos_a*dx+sin_a*dy,-sin_a*dx+cos_a*dy
+        rx,ry = abs(rx),abs(ry)
+        radii = (x1*x1)/(rx*rx)+(y1*y1)/(ry*ry)
+        if radii > 1: rx,ry = rx*math.sqrt(radii),ry*math.sqrt(radii)
+        factor = math.sqrt(max(0,(rx*rx*ry*ry-rx*rx*y1*y1-ry*ry*x1*x1)/(rx*rx*y1*y1+ry*ry*x1*x1)))
+        if bool(large_arc) == bool(sweep): factor = -factor
+        cx1,cy1 = factor*rx*y1/ry,-factor*ry*x1/rx
+        cx = cos_a*cx1-sin_a*cy1+(start[0]+end[0])*.5
+        cy = sin_a*cx1+cos_a*cy1+(start[1]+end[1])*.5
+        start_angle = math.atan2((y1-cy1)/ry,(x1-cx1)/rx)
+        delta = math.atan2((-y1-cy1)/ry,(-x1-cx1)/rx)-start_angle
+        if sweep and delta < 0: delta += 2*math.pi
+        if not sweep and delta > 0: delta -= 2*math.pi
+        steps = max(2,int(abs(math.degrees(delta))/5))
+        points = []
+        for step in range(steps+1):
+            t = start_angle+delta*step/steps
+            px,py = rx*math.cos(t),ry*math.sin(t)
+            points.append((cos_a*px-sin_a*py+cx,sin_a*px+cos_a*py+cy))
+        points[-1] = end
+        return points
+
+class g_points(object):
+    #Packed toolpath points, xyz and arc center offsets as doubles, feed as float and the move kind as a byte
+    __slots__ = ('xyz','ij','feed','kind')
+    
+    def __init__(self):
+        self.xyz = array('d')
+        self.ij = array('d')
+        self.feed = array('f')
+        self.kind = array('B')
+    
+    def __len__(self):
+        return len(self.kind)
+    
+    def append(self,point,feed,kind=MOVE_CUT,center_offset=(0,0)):
+        self.xyz.append(point[0])
+        self.xyz.append(point[1])
+        self.xyz.append(point[2])
+        self.ij.append(center_offset[0])
+        self.ij.append(center_offset[1])
+        self.feed.append(feed)
+        self.kind.append(kind)
+    
+    def view(self):
+        return g_points_view(self)
+    
+    def dumps(self):
+        #Buffers as base64 text for the toolpath cache in the document
+        return dict((name,base64.b64encode(getattr(self,name).tostring())) for name in self.__slots__)
+    
+    def transformed(self,angle,origin,target):
+        #Copy rotated by angle around origin and moved to target, z does not change
+        points = g_points()
+        cos_angle,sin_angle = math.cos(angle),math.sin(angle)
+        ox,oy = origin
+        tx,ty = target
+        xyz,ij = self.xyz,self.ij
+        for index in range(len(self.kind)):
+            dx,dy = xyz[3*index]-ox,xyz[3*index+1]-oy
+            points.xyz.append(tx+cos_angle*dx-sin_angle*dy)
+            points.xyz.append(ty+sin_angle*dx+cos_angle*dy)
+            points.xyz.append(xyz[3*index+2])
+            i,j = ij[2*index],ij[2*index+1]
+            points.ij.append(cos_angle*i-sin_angle*j)
+            points.ij.append(sin_angle*i+cos_angle*j)
+        points.feed.extend(self.feed)
+        points.kind.extend(self.kind)
+        return points
+    
+    @staticmethod
+    def loads(data):
+        points = g_points()
+        for name in points.__slots__:
+            getattr(points,name).fromstring(base64.b64decode(data[name]))
+        return points
+
+class g_points_view(object):
+    #Read only access to g_points, values are read straight from the buffers
+    __slots__ = ('_points',)
+    
+    def __init__(self,points):
+        self._points = points
+    
+    def __len__(self):
+        return len(self._points.kind)
+    
+    def __getitem__(self,index):
+        return self.point(index)+(self.feed(index),self.kind(index))
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+    
+    def point(self,index):
+        if index < 0: index += len(self)
+        xyz = self._points.xyz
+        return (xyz[3*index],xyz[3*index+1],xyz[3*index+2])
+    
+    def center_offset(self,index):
+        if index < 0: index += len(self)
+        return (self._points.ij[2*index],self._points.ij[2*index+1])
+    
+    def feed(self,index):
+        return self._points.feed[index]
+    
+    def kind(self,index):
+        return self._points.kind[index]
+    
+    def buffers(self):
+        #Raw arrays for passes that walk the whole toolpath, they must not be modified
+        return self._points.xyz,self._points.ij,self._points.feed,self._points.kind
+
+#Line templates of the postprocessor, default template and the fields each one can use
+POST_TEMPLATES = OrderedDict([
+    ("rapid_template",("{word} {x}{y}{z} {f}",("word","x","y","z","f"))),
+    ("linear_template",("{word} {x}{y}{z} {f}",("word","x","y","z","f"))),
+    ("arc_template",("{word} {x}{y}{z} {i}{j} {f}",("word","x","y","z","i","j","f"))),
+    ("drill_template",("G98 {cycle} {x}{y} {z} {r} {q}{p} {f}",("cycle","x","y","z","r","q","p","f"))),
+    ("comment",("",("text",))),
+    ])
+TOOL_CHANGE_FIELDS = ("tool","diam","spindle","sec_plane")
+#Fields of the level repetition lines and number of the first one
+LOOP_FIELDS = ("number","count")
+LOOP_FIRST_NUMBER = 1000
+
+def compile_template(template,fields):
+    #Template with {field} names turned into a %(field)s string, unknown fields raise ValueError
+    compiled = ''
+    for literal,field,format_spec,conversion in string.Formatter().parse(template):
+        compiled += literal.replace('%','%%')
+        if field is None: continue
+        if field not in fields: raise ValueError(field)
+        compiled += '%%(%s)s' % field
+    return compiled
+
+def validate_post(post,post_input):
+    #Errors of a postprocessor against the POST_INPUT schema, missing values take their defaults later
+    errors = []
+    for input_data in post_input:
+        name = input_data['var']
+        if name not in post: continue
+        value = post[name]
+        if input_data['type'] == 'number' and not isinstance(value,(int,float)): errors.append(name)
+        elif input_data['type'] == 'list' and not isinstance(value,list): errors.append(name)
+        elif input_data['type'] == 'string' and not isinstance(value,basestring): errors.append(name)
+    for name,(default,fields) in POST_TEMPLATES.items():
+        try: compile_template(post.get(name,default),fields)
+        except ValueError as e: errors.append('%s {%s}' % (name,e))
+    for line in post.get('tool_change',[]):
+        try: compile_template(line,TOOL_CHANGE_FIELDS)
+        except ValueError as e: errors.append('tool_change {%s}' % e)
+    for name in ('loop_start','loop_end','loop_call'):
+        for line in post.get(name,[]):
+            try: compile_template(line,LOOP_FIELDS)
+            except ValueError as e: errors.append('%s {%s}' % (name,e))
+    return errors
+
+class g_formatter(object):
+    #Postprocessor compiled once, templates become format strings and the modal rules flags
+    __slots__ = ('decimals','scale','rapid','cut','feed','fixed','templates','modal_word','modal_feed','modal_axes','line_step')
+    
+    def __init__(self,post):
+        self.decimals = int(post.get('round_tol',2))
+        self.scale = 10**self.decimals
+        self.rapid = post['rapid']
+        self.cut = post['cut']
+        self.feed = post['feed']
+        #One rounding for every number, the axes and the arc offsets
+        self.fixed = self.round_half_away if post.get('fixed_point',0) else self.round_float
+        self.templates = dict((name,compile_template(post.get(name,default),fields)) for name,(default,fields) in POST_TEMPLATES.items())
+        modal = [word.strip().upper() for word in post.get('modal',['G','F'])]
+        self.modal_word = 'G' in modal
+        self.modal_feed = 'F' in modal
+        self.modal_axes = 'XYZ' in modal
+        self.line_step = int(post.get('line_numbers',0))
+    
+    def round_half_away(self,value):
+        #Value as an integer count of the last decimal, halves go away from zero
+        fixed_value = int(math.floor(abs(value)*self.scale+.5))
+        return fixed_value if value >= 0 else -fixed_value
+    
+    def round_float(self,value):
+        #Value as an integer count of the last decimal rounded as the float text, from the exact binary value
+        return int(('%.*f' % (self.decimals,value)).replace('.',''))
+    
+    def fixed_text(self,fixed_value):
+        whole,fraction = divmod(abs(fixed_value),self.scale)
+        sign = '-' if fixed_value < 0 else ''
+        if not fraction: return '%s%d' % (sign,whole)
+        return ('%s%d.%0*d' % (sign,whole,self.decimals,fraction)).rstrip('0')
+    
+    def number(self,value):
+        return self.fixed_text(self.fixed(value))
+    
+    def format_block(self,toolpath,start=0,end=None):
+        #One line per point, the modal words are only written when they change
+        xyz,ij,feed,kind = toolpath.buffers()
+        end = len(kind) if end is None else end
+        number = self.number
+        fixed = self.fixed
+        fixed_text = self.fixed_text
+        rapid_word = self.rapid
+        cut_word = self.cut
+        feed_word = self.feed
+        modal_word = self.modal_word
+        modal_feed = self.modal_feed
+        modal_axes = self.modal_axes
+        rapid_template = self.templates['rapid_template']
+        linear_template = self.templates['linear_template']
+        arc_template = self.templates['arc_template']
+        lines = []
+        last_word = None
+        last_feed = None
+        last_axes = None
+        for i in range(start,end):
+            k = kind[i]
+            x = xyz[3*i]
+            y = xyz[3*i+1]
+            axes = ('X'+number(x),'Y'+number(y),'Z'+number(xyz[3*i+2]))
+            if modal_axes and last_axes: values = {'x':'' if axes[0] == last_axes[0] else axes[0],'y':'' if axes[1] == last_axes[1] else axes[1],'z':'' if axes[2] == last_axes[2] else axes[2]}
+            else: values = {'x':axes[0],'y':axes[1],'z':axes[2]}
+            last_axes = axes
+            if k & (MOVE_ARC_CW | MOVE_ARC_CCW):
+                #The center offset is taken between rounded values so the arc radius matches on the controller
+                sx = xyz[3*i-3]
+                sy = xyz[3*i-2]
+                word = 'G02' if k & MOVE_ARC_CW else 'G03'
+                values['word'] = word
+                values['i'] = 'I'+fixed_text(fixed(sx+ij[2*i])-fixed(sx))
+                values['j'] = 'J'+fixed_text(fixed(sy+ij[2*i+1])-fixed(sy))
+                template = arc_template
+            else:
+                word = rapid_word if k & 3 == MOVE_RAPID else cut_word
+                values['word'] = '' if modal_word and word == last_word else word
+                template = rapid_template if word == rapid_word else linear_template
+            f = int(feed[i])
+            values['f'] = '' if modal_feed and f == last_feed else '%s%s' % (feed_word,f)
+            last_feed = f
+            last_word = word
+            lines.append(' '.join((template % values).split()))
+        return lines
+    
+    def format_incremental(self,toolpath,start,end):
+        #Lines of the moves to the points start to end-1 as increments of the previous point, the axes that
+        #do not move are left out and the first line has every modal word
+        xyz,ij,feed,kind = toolpath.buffers()
+        fixed = self.fixed
+        fixed_text = self.fixed_text
+        lines = []
+        last_word = None
+        last_feed = None
+        for i in range(start,end):
+            k = kind[i]
+            deltas = [fixed(xyz[3*i+axis])-fixed(xyz[3*i+axis-3]) for axis in range(3)]
+            values = dict((name,'%s%s' % (name.upper(),fixed_text(delta)) if delta else '') for name,delta in zip('xyz',deltas))
+            if k & (MOVE_ARC_CW | MOVE_ARC_CCW):
+                sx = xyz[3*i-3]
+                sy = xyz[3*i-2]
+                word = 'G02' if k & MOVE_ARC_CW else 'G03'
+                values['word'] = word
+                values['i'] = 'I'+fixed_text(fixed(sx+ij[2*i])-fixed(sx))
+                values['j'] = 'J'+fixed_text(fixed(sy+ij[2*i+1])-fixed(sy))
+                template = self.templates['arc_template']
+            else:
+                word = self.rapid if k & 3 == MOVE_RAPID else self.cut
+                values['word'] = '' if self.modal_word and word == last_word else word
+                template = self.templates['rapid_template'] if word == self.rapid else self.templates['linear_template']
+            f = int(feed[i])
+            values['f'] = '' if self.modal_feed and f == last_feed else '%s%s' % (self.feed,f)
+            last_feed = f
+            last_word = word
+            lines.append(' '.join((template % values).split()))
+        return lines
+    
+    def find_loops(self,toolpath,min_length=4):
+        #Z levels of a toolpath as (anchor,length,count): the moves to the length points after the anchor are
+        #repeated count times with the same increments and end over the anchor, only lower or higher.
+        #Candidates are the later points over the anchor, the run of equal moves gives the repetitions.
+        xyz,ij,feed,kind = toolpath.buffers()
+        fixed = self.fixed
+        size = len(kind)
+        points = [(fixed(xyz[3*i]),fixed(xyz[3*i+1]),fixed(xyz[3*i+2])) for i in range(size)]
+        moves = [None] + [(points[i][0]-points[i-1][0],points[i][1]-points[i-1][1],points[i][2]-points[i-1][2],kind[i],int(feed[i]),
+                           fixed(ij[2*i]),fixed(ij[2*i+1])) for i in range(1,size)]
+        over = {}
+        for i,point in enumerate(points): over.setdefault(point[:2],[]).append(i)
+        loops = []
+        anchor = 0
+        while anchor < size - 2*min_length:
+            loop = None
+            for other in over[points[anchor][:2]]:
+                length = other - anchor
+                if length < min_length or points[other][2] == points[anchor][2]: continue
+                if anchor + 2*length >= size: break
+                run = 0
+                while anchor + run + 1 + length < size and moves[anchor+run+1] == moves[anchor+run+1+length]: run += 1
+                if run >= length:
+                    loop = (anchor,length,run//length + 1)
+                    break
+            if loop:
+                loops.append(loop)
+                anchor += loop[1]*loop[2]
+            else: anchor += 1
+        return loops
+    
+    def format_move(self,x=None,y=None,z=None,feed=None,rapid=True):
+        #Single move outside a toolpath block, the missing axes are left out
+        number = self.number
+        values = {'word':self.rapid if rapid else self.cut,
+                  'x':'' if x is None else 'X'+number(x),
+                  'y':'' if y is None else 'Y'+number(y),
+                  'z':'' if z is None else 'Z'+number(z),
+                  'f':'' if feed is None else '%s%s' % (self.feed,int(feed))}
+        template = self.templates['rapid_template'] if rapid else self.templates['linear_template']
+        return ' '.join((template % values).split())
+    
+    def format_drill(self,values):
+        return ' '.join((self.templates['drill_template'] % values).split())
+    
+    def format_comment(self,text):
+        #Empty when the postprocessor has no comment template
+        if not self.templates['comment']: return []
+        return [self.templates['comment'] % {'text':text}]
+    
+    def is_numbered(self,line):
+        #Empty lines, tape marks and program numbers (O1000, :1000) take no line number, Fanuc rejects N before O
+        if not line or line[0] == '%': return False
+        return not (line[0] in 'O:' and line[1:].split(' ')[0].split('(')[0].isdigit())
+    
+    def number_lines(self,lines,line_number=0):
+        #Line numbers continue from line_number, see is_numbered for the lines that are left as they are
+        if not self.line_step: return lines
+        numbered = []
+        for line in lines:
+            if self.is_numbered(line):
+                line_number += self.line_step
+                line = 'N%d %s' % (line_number,line)
+            numbered.append(line)
+        return numbered
+
+class g_program_writer(object):
+    #Writes the program block by block, a new file is started on a safe block when the limits would be passed.
+    #A file that still passes them, because one object does not fit in a file, is marked as oversized.
+    
+    def __init__(self,file_path,formatter,start_lines,end_lines,max_lines=0,max_bytes=0):
+        self.file_path = file_path
+        self.formatter = formatter
+        self.start_lines = start_lines
+        self.end_lines = end_lines
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.split = bool(max_lines or max_bytes)
+        self.chunks = []
+        self.file = None
+        self.line_number = 0
+        self.end_size = self.get_size(formatter.number_lines(end_lines,10**6))
+        #Subprograms called from the current file, they are written after its end lines
+        self.subprograms = []
+    
+    def get_size(self,lines):
+        return sum([len(line)+len(os.linesep) for line in lines])
+    
+    def open_chunk(self,resume=[]):
+        #The resume lines restore the tool of the block the file starts with
+        if self.split:
+            base,extension = os.path.splitext(self.file_path)
+            path = '%s_%02d%s' % (base,len(self.chunks)+1,extension or '.nc')
+        else: path = self.file_path
+        self.file = open(path,'w')
+        self.chunks.append({'file':os.path.basename(path),'path':path,'lines':0,'bytes':0,'blocks':0,'oversized':False})
+        self.line_number = 0
+        self.write_lines(self.formatter.number_lines(self.start_lines + resume))
+    
+    def close_chunk(self):
+        self.write_lines(self.formatter.number_lines(self.end_lines,self.line_number))
+        if self.subprograms: self.write_lines(self.formatter.number_lines(self.subprograms,self.line_number))
+        self.subprograms = []
+        self.file.close()
+        self.file = None
+        chunk = self.chunks[-1]
+        chunk['oversized'] = bool(self.max_lines and chunk['lines'] > self.max_lines or self.max_bytes and chunk['bytes'] > self.max_bytes)
+    
+    def write_lines(self,lines):
+        chunk = self.chunks[-1]
+        for line in lines:
+            self.file.write(line+'\n')
+            if self.formatter.is_numbered(line): self.line_number += self.formatter.line_step
+        chunk['lines'] += len(lines)
+        chunk['bytes'] += self.get_size(lines)
+    
+    def is_full(self,lines):
+        chunk = self.chunks[-1]
+        if not chunk['blocks']: return False
+        if self.max_lines and chunk['lines'] + len(lines) + len(self.end_lines) + len(self.subprograms) > self.max_lines: return True
+        if self.max_bytes and chunk['bytes'] + self.get_size(lines) + self.end_size + self.get_size(self.subprograms) > self.max_bytes: return True
+        return False
+    
+    def add_block(self,lines,safe=False,subprograms=[],resume=[]):
+        #The subprograms of the block go to the file the block is written to
+        if self.file is None: self.open_chunk()
+        numbered = self.formatter.number_lines(lines,self.line_number)
+        if safe and self.split and self.is_full(numbered + subprograms):
+            self.close_chunk()
+            self.open_chunk(resume)
+            numbered = self.formatter.number_lines(lines,self.line_number)
+        self.write_lines(numbered)
+        self.subprograms += subprograms
+        self.chunks[-1]['blocks'] += 1
+    
+    def close(self):
+        #Returns the written files, the manifest goes last when the program was split
+        if self.file is None: self.open_chunk()
+        self.close_chunk()
+        paths = [chunk['path'] for chunk in self.chunks]
+        if self.split:
+            manifest_path = '%s_manifest.json' % os.path.splitext(self.file_path)[0]
+            manifest = {'program':os.path.basename(self.file_path),
+                        'files':[dict((key,chunk[key]) for key in ('file','lines','bytes','oversized')) for chunk in self.chunks]}
+            with open(manifest_path,'w') as f:
+                f.write(json.dumps(manifest,indent=4))
+            paths.append(manifest_path)
+        return paths
+
+#Preset section of each operation
+PRESET_SECTIONS = {"points":"barrenado","curves_open":"grabado","curves_pocketing":"desbaste","curves_outside":"corte","curves_inside":"corte"}
+#Names of the operations on the reports
+OPERATION_NAMES = OrderedDict([("curves_outside","Corte exterior"),("curves_inside","Corte interior"),("curves_pocketing","Desbaste"),("curves_rest","Desbaste de restos"),
+                               ("curves_open","Grabado"),("points","Barrenado")])
+#Colors of the moves and labels on the job sheet
+REPORT_COLORS = {"rapid":(170,170,170),"plunge":(230,150,0),"cut":(40,110,200),"text":(40,40,40),"cluster":(200,0,0)}
+
+class g_report(object):
+    #Job sheet drawn from the toolpath points as a top view with the order and cluster numbers, times and
+    #a table per operation. Nothing goes through the document or the viewports.
+    
+    def __init__(self,width=1200,max_plot_height=800,translate=False):
+        self.width = width
+        self.height = 0
+        self.max_plot_height = max_plot_height
+        self.margin = 40
+        self.line_height = 22
+        self.txt = translate if translate else self.no_translation
+        self.items = []
+    
+    def no_translation(self,text):
+        return text
+    
+    def add_text(self,x,y,text,size=14,color=REPORT_COLORS["text"],anchor="start"):
+        self.items.append(("text",x,y,text,size,color,anchor))
+    
+    def add_polyline(self,points,color,width=1):
+        if len(points) > 1: self.items.append(("polyline",points,color,width))
+    
+    def get_moves(self,obj):
+        #(state,x,y) of every move, arcs sampled
+        toolpath = obj.toolpath
+        states = dict((kind,name) for name,kind in MOVE_STATES.items())
+        moves = [("rapid",toolpath.point(0)[0],toolpath.point(0)[1])]
+        for index in range(1,len(toolpath)):
+            kind = toolpath.kind(index)
+            state = states[kind & 3]
+            if kind & (MOVE_ARC_CW | MOVE_ARC_CCW):
+                for point in obj.get_arc_points(toolpath.point(index-1),toolpath.point(index),toolpath.center_offset(index),kind):
+                    moves.append((state,point[0],point[1]))
+            else:
+                point = toolpath.point(index)
+                moves.append((state,point[0],point[1]))
+        return moves
+    
+    def build(self,object_list,cero,header,times,operations):
+        #header is a list of lines, times the minutes per move state and operations the rows per cam type
+        margin,line_height = self.margin,self.line_height
+        paths = [self.get_moves(obj) for obj in object_list if len(obj.points)]
+        xs = [move[1] for moves in paths for move in moves] or [0]
+        ys = [move[2] for moves in paths for move in moves] or [0]
+        min_x,max_x,min_y,max_y = min(xs),max(xs),min(ys),max(ys)
+        plot_width = self.width - 2*margin
+        size_x,size_y = max(max_x-min_x,1e-6),max(max_y-min_y,1e-6)
+        scale = min(plot_width/size_x,self.max_plot_height/size_y)
+        plot_top = margin + line_height*(len(header)+1)
+        plot_height = size_y*scale
+        def to_sheet(x,y):
+            return (margin + (x-min_x)*scale,plot_top + (max_y-y)*scale)
+        
+        for index,line in enumerate(header):
+            self.add_text(margin,margin + line_height*index,line,18 if not index else 14)
+        #Toolpath, one polyline per run of the same state without points closer than half a pixel
+        last_point = None
+        for moves in paths:
+            if last_point: self.add_polyline([last_point,to_sheet(moves[0][1],moves[0][2])],REPORT_COLORS["rapid"])
+            run_state,run = moves[0][0],[to_sheet(moves[0][1],moves[0][2])]
+            for state,x,y in moves[1:]:
+                point = to_sheet(x,y)
+                if state != run_state:
+                    self.add_polyline(run,REPORT_COLORS[run_state],1.5 if run_state == "cut" else 1)
+                    run_state,run = state,[run[-1]]
+                if abs(point[0]-run[-1][0]) + abs(point[1]-run[-1][1]) >= .5: run.append(point)
+            if len(run) == 1: run.append(run[0])
+            self.add_polyline(run,REPORT_COLORS[run_state],1.5 if run_state == "cut" else 1)
+            last_point = run[-1]
+        #Order and cluster numbers where the text dots go
+        for index,obj in enumerate(object_list):
+            x,y = to_sheet(obj.start_point[0]-cero[0],obj.start_point[1]-cero[1])
+            self.add_text(x+3,y-3,str(index+1),11)
+            if obj.iscluster:
+                x,y = to_sheet(obj.point[0]-cero[0],obj.point[1]-cero[1])
+                self.add_text(x,y,"%s %s" % (self.txt('Pieza'),obj.asignedcluster),13,REPORT_COLORS["cluster"],"middle")
+        x,y = to_sheet(0,0)
+        if 0 <= x <= self.width and plot_top <= y <= plot_top + plot_height: self.add_text(x,y+5,"+",16,REPORT_COLORS["cluster"],"middle")
+        
+        #Times and table per operation
+        top = plot_top + plot_height + line_height*2
+        for index,(name,label) in enumerate((("cut","Corte"),("plunge","Bajada"),("rapid","Rapido"))):
+            self.add_text(margin + index*220,top,"%s: %s min" % (self.txt(label),round(times.get(name,0),1)),14,REPORT_COLORS[name])
+        top += line_height*2
+        columns = [(self.txt('Operacion'),margin),(self.txt('Objetos'),margin+260),(self.txt('Herramienta'),margin+380),(self.txt('Minutos'),margin+520)]
+        for title,x in columns: self.add_text(x,top,title,14)
+        for name,row in operations:
+            top += line_height
+            values = [self.txt(OPERATION_NAMES.get(name,name)),row['objects'],row['tools'],round(row['minutes'],1)]
+            for value,(title,x) in zip(values,columns): self.add_text(x,top,str(value),14)
+        self.height = int(top + margin)
+        return self
+    
+    def escape(self,text):
+        return text.replace("&","&amp;").replace("<","&lt;").replace(">","&gt;").replace('"',"&quot;")
+    
+    def get_svg(self):
+        svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s" viewBox="0 0 %s %s" font-family="Arial, sans-serif">' % (self.width,self.height,self.width,self.height),
+               '<rect width="100%" height="100%" fill="white"/>']
+        for item in self.items:
+            if item[0] == "polyline":
+                points,color,width = item[1:]
+                svg.append('<polyline points="%s" fill="none" stroke="rgb(%s,%s,%s)" stroke-width="%s"/>' % (" ".join(["%.1f,%.1f" % point for point in points]),color[0],color[1],color[2],width))
+            else:
+                x,y,text,size,color,anchor = item[1:]
+                svg.append('<text x="%.1f" y="%.1f" font-size="%s" fill="rgb(%s,%s,%s)" text-anchor="%s">%s</text>' % (x,y,size,color[0],color[1],color[2],anchor,self.escape(text)))
+        svg.append('</svg>')
+        return "\n".join(svg)
+    
+    def save_svg(self,file_path):
+        with open(file_path,'w') as f:
+            f.write(self.get_svg())
+        return file_path
+    
+    def save_png(self,file_path):
+        #Drawn on an offscreen bitmap
+        bitmap = drawing.Bitmap(self.width,self.height,drawing.PixelFormat.Format32bppRgba)
+        graphics = drawing.Graphics(bitmap)
+        try:
+            graphics.AntiAlias = True
+            graphics.Clear(drawing.Colors.White)
+            for item in self.items:
+                if item[0] == "polyline":
+                    points,color,width = item[1:]
+                    graphics.DrawLines(drawing.Pen(drawing.Color.FromArgb(color[0],color[1],color[2],255),width),[drawing.PointF(x,y) for x,y in points])
+                else:
+                    x,y,text,size,color,anchor = item[1:]
+                    font = drawing.Font(drawing.SystemFont.Default,size*.75)
+                    text_width = graphics.MeasureString(font,text).Width
+                    if anchor == "middle": x -= text_width/2
+                    graphics.DrawText(font,drawing.Color.FromArgb(color[0],color[1],color[2],255),x,y-size,text)
+        finally:
+            graphics.Dispose()
+        bitmap.Save(file_path,drawing.ImageFormat.Png)
+        return file_path
+
+class g_serial_port(object):
+    #.NET serial port for Rhino, g_sender works with any object that has write(text) and readline()
+    
+    def __init__(self,name,baudrate=115200,timeout=1000):
+        self.port = System.IO.Ports.SerialPort(name,int(baudrate))
+        self.port.ReadTimeout = timeout
+        self.port.NewLine = '\n'
+        self.port.Open()
+    
+    def write(self,text):
+        self.port.Write(text)
+    
+    def readline(self):
+        #Empty text on timeout
+        try: return self.port.ReadLine()
+        except System.TimeoutException: return ''
+    
+    def close(self):
+        if self.port.IsOpen: self.port.Close()
+
+_formatters = {}
+
+def get_formatter(post):
+    #Formatters are cached by postprocessor content
+    key = json.dumps(post,sort_keys=True)
+    if key not in _formatters: _formatters[key] = g_formatter(post)
+    return _formatters[key]
+
+def point_segment_distance(point,start,end):
+    #Distance on XY
+    dx,dy = end[0]-start[0],end[1]-start[1]
+    length = dx*dx + dy*dy
+    t = max(0,min(1,((point[0]-start[0])*dx + (point[1]-start[1])*dy)/length)) if length else 0
+    return math.hypot(point[0]-start[0]-t*dx,point[1]-start[1]-t*dy)
+
+def segments_cross(a_start,a_end,b_start,b_end):
+    #Whether two segments on XY cross or touch
+    def side(p,q,r): return (q[0]-p[0])*(r[1]-p[1]) - (q[1]-p[1])*(r[0]-p[0])
+    d1,d2 = side(b_start,b_end,a_start),side(b_start,b_end,a_end)
+    d3,d4 = side(a_start,a_end,b_start),side(a_start,a_end,b_end)
+    if d1*d2 < 0 and d3*d4 < 0: return True
+    return min(point_segment_distance(a_start,b_start,b_end),point_segment_distance(a_end,b_start,b_end),
+               point_segment_distance(b_start,a_start,a_end),point_segment_distance(b_end,a_start,a_end)) < 1e-9
+
+def point_in_polygon(point,polygon):
+    #Even-odd rule on XY, the polygon is closed by its last point
+    inside = False
+    for index in range(len(polygon)):
+        (x1,y1),(x2,y2) = polygon[index-1][:2],polygon[index][:2]
+        if (y1 > point[1]) != (y2 > point[1]) and point[0] < x1 + (point[1]-y1)*(x2-x1)/(y2-y1): inside = not inside
+    return inside
+
+def segment_touches_polygon(start,end,polygon):
+    #Whether a segment on XY has an end inside the polygon or meets its outline
+    if point_in_polygon(start,polygon) or point_in_polygon(end,polygon): return True
+    for index in range(len(polygon)):
+        if segments_cross(start,end,polygon[index-1],polygon[index]): return True
+    return False
+
+def curve_polygon(curve,tolerance=None):
+    #XY points of a closed curve within the tolerance, without adding anything to the document
+    tolerance = tolerance or sc.doc.ModelAbsoluteTolerance
+    polyline = rs.coercecurve(curve).ToPolyline(tolerance,sc.doc.ModelAngleToleranceRadians,0,0)
+    return [(polyline.Point(index).X,polyline.Point(index).Y) for index in range(polyline.PointCount)]
+
+def get_common_interval(a_start,a_end,b_start,b_end,gap,tolerance):
+    #Middle line where two parallel segments gap apart face each other, None if they do not
+    ax,ay = a_end[0]-a_start[0],a_end[1]-a_start[1]
+    length = math.hypot(ax,ay)
+    if length < tolerance or abs(a_start[2]-b_start[2]) > tolerance: return None
+    ux,uy = ax/length,ay/length
+    #Signed distance of the b points to the a line and their position along it
+    sides = [ux*(p[1]-a_start[1]) - uy*(p[0]-a_start[0]) for p in (b_start,b_end)]
+    if abs(sides[0]-sides[1]) > tolerance or abs(abs(sides[0])-gap) > tolerance: return None
+    positions = sorted([ux*(p[0]-a_start[0]) + uy*(p[1]-a_start[1]) for p in (b_start,b_end)])
+    t0,t1 = max(0,positions[0]),min(length,positions[1])
+    if t1 - t0 < gap: return None
+    half = (sides[0]+sides[1])*.25
+    return [(a_start[0]+ux*t-uy*half,a_start[1]+uy*t+ux*half,a_start[2]) for t in (t0,t1)]
+
+def move_length(x1,y1,z1,x2,y2,z2,i,j,kind):
+    #Length of a linear or helical move
+    if not kind & (MOVE_ARC_CW | MOVE_ARC_CCW):
+        return math.sqrt((x2-x1)**2+(y2-y1)**2+(z2-z1)**2)
+    cx = x1 + i
+    cy = y1 + j
+    radius = math.hypot(i,j)
+    sweep = math.atan2(y2-cy,x2-cx) - math.atan2(y1-cy,x1-cx)
+    if kind & MOVE_ARC_CCW:
+        if sweep <= 0: sweep += 2*math.pi
+    else:
+        if sweep >= 0: sweep -= 2*math.pi
+    return math.hypot(abs(sweep)*radius,z2-z1)
+
+class g_curve(object):
+    __slots__ = ('input_data','general_input','compensation','pocketing','curve','nurbs_curve','cero_point','cam_type','post',
+                 'tool','sec_plane','clear_plane','asignedcluster','iscluster','link_retract','color_palette','geometry_type',
+                 'point','start_point','cut_curve','points','time','preview','drill_code','drill_cycle','drill_modal','drill_position','cache_key',
+                 'master','shape_frame','common_cut','chain','rest_entry','link_polygon','level_refs')
+    
+    def __init__(self,curve,input_data,general_input,compensation,pocketing,cero_point,cam_type=False,post=False):
+        #Initial needed values
+        self.input_data = input_data
+        self.general_input = general_input
+        self.compensation = compensation
+        self.pocketing = pocketing
+        self.curve  = curve #Original curve nothing modifies it, the self.nurbs_curve is used.
+        self.nurbs_curve  = curve
+        self.cero_point = cero_point
+        self.cam_type = cam_type
+        self.post = post if post else self.get_default_post()
+        self.tool = int(general_input.get('tool',1))
+        #Safe plane for long travels and clearance plane for short retracts between features
+        self.sec_plane = general_input['sec_plane']
+        self.clear_plane = self.get_clear_plane()
+        #Calculated outside values
+        self.asignedcluster = -1
+        self.iscluster = False
+        self.link_retract = True
+        #Some other values
+        self.color_palette = {"cut":(153,204,255),"plunge":(254,184,0),"point":(153,204,255),"rapid":(200,200,200)}
+        self.geometry_type = "point"  if rs.IsPoint(self.nurbs_curve) else "curve" if rs.IsCurveClosed(self.nurbs_curve) else "open_curve" 
+        self.point = self.curve if rs.IsPoint(self.nurbs_curve) else rs.CurveAreaCentroid(self.nurbs_curve)[0] if rs.IsCurveClosed(self.nurbs_curve) else rs.CurveStartPoint(self.nurbs_curve)   # Centroide curva original
+        self.start_point = rs.PointCoordinates(self.nurbs_curve,False) if rs.IsPoint(self.nurbs_curve) else rs.CurveStartPoint(self.nurbs_curve)
+        #Canned drilling cycles do not need any geometry in the document
+        self.drill_cycle = self.get_drill_cycle()
+        self.drill_modal = False
+        self.drill_position = False
+        #Only canned cycles keep their lines, toolpaths are formatted while the program is written
+        self.drill_code = []
+        #The cut curve is made on process so cached toolpaths do not need it
+        self.cut_curve = None
+        self.cache_key = False
+        #Congruent curves take the toolpath of their master moved to their own frame
+        self.master = None
+        self.shape_frame = False
+        #Middle lines shared with outside parts cut before this one, see camJob.SetCommonLines
+        self.common_cut = []
+        #Open curves joined in this one, see camJob.ChainOpenCurves
+        self.chain = []
+        #Cache entry of rest regions, see camJob.GetRestObjects
+        self.rest_entry = False
+        #Boundary outline used by is_link_inside
+        self.link_polygon = False
+        #Curves the levels refer to while the toolpath is made without preview, see level_curve
+        self.level_refs = False
+        self.points = g_points()
+        self.time = 0
+        
+    @property
+    def toolpath(self):
+        return self.points.view()
+    
+    def get_gcode(self):
+        #Program lines of the object, made again every time they are written
+        if self.drill_cycle: return self.drill_code
+        return get_formatter(self.post).format_block(self.toolpath)
+    
+    def get_default_post(self):
+        return {
+            "footer": [
+                "M5"
+            ], 
+            "feed": "F", 
+            "description": "Arduino GRBL\r\nTinyG ", 
+            "round_tol": 2, 
+            "cut": "G01", 
+            "spindle": "", 
+            "rapid": "G00", 
+            "header": [
+                "G21", 
+                "G90", 
+                "G54", 
+                "M3"
+            ],
+            "tool_change": []
+        }
+    
+    def get_clear_plane(self):
+        #Presets without clearance plane keep the old rapid/plunge split at 20% of the safe plane
+        clear_plane = self.general_input.get('clear_plane',0)
+        if not clear_plane: return self.sec_plane * .2
+        return min(clear_plane,self.sec_plane)
+    
+    def process(self,preview=True):
+        if self.drill_cycle:
+            self.preview = []
+            self.drill_code = self.get_drill_code()
+            return
+        #Without preview the levels only refer to the curves they are copied from and nothing is left in the document
+        self.level_refs = False if preview else []
+        self.cut_curve = self.get_cut_curve()
+        if rs.IsPoint(self.nurbs_curve):
+            self.preview = self.get_cut_path_point(self.cut_curve)
+        elif self.compensation == 0:# and not rs.IsCurveClosed(self.nurbs_curve):
+            self.preview =  self.get_cut_path_open(self.cut_curve) 
+        elif self.common_cut:
+            self.preview = self.get_cut_path_common(self.cut_curve)
+
+        else:
+            if self.input_data["finish_pass"] and not self.input_data["finish_entries"]:
+                #Creates a finishing pass on the last level
+                self.preview =  self.get_cut_path_closed(self.cut_curve,finish_pass=self.input_data["finish_pass"])
+            elif self.input_data["finish_pass"]:
+                #Creates a finishing pass equal to the cut curve but with a different offset
+                 crv_finish_offset = self.get_cut_curve(self.compensation,(self.general_input['cut_diam']*.5)+self.input_data["finish_pass"])
                  self.preview =  self.get_cut_path_closed(crv_finish_offset)
                  self.preview += self.get_cut_path_closed(self.cut_curve,no_entries=self.input_data["finish_entries"],plunge_distance=False,omit_box=True)
             else:
                 self.preview = self.get_cut_path_closed(self.cut_curve)
                 
-        self.gcode = self.get_g_code(self.preview,self.cero_point)
+        #Nothing is left to cut when every line of the contour is shared with parts already cut
+        if self.preview: self.get_g_code(self.preview,self.cero_point)
+        else: self.points = g_points()
+        if self.level_refs is not False:
+            rs.DeleteObjects([crv for crv in self.preview if not isinstance(crv,tuple)] + self.level_refs)
+            self.preview = []
+            self.level_refs = False
   
+    def get_shape_signature(self,rotation=False):
+        #Shape descriptor that does not change when the curve is moved or rotated on XY.
+        #The frame is the centroid, or start point of open curves, and the angle to the first control point.
+        if self.geometry_type == "point" or self.common_cut: return False
+        cero = rs.coerce3dpoint(self.cero_point) if self.cero_point else (0,0,0)
+        center = self.point
+        points = rs.CurvePoints(self.curve)
+        angle = math.atan2(points[0][1]-center[1],points[0][0]-center[0]) if rotation else 0
+        if rotation and rs.Distance((center[0],center[1],0),(points[0][0],points[0][1],0)) < .001: angle = 0
+        cos_angle,sin_angle = math.cos(-angle),math.sin(-angle)
+        shape = []
+        for point in points:
+            dx,dy = point[0]-center[0],point[1]-center[1]
+            shape += [round(cos_angle*dx-sin_angle*dy,3)+0.0,round(sin_angle*dx+cos_angle*dy,3)+0.0,round(point[2],3)+0.0]
+        knots = rs.CurveKnots(self.curve)
+        knots = [round(knot-knots[0],6) for knot in knots]
+        weights = [round(weight,6) for weight in rs.CurveWeights(self.curve)]
+        self.shape_frame = (center[0]-cero[0],center[1]-cero[1],angle)
+        signature = [self.geometry_type,self.cam_type,self.tool,rs.CurveDegree(self.curve),knots,weights,shape]
+        return hashlib.md5(json.dumps(signature)).hexdigest()
+    
+    def copy_master(self):
+        #Toolpath and preview of the master curve placed on this curve frame
+        master = self.master
+        cero = rs.coerce3dpoint(self.cero_point) if self.cero_point else (0,0,0)
+        cx,cy,angle = master.shape_frame
+        tx,ty,target_angle = self.shape_frame
+        rotation = target_angle - angle
+        self.points = master.points.transformed(rotation,(cx,cy),(tx,ty))
+        xform = rs.XformMultiply(rs.XformTranslation((tx-cx,ty-cy,0)),rs.XformRotation2(math.degrees(rotation),(0,0,1),(cx+cero[0],cy+cero[1],0)))
+        self.preview = rs.TransformObjects(master.preview,xform,True) if master.preview else []
+    
+    def get_geometry_values(self):
+        #Rounded zero point and curve definition
+        cero = rs.coerce3dpoint(self.cero_point) if self.cero_point else (0,0,0)
+        points = [cero]
+        if self.geometry_type == "point":
+            points.append(rs.PointCoordinates(self.curve))
+            values = []
+        else:
+            points += rs.CurvePoints(self.curve)
+            values = [rs.CurveDegree(self.curve)] + list(rs.CurveKnots(self.curve)) + list(rs.CurveWeights(self.curve))
+        values = [round(value,6) for value in values]
+        for point in points: values += [round(point[0],6),round(point[1],6),round(point[2],6)]
+        return values
+    
+    def get_cache_key(self):
+        #Hash of the geometry, the zero point and every setting used to make the toolpath
+        if self.cache_key: return self.cache_key
+        values = self.get_geometry_values()
+        signature = [CACHE_VERSION,self.geometry_type,self.cam_type,self.compensation,self.pocketing,self.input_data,self.general_input,self.post,sc.doc.ModelAbsoluteTolerance,values,self.common_cut]
+        self.cache_key = hashlib.md5(json.dumps(signature,sort_keys=True)).hexdigest()
+        return self.cache_key
+    
+    def dump_cache(self):
+        return {'version':CACHE_VERSION,
+                'key':self.get_cache_key(),
+                'points':self.points.dumps(),
+                'drill':[self.drill_modal,self.drill_position,self.drill_code]}
+    
+    def load_cache(self,data,preview=True):
+        self.points = g_points.loads(data['points'])
+        self.drill_modal,self.drill_position,self.drill_code = data['drill']
+        self.preview = self.get_cached_preview() if preview and not self.drill_cycle else []
+    
+    def set_preview(self,mode):
+        #The toolpath curves are replaced by polylines of the points, of the first level only on 'top' and none on 'none'.
+        #Drilled points plunge on every cut so they always show the whole path.
+        if self.preview: rs.DeleteObjects(self.preview)
+        self.preview = self.get_cached_preview(mode == 'top' and self.geometry_type != "point") if mode != 'none' and not self.drill_cycle else []
+    
+    def get_cached_preview(self,top_level=False):
+        #Preview polylines drawn from the cached points, one per run of the same move state.
+        #The top level stops at the first move below the height of the first cut.
+        toolpath = self.toolpath
+        if not len(toolpath): return []
+        cero = rs.coerce3dpoint(self.cero_point) if self.cero_point else (0,0,0)
+        states = dict((kind,name) for name,kind in MOVE_STATES.items())
+        preview = []
+        run_state = "rapid"
+        run = [toolpath.point(0)]
+        top_height = None
+        for index in range(1,len(toolpath)):
+            kind = toolpath.kind(index)
+            state = states[kind & 3]
+            if top_level:
+                height = toolpath.point(index)[2]
+                if top_height is not None and height < top_height - 1e-6: break
+                if top_height is None and state == "cut": top_height = height
+            if kind & (MOVE_ARC_CW | MOVE_ARC_CCW): move_points = self.get_arc_points(run[-1],toolpath.point(index),toolpath.center_offset(index),kind)
+            else: move_points = [toolpath.point(index)]
+            if state != run_state:
+                preview += self.add_preview_polyline(run,run_state,cero)
+                run = [run[-1]]
+                run_state = state
+            run += move_points
+        preview += self.add_preview_polyline(run,run_state,cero)
+        return preview
+    
+    def get_arc_points(self,start,end,center_offset,kind):
+        #Arc sampled every 10 degrees, z changes linearly for helical arcs
+        cx,cy = start[0]+center_offset[0],start[1]+center_offset[1]
+        radius = math.hypot(center_offset[0],center_offset[1])
+        start_angle = math.atan2(start[1]-cy,start[0]-cx)
+        sweep = math.atan2(end[1]-cy,end[0]-cx) - start_angle
+        if kind & MOVE_ARC_CW:
+            sweep = sweep % (-2*math.pi)
+            if abs(sweep) < 1e-9: sweep = -2*math.pi
+        else:
+            sweep = sweep % (2*math.pi)
+            if abs(sweep) < 1e-9: sweep = 2*math.pi
+        steps = max(2,int(abs(math.degrees(sweep))/10.0))
+        arc_points = []
+        for step in range(1,steps):
+            angle = start_angle + sweep*step/steps
+            arc_points.append((cx+radius*math.cos(angle),cy+radius*math.sin(angle),start[2]+(end[2]-start[2])*step/float(steps)))
+        arc_points.append(end)
+        return arc_points
+    
+    def add_preview_polyline(self,run,state,cero):
+        run = [pt for index,pt in enumerate(run) if not index or pt != run[index-1]]
+        if len(run) < 2: return []
+        polyline = rs.AddPolyline([(pt[0]+cero[0],pt[1]+cero[1],pt[2]+cero[2]) for pt in run])
+        if not polyline: return []
+        rs.ObjectColor(polyline,self.color_palette[state])
+        return [polyline]
+    
     def rgb_state(self,crv):
         
         crv_rgb = (rs.ColorRedValue(rs.ObjectColor(crv)),rs.ColorGreenValue(rs.ObjectColor(crv)),rs.ColorBlueValue(rs.ObjectColor(crv)))
@@ -1253,15 +4075,21 @@ class g_curve():
         elif crv_rgb == self.color_palette["rapid"]:
             return 'rapid'
     
+    def get_arc_move(self,segment):
+        #Arc direction and center offset from the start point, False if the segment is not an arc
+        if not (rs.IsCircle(segment) or rs.IsArc(segment)): return False
+        rc,arc = rs.coercecurve(segment).TryGetArc()
+        if not rc: return False
+        start = rs.CurveStartPoint(segment)
+        arc_dir = MOVE_ARC_CW if arc.Plane.Normal.Z < 0 else MOVE_ARC_CCW
+        return arc_dir,(arc.Center.X-start[0],arc.Center.Y-start[1])
+    
     def get_g_code(self,crv_list,cero_point=False):
-        if cero_point:
-            for mcrv in crv_list:
-                start = cero_point
-                end = (0,0,0)
-                rs.MoveObjects(mcrv,rs.VectorCreate(end,start))
+        #Level references are read from the curve they refer to, moved to their height
+        curves = list(set([crv[0] if isinstance(crv,tuple) else crv for crv in crv_list]))
+        if cero_point: rs.MoveObjects(curves,rs.VectorCreate((0,0,0),cero_point))
                 
-        gcode = []
-        gcode_points = []
+        points = g_points()
         #Points do not have plunge
         if not rs.IsPoint(self.nurbs_curve):
             feed_plunge = self.input_data['feed_plunge']
@@ -1271,148 +4099,198 @@ class g_curve():
             feed_plunge = self.input_data['feed']
             feed_rapid = self.general_input["feed_rapid"]
             feed_cut = self.input_data["feed"]
+        state_feeds = {"cut":feed_cut,"plunge":feed_plunge,"rapid":feed_rapid}
         
         #Creates the G0Hello and the first cut point and extracts the first cutting curve
-        hello_pt = self.round_point(rs.CurveStartPoint(crv_list[0]))
-        #gcode.append("(1)")
-        gcode.append("%s X%sY%sZ%s %s%s" % (self.post['rapid'],hello_pt[0],hello_pt[1],hello_pt[2],self.post['feed'],int(feed_rapid)))
-        #Attach the feed and the hello point to the list of points.
-        gcode_points.append({'feed':int(feed_rapid),'point':hello_pt})
-        
-        state = self.rgb_state(crv_list[0])
-        start_cut_pt = self.round_point(rs.CurveEndPoint(crv_list[0]))
-        #gcode.append("(2)")
-        gcode.append("%s Z%s %s%s" % (self.post['cut'],start_cut_pt[2],self.post['feed'],int(feed_plunge)))
-        gcode_points.append({'feed':int(feed_plunge),'point':start_cut_pt})
-        crvs_list = crv_list[1:]
-        #reviews each block of curves 
-        last_state = state
-        
-        for crv in crvs_list: 
-            state = self.rgb_state(crv)
-            if state == "cut":
-                new_state = "cut"
-                current_feed = feed_cut
-                prefix = self.post['cut']
-            elif  state == "plunge":
-                new_state = "plunge"  
-                current_feed = feed_plunge
-                prefix = self.post['cut']
-            elif state == "rapid":
-                new_state = "rapid"
-                current_feed = feed_rapid
-                prefix = self.post['rapid']
-  
-            add_feed = True if new_state != last_state else False
-            last_state = new_state
-           
-            curve_segments = rs.ExplodeCurves(crv, delete_input=False)
-            if not curve_segments: curve_segments = [rs.CopyObject(crv)]
-            #check each segment on the curve to see if it is an arc or line etc. and assign code per point 
-            for crv in curve_segments:
-                crv_gcode = []
-                if rs.IsCircle(crv):
-                    atol=sc.doc.ModelAngleToleranceDegrees
-                    cir_ctr = self.round_point(rs.CircleCenterPoint(crv))
-                    cir_Start = self.round_point(rs.CurveStartPoint(crv))
-                    ref_plane=rs.ViewCPlane()
-                    arc_crv=rs.coercecurve(crv)
-                    rc,arc=arc_crv.TryGetArc()
-                    arc_plane = arc.Plane
-                    delta_ptx = cir_ctr[0] - cir_Start[0] 
-                    delta_pty = cir_ctr[1] - cir_Start[1]
-                    angle=rs.VectorAngle(ref_plane.Normal,arc_plane.Normal)
-                    if Rhino.RhinoMath.EpsilonEquals(angle,180,atol): arc_dir="G02" #clockwise
-                    elif Rhino.RhinoMath.EpsilonEquals(angle,0,atol): arc_dir="G03" #counterclockwise
-                    #crv_gcode.append("(3)")
-                    crv_gcode.append("%s I%sJ%s %s%s" % (arc_dir,delta_ptx,delta_pty,self.post['feed'],int(current_feed)))
-                elif rs.IsArc(crv):
-                    atol=sc.doc.ModelAngleToleranceDegrees
-                    cir_ctr = self.round_point(rs.ArcCenterPoint(crv))
-                    cir_Start = self.round_point(rs.CurveStartPoint(crv))
-                    cir_End = self.round_point(rs.CurveEndPoint(crv))
-                    ref_plane=rs.ViewCPlane()
-                    arc_crv=rs.coercecurve(crv)
-                    rc,arc=arc_crv.TryGetArc()
-                    arc_plane = arc.Plane
-                    delta_ptx = cir_ctr[0] - cir_Start[0] 
-                    delta_pty = cir_ctr[1] - cir_Start[1]
-                    angle=rs.VectorAngle(ref_plane.Normal,arc_plane.Normal)
-                    if Rhino.RhinoMath.EpsilonEquals(angle,180,atol): arc_dir="G02" #clockwise
-                    elif Rhino.RhinoMath.EpsilonEquals(angle,0,atol): arc_dir="G03" #counterclockwise
-                    #crv_gcode.append("(4)")
-                    crv_gcode.append("%s X%sY%s I%sJ%s %s%s" % (arc_dir,cir_End[0],cir_End[1],delta_ptx,delta_pty,self.post['feed'],int(current_feed)))                    
-                    
-                    #crv_gcode.append("%s X%sY%sZ%s %s%s" % (prefix,crv_endpt[0],crv_endpt[1],crv_endpt[2],self.post['feed'],int(current_feed)))
-                elif rs.IsLine(crv) or rs.CurveLength(crv)<self.general_input['tolerance']: # If the line is straight
-                    crv_endpt = self.round_point(rs.CurveEndPoint(crv))
-                    if curve_segments.index(crv) == 0 and add_feed:  #if there is a change of state between plunge and cut and it is the first line add the feed variable
-                        #crv_gcode.append("(5)")
-                        crv_gcode.append("%s X%sY%sZ%s %s%s" % (prefix,crv_endpt[0],crv_endpt[1],crv_endpt[2],self.post['feed'],int(current_feed)))
-                    else:
-                        #crv_gcode.append("(6)")
-                        
-                        #crv_gcode.append("%s X%sY%sZ%s" % (self.post['rapid'],crv_endpt[0],crv_endpt[1],crv_endpt[2]))
-                        #crv_gcode.append("X%sY%sZ%s" % (crv_endpt[0],crv_endpt[1],crv_endpt[2]))
-                        crv_gcode.append("%s X%sY%sZ%s %s%s" % (prefix,crv_endpt[0],crv_endpt[1],crv_endpt[2],self.post['feed'],int(current_feed)))
-                        
-                    gcode_points.append({'feed':int(current_feed),'point':crv_endpt})
-                else:
-                    no_points = int(rs.CurveLength(crv)/self.general_input['tolerance'])
-                    pts = rs.DivideCurve(crv,no_points, create_points=False, return_points=True)[1:]
-                    
-                    if rs.IsCurveClosed(crv):
-                        pts.append(rs.CurveStartPoint(crv))
-                    #crv_gcode.append("(7)")
-                    fst_pnt = self.round_point(pts[0])
-                    crv_gcode.append("%s X%sY%sZ%s %s%s" % (prefix,fst_pnt[0],fst_pnt[1],fst_pnt[2],self.post['feed'],int(current_feed)))
-                    for pt in pts:
-                        if curve_segments.index(crv) == 0 and pts.index(pt) == 0 and add_feed:  #if there is a change of state between plunge and cut and it is the first line add the feed variable
-                            pt = self.round_point(pt)
-                            crv_gcode.append("(8)")
-                            crv_gcode.append("%s X%sY%sZ%s %s%s" % (prefix,pt[0],pt[1],pt[2],self.post['feed'],int(current_feed)))
-                        else:
-                            pt = self.round_point(pt)
-                            crv_gcode.append("(9)")
-                            crv_gcode.append("X%sY%sZ%s" % (pt[0],pt[1],pt[2]))
-                            
-                        gcode_points.append({'feed':int(current_feed),'point':pt})
-                           
-                gcode += crv_gcode
-                rs.DeleteObject(crv)
+        points.append(self.curve_start(crv_list[0]),int(feed_rapid),MOVE_RAPID)
+        points.append(self.curve_end(crv_list[0]),int(feed_plunge),MOVE_PLUNGE)
+        
+        #reviews each block of curves and stores its points, the text is written at the end in a single pass
+        curve_moves = {}
+        for crv in crv_list[1:]: 
+            crv,height = crv if isinstance(crv,tuple) else (crv,0)
+            if crv not in curve_moves: curve_moves[crv] = self.get_curve_moves(crv,state_feeds)
+            for point,feed,kind,center_offset in curve_moves[crv]:
+                points.append((point[0],point[1],point[2]+height),feed,kind,center_offset)
                 
-        if cero_point:
-            for mcrv in crv_list:
-                start = cero_point
-                end = (0,0,0)
-                rs.MoveObjects(mcrv,rs.VectorCreate(start,end))
+        if cero_point: rs.MoveObjects(curves,rs.VectorCreate(cero_point,(0,0,0)))
         
-        self.gcode_points = gcode_points     
-        return gcode
+        self.points = points
+    
+    def get_curve_moves(self,crv,state_feeds):
+        #Points of the curve with their feed, move kind and arc center offset
+        moves = []
+        state = self.rgb_state(crv)
+        current_feed = int(state_feeds[state])
+        kind = MOVE_STATES[state]
+        
+        #Helical arcs from ramps and helix entries go out as a single G02/G03 with Z
+        arc_data = rs.GetUserText(crv,'lincam_arc')
+        if arc_data:
+            arc_dir,delta_ptx,delta_pty = arc_data.split(',')
+            return [(rs.CurveEndPoint(crv),current_feed,kind | (MOVE_ARC_CW if arc_dir == "G02" else MOVE_ARC_CCW),(float(delta_ptx),float(delta_pty)))]
+       
+        curve_segments = rs.ExplodeCurves(crv, delete_input=False)
+        if not curve_segments: curve_segments = [rs.CopyObject(crv)]
+        #check each segment on the curve to see if it is an arc or line etc. and assign code per point 
+        for segment in curve_segments:
+            arc_move = self.get_arc_move(segment)
+            if arc_move:
+                moves.append((rs.CurveEndPoint(segment),current_feed,kind | arc_move[0],arc_move[1]))
+            elif rs.IsLine(segment) or rs.CurveLength(segment)<self.general_input['tolerance']: # If the line is straight
+                moves.append((rs.CurveEndPoint(segment),current_feed,kind,(0,0)))
+            else:
+                no_points = int(rs.CurveLength(segment)/self.general_input['tolerance'])
+                pts = rs.DivideCurve(segment,no_points, create_points=False, return_points=True)[1:]
+                if rs.IsCurveClosed(segment):
+                    pts.append(rs.CurveStartPoint(segment))
+                for pt in pts:
+                    moves.append((pt,current_feed,kind,(0,0)))
+            rs.DeleteObject(segment)
+        return moves
+    
+    def level_curve(self,crv,translation,state=False):
+        #Copy of the curve moved to a level, only a reference to the curve and the height while there is no preview
+        if self.level_refs is False:
+            level_crv = rs.CopyObject(crv,translation)
+            if state: rs.ObjectColor(level_crv,self.color_palette[state])
+            return level_crv
+        if state: rs.ObjectColor(crv,self.color_palette[state])
+        return (crv,translation[2])
+    
+    def curve_start(self,crv):
+        if isinstance(crv,tuple): return rs.CurveStartPoint(crv[0]) + Rhino.Geometry.Vector3d(0,0,crv[1])
+        return rs.CurveStartPoint(crv)
+    
+    def curve_end(self,crv):
+        if isinstance(crv,tuple): return rs.CurveEndPoint(crv[0]) + Rhino.Geometry.Vector3d(0,0,crv[1])
+        return rs.CurveEndPoint(crv)
+    
+    def discard_curves(self,curves):
+        #Curves only used to be copied into the levels, kept until the G-code is made if the levels refer to them
+        curves = [crv for crv in curves if crv and crv != "sec_plane"]
+        if self.level_refs is False: rs.DeleteObjects(curves)
+        else: self.level_refs += curves
     
     def get_cut_time(self,last_point = False):
-        if not self.gcode_points: return
-        gcode_time = 0
-        points = self.gcode_points if not last_point else [last_point]+self.gcode_points
-        for i in range(len(points)-1):
-            point1 = points[i]['point']
-            point2 = points[i+1]['point']
-            feed = points[i+1]['feed']
-            distance = rs.Distance(point1,point2)
-            gcode_time += distance/feed
-        return [gcode_time,points[-1]]  
+        if not len(self.points): return
+        times,last_point = self.get_cut_times(last_point)
+        return [sum(times),last_point]
+    
+    def get_cut_times(self,last_point = False):
+        #Time of the rapid, plunge and cut moves indexed by their kind, arcs are counted with their state
+        times = [0,0,0]
+        if not len(self.points): return times,last_point
+        xyz,ij,feed,kind = self.toolpath.buffers()
+        if last_point:
+            times[MOVE_RAPID] += move_length(last_point[0],last_point[1],last_point[2],xyz[0],xyz[1],xyz[2],0,0,MOVE_RAPID)/feed[0]
+        for i in range(1,len(kind)):
+            times[kind[i] & (MOVE_PLUNGE | MOVE_CUT)] += move_length(xyz[3*i-3],xyz[3*i-2],xyz[3*i-1],xyz[3*i],xyz[3*i+1],xyz[3*i+2],ij[2*i],ij[2*i+1],kind[i])/feed[i]
+        return times,self.toolpath.point(-1)
+    
+    def get_quote_times(self,input_data=False):
+        #Rapid, plunge and cut times like get_cut_times but from the curve length and area only,
+        #offsets are taken as the length plus or minus a tool circle and pockets as their area over the step.
+        #Other settings of the same operation can be given to compare presets.
+        input_data = input_data or self.input_data
+        times = [0,0,0]
+        entries = max(1,int(input_data.get('entries',1)))
+        depth = abs(input_data['depth'])
+        feed_rapid = self.general_input['feed_rapid']
+        if self.geometry_type == "point":
+            #In and out of every level from the clearance plane
+            times[MOVE_CUT] += (depth*(entries+1) + 2*self.clear_plane)/input_data['feed']
+            return times
+        feed_cut,feed_plunge = input_data['feed_cut'],input_data['feed_plunge']
+        length = rs.CurveLength(self.curve)
+        times[MOVE_RAPID] += 2*self.clear_plane/feed_rapid
+        if self.geometry_type == "open_curve" or self.compensation == 0:
+            times[MOVE_PLUNGE] += (self.clear_plane + depth)/feed_plunge
+            times[MOVE_CUT] += length*entries/feed_cut
+            return times
+        radius = self.general_input['cut_diam']*.5
+        length = max(length + 2*math.pi*radius*self.compensation,0)
+        plunge = min(input_data.get('plunge',0),length)
+        times[MOVE_PLUNGE] += (self.clear_plane + plunge*entries)/feed_plunge
+        times[MOVE_CUT] += (length*entries - plunge*(entries-1))/feed_cut
+        if input_data.get('finish_pass',0):
+            times[MOVE_CUT] += length*max(1,int(input_data.get('finish_entries',0)))/feed_cut
+        if self.pocketing:
+            step = self.general_input['cut_diam']*input_data.get('xy_dist',.5)
+            area = rs.CurveArea(self.curve)[0] - rs.CurveLength(self.curve)*radius*2
+            if area > 0 and step > 0: times[MOVE_CUT] += area/step*entries/feed_cut
+            if input_data.get('circular_pocketing',0) and not input_data.get('adaptive_pocketing',0) and step > 0:
+                #Circles around the centroid are cut whole up to the nearest wall, past it every ring is split
+                #into pieces with a link over the clearance plane between them
+                centroid = rs.CurveAreaCentroid(self.curve)[0]
+                polygon = curve_polygon(self.curve)
+                far = max([math.hypot(x-centroid[0],y-centroid[1]) for x,y in polygon])
+                near = rs.Distance(centroid,rs.EvaluateCurve(self.curve,rs.CurveClosestPoint(self.curve,centroid)))
+                rings = max(far - near,0)/step
+                times[MOVE_RAPID] += rings*entries*self.clear_plane/feed_rapid
+                times[MOVE_PLUNGE] += rings*entries*self.clear_plane/feed_plunge
+        return times
+    
+    def get_drill_cycle(self):
+        #Canned cycle for the point if the postprocessor supports it, otherwise the moves are expanded
+        if self.geometry_type != "point": return False
+        cycles = [cycle.strip().upper() for cycle in self.post.get('drill_cycle',[]) if cycle.strip()]
+        if self.input_data["entries"] > 1 or self.input_data.get("peck",0): needed = "G83"
+        elif self.input_data.get("dwell",0): needed = "G82"
+        else: needed = "G81"
+        return needed if needed in cycles else False
+    
+    def get_drill_code(self):
+        #One cycle line per hole, the points are only kept for the time estimate and the links
+        point = rs.PointCoordinates(self.curve)
+        cero = rs.coerce3dpoint(self.cero_point) if self.cero_point else (0,0,0)
+        x,y,z = point[0]-cero[0],point[1]-cero[1],point[2]-cero[2]
+        bottom = z + self.input_data["depth"]
+        retract = z + 2
+        feed = int(self.input_data["feed"])
+        feed_rapid = int(self.general_input["feed_rapid"])
+        peck = self.input_data.get("peck",0) or abs(self.input_data["depth"])/self.input_data["entries"]
+        
+        points = g_points()
+        points.append((x,y,self.clear_plane),feed_rapid,MOVE_RAPID)
+        points.append((x,y,retract),feed_rapid,MOVE_RAPID)
+        if self.drill_cycle == "G83":
+            peck_level = z
+            while True:
+                peck_level = max(bottom,peck_level-max(peck,.01))
+                points.append((x,y,peck_level),feed,MOVE_PLUNGE)
+                if peck_level <= bottom: break
+                points.append((x,y,retract),feed_rapid,MOVE_RAPID)
+        else:
+            points.append((x,y,bottom),feed,MOVE_PLUNGE)
+        #G98 goes back to the clearance plane where the cycle started
+        points.append((x,y,self.clear_plane),feed_rapid,MOVE_RAPID)
+        self.points = points
+        
+        formatter = get_formatter(self.post)
+        number = formatter.number
+        values = {'cycle':self.drill_cycle,
+                  'x':'X%s' % number(x),
+                  'y':'Y%s' % number(y),
+                  'z':'Z%s' % number(bottom),
+                  'r':'R%s' % number(retract),
+                  'q':'Q%s' % number(peck) if self.drill_cycle == "G83" else '',
+                  'p':'P%s' % number(self.input_data["dwell"]) if self.drill_cycle == "G82" else '',
+                  'f':'%s%s' % (self.post['feed'],feed)}
+        self.drill_modal = ' '.join([values[name] for name in ('cycle','z','r','q','p','f')])
+        self.drill_position = values['x'] + values['y']
+        return formatter.format_block(points.view(),0,1) + [formatter.format_drill(values)]
     
     def get_cut_path_point(self,point):
         o_point = point
         point = rs.PointCoordinates(o_point)
         no_entries = self.input_data["entries"]
         level_depth = self.input_data["depth"] / no_entries
-        sec_plane = self.general_input["sec_plane"]
         #Final operating checklist for curve cutter
         curves_cut_path = []
     
         start_point = (point[0],point[1],point[2]+2)
-        hello_line = rs.AddLine((point[0],point[1],sec_plane),start_point)
+        hello_line = rs.AddLine((point[0],point[1],self.clear_plane),start_point)
         rs.ObjectColor(hello_line,self.color_palette["cut"])
         curves_cut_path.append(hello_line)
         
@@ -1423,7 +4301,7 @@ class g_curve():
             rs.ObjectColor([in_line,out_line],self.color_palette["cut"])
             curves_cut_path += [in_line,out_line]
             
-        end_line = rs.AddLine(start_point,(point[0],point[1],sec_plane))
+        end_line = rs.AddLine(start_point,(point[0],point[1],self.clear_plane))
         rs.ObjectColor(end_line,self.color_palette["cut"])
         curves_cut_path.append(end_line)
         rs.DeleteObject(o_point)
@@ -1433,40 +4311,59 @@ class g_curve():
         
         no_entries = self.input_data["entries"]
         level_depth = self.input_data["depth"]/ no_entries
-        sec_plane = self.general_input["sec_plane"]
         #Final operating checklist for curve cutter
         curves_cut_path = [] 
+        #Even levels go back along the curve
+        reversed_crv = rs.CopyObject(crv) if no_entries > 1 else None
+        if reversed_crv: rs.ReverseCurve(reversed_crv)
         
         for entrie in range(1,int(no_entries)+1):
  
             translation = rs.VectorAdd((0,0,0),(0,0,level_depth*entrie))
-            level_curve = rs.CopyObject(crv,translation)
-            rs.ObjectColor(level_curve,self.color_palette["cut"])
-            if entrie % 2 == 0: rs.ReverseCurve(level_curve)
+            level_curve = self.level_curve(reversed_crv if entrie % 2 == 0 else crv,translation,"cut")
             if entrie == 1:
-                entry_end_point = rs.CurveStartPoint(level_curve)
-                in_curve = rs.AddLine((entry_end_point[0],entry_end_point[1],sec_plane),entry_end_point)
+                entry_end_point = self.curve_start(level_curve)
+                in_curve = rs.AddLine((entry_end_point[0],entry_end_point[1],self.clear_plane),entry_end_point)
                 rs.ObjectColor(in_curve,self.color_palette["plunge"])
                 curves_cut_path.append(in_curve)
             
             curves_cut_path.append(level_curve)
             
             if entrie < no_entries:
-                level_ept = rs.CurveEndPoint(level_curve)
+                level_ept = self.curve_end(level_curve)
                 plunge_curve = rs.AddLine(level_ept,(level_ept[0],level_ept[1],(entrie+1)*level_depth))
                 rs.ObjectColor(plunge_curve,self.color_palette["plunge"])
                 curves_cut_path.append(plunge_curve)
             
             
-        final_point = rs.CurveEndPoint(level_curve)
-        out_curve = rs.AddLine(final_point,(final_point[0],final_point[1],sec_plane))
+        final_point = self.curve_end(level_curve)
+        out_curve = rs.AddLine(final_point,(final_point[0],final_point[1],self.clear_plane))
         rs.ObjectColor(out_curve,self.color_palette["cut"])
         curves_cut_path.append(out_curve)
         
-        rs.DeleteObjects([crv])
+        self.discard_curves([crv,reversed_crv])
         
         return curves_cut_path
    
+    def get_cut_path_common(self,crv):
+        #The contour without the lines shared with parts already cut. Every piece starts and ends inside
+        #their cut so it goes in and out like an open curve, pieces are linked over the safe plane.
+        tolerance = max(sc.doc.ModelAbsoluteTolerance*10,.01)
+        params = [rs.CurveClosestPoint(crv,point) for interval in self.common_cut for point in interval]
+        pieces = rs.SplitCurve(crv,params) or [crv]
+        keep = []
+        for piece in pieces:
+            middle = rs.EvaluateCurve(piece,sum(rs.CurveDomain(piece))*.5)
+            if [interval for interval in self.common_cut if point_segment_distance(middle,interval[0],interval[1]) < tolerance]: rs.DeleteObject(piece)
+            else: keep.append(piece)
+        if len(keep) > 1: keep = rs.JoinCurves(keep,True)
+        curves_cut_path = []
+        for piece in keep:
+            piece_path = self.get_cut_path_open(piece)
+            if curves_cut_path: curves_cut_path += self.link_curves(rs.CurveEndPoint(curves_cut_path[-1]),rs.CurveStartPoint(piece_path[0]),self.sec_plane)
+            curves_cut_path += piece_path
+        return curves_cut_path
+    
     def isCurveNew(self,offsets,curve):
         if offsets:
             for offset in offsets:
@@ -1486,7 +4383,7 @@ class g_curve():
         else:
             return False
     
-    def OffsetCurve(self,level_cut):
+    def OffsetCurve(self,level_cut,offset_distance=False):
         
         check_presision = 10
         offset_type=3
@@ -1494,7 +4391,7 @@ class g_curve():
         branched_curves = []
         main_curve = level_cut
         
-        offset_distance = self.general_input["cut_diam"] * self.input_data["xy_dist"]
+        offset_distance = self.general_input["cut_diam"] * self.input_data["xy_dist"] if not offset_distance else offset_distance
         curve_1 = rs.OffsetCurve(main_curve,rs.CurveAreaCentroid(main_curve)[0],-mini_test_offset,None,offset_type)
         curve_2 = rs.OffsetCurve(main_curve,rs.CurveAreaCentroid(main_curve)[0],mini_test_offset,None,offset_type)
         
@@ -1609,63 +4506,145 @@ class g_curve():
         clusters = rs.JoinCurves(joined_pocket_curves,delete_input=True)
         return clusters
         
-    def pocket_path_circular(self,cep,translation,pocket_list):
-        
-        def jump(pt1,pt2,height,color_palette):
-            up_curve = rs.AddLine(pt1,(pt1[0],pt1[1],height))
-            go_curve = rs.AddLine((pt1[0],pt1[1],height),(pt2[0],pt2[1],height))
-            down_curve = rs.AddLine((pt2[0],pt2[1],height),pt2)
-            rs.ObjectColor(up_curve,color_palette["rapid"])
-            rs.ObjectColor(go_curve,color_palette["rapid"])
-            rs.ObjectColor(down_curve,color_palette["rapid"])
-            return [up_curve,go_curve,down_curve]
+    def is_link_inside(self,pt1,pt2,boundary):
+        #Checks if the straight link between two points stays inside the closed boundary, the outline of the
+        #boundary is kept so no line is added to the document for each link
+        if not self.link_polygon or self.link_polygon[0] != boundary: self.link_polygon = (boundary,curve_polygon(boundary))
+        polygon = self.link_polygon[1]
+        start,end = (pt1[0],pt1[1]),(pt2[0],pt2[1])
+        if math.hypot(end[0]-start[0],end[1]-start[1]) < self.general_input['tolerance']: return point_in_polygon(start,polygon)
+        for index in range(len(polygon)):
+            if segments_cross(start,end,polygon[index-1],polygon[index]): return False
+        return point_in_polygon(((start[0]+end[0])*.5,(start[1]+end[1])*.5),polygon)
+    
+    def link_height(self,pt1,pt2,safe_height,boundary):
+        #Links inside an already cleared level stay over its floor, everything else uses the clearance plane.
+        #Circular pocketing leaves cusps up to the top between its circles so its links never stay low.
+        if boundary and safe_height is not False and self.pocket_strategy() != "circular" and self.is_link_inside(pt1,pt2,boundary):
+            return min(safe_height,self.clear_plane)
+        return self.clear_plane
+    
+    def link_curves(self,pt1,pt2,height):
+        #Rapid up and across, plunge feed back down into the cut
+        link_points = [pt1,(pt1[0],pt1[1],height),(pt2[0],pt2[1],height),pt2]
+        link_colors = [self.color_palette["rapid"],self.color_palette["rapid"],self.color_palette["plunge"]]
+        curves = []
+        for i in range(3):
+            if rs.Distance(link_points[i],link_points[i+1]) > 0:
+                link = rs.AddLine(link_points[i],link_points[i+1])
+                rs.ObjectColor(link,link_colors[i])
+                curves.append(link)
+        return curves
+    
+    def pocket_path_circular(self,cep,translation,pocket_list,safe_height=False,boundary=False):
         
-        def copy_into_level(crvs,translation,color_palette):
-            level_crvs = []
-            for crv in crvs:
-                new_crv = rs.CopyObject(crv,translation)
-                rs.ObjectColor(new_crv,color_palette["cut"])
-                level_crvs.append(new_crv)
-            return level_crvs
+        def jump(pt1,pt2):
+            return self.link_curves(pt1,pt2,self.link_height(pt1,pt2,safe_height,boundary))
         
-        sec_plane = self.general_input['sec_plane']
-        pocket_perimeter,pocket_clusters,pocket_circles = [copy_into_level(i,translation,self.color_palette) for i in pocket_list]
+        pocket_perimeter,pocket_clusters,pocket_circles = [[self.level_curve(crv,translation,"cut") for crv in crvs] for crvs in pocket_list]
         
         pocket_path = []
         
         pocket_path += pocket_perimeter[:-1]
         
-        if rs.CurveEndPoint(pocket_perimeter[0]) != rs.CurveStartPoint(pocket_circles[0]): # Revisa si es circulo
-            pocket_path += jump(rs.CurveEndPoint(pocket_perimeter[0]),rs.CurveStartPoint(pocket_circles[0]),sec_plane,self.color_palette)
+        if self.curve_end(pocket_perimeter[0]) != self.curve_start(pocket_circles[0]): # Revisa si es circulo
+            pocket_path += jump(self.curve_end(pocket_perimeter[0]),self.curve_start(pocket_circles[0]))
         pocket_path += pocket_circles
         
         if pocket_clusters: # Check if it is a circle
-            pocket_path += jump(rs.CurveEndPoint(pocket_circles[-1]),rs.CurveStartPoint(pocket_clusters[0]),sec_plane,self.color_palette)
+            pocket_path += jump(self.curve_end(pocket_circles[-1]),self.curve_start(pocket_clusters[0]))
             for i,path in enumerate(pocket_clusters):
                 pocket_path.append(path)
                 if i < len(pocket_clusters)-1:
-                    pocket_path += jump(rs.CurveEndPoint(path),rs.CurveStartPoint(pocket_clusters[i+1]), sec_plane, self.color_palette)
-            pocket_path += jump(rs.CurveEndPoint(pocket_clusters[-1]),rs.CurveStartPoint(pocket_perimeter[-1]), sec_plane, self.color_palette)
+                    pocket_path += jump(self.curve_end(path),self.curve_start(pocket_clusters[i+1]))
+            pocket_path += jump(self.curve_end(pocket_clusters[-1]),self.curve_start(pocket_perimeter[-1]))
         
         pocket_path.append(pocket_perimeter[-1])
         
         return pocket_path
         
     
+    def pocket_strategy(self):
+        if self.input_data.get("adaptive_pocketing",0): return "adaptive"
+        if self.input_data["circular_pocketing"]: return "circular"
+        return "offset"
+    
+    def get_pocketing_crvs_adaptive(self,crv):
+        #Trochoidal rings: the loops of the first ring touch the wall and the rings are one loop width apart,
+        #so the loop centers sweep the whole band between rings and the tool reaches the core inside the last one
+        cut_diam = self.general_input["cut_diam"]
+        loop_radius = cut_diam * TROCHOID_LOOP_RADIUS
+        first_ring = self.get_cut_curve(-1,loop_radius,crv)
+        if not first_ring: return []
+        rings = [first_ring]
+        inner_rings = self.make_pocket_curves(first_ring,loop_radius*2)
+        if inner_rings: rings += [ring for ring in inner_rings if ring != "sec_plane"]
+        trochoids = [self.make_trochoid(ring,loop_radius) for ring in rings]
+        rs.DeleteObjects(rings)
+        return [trochoid for trochoid in trochoids if trochoid]
+    
+    def make_trochoid(self,ring,loop_radius):
+        #Full circles moving along the ring, every loop only bites the loop advance so the engagement stays bounded.
+        #Each circle is two half arcs so it goes out as G02/G03, the loops start on the same side of their center
+        #and the turn direction is kept in the user text for the helix into the ring.
+        loop_advance = self.general_input["cut_diam"] * self.input_data.get("engagement",.15)
+        ring_length = rs.CurveLength(ring)
+        no_loops = int(math.ceil(ring_length/loop_advance))
+        centers = rs.DivideCurve(ring,no_loops,create_points=False,return_points=True)
+        if not centers: return
+        if rs.IsCurveClosed(ring): centers.append(centers[0])
+        turn = loop_radius if rs.ClosedCurveOrientation(ring,direction=(0,0,1)) == 1 else -loop_radius
+        pieces = []
+        last_start = None
+        for center in centers:
+            start = (center[0]+loop_radius,center[1],center[2])
+            back = (center[0]-loop_radius,center[1],center[2])
+            if last_start and rs.Distance(last_start,start) > 0: pieces.append(rs.AddLine(last_start,start))
+            pieces.append(rs.AddArc3Pt(start,back,(center[0],center[1]+turn,center[2])))
+            pieces.append(rs.AddArc3Pt(back,start,(center[0],center[1]-turn,center[2])))
+            last_start = start
+        trochoid = rs.JoinCurves(pieces,True)
+        if not trochoid: return
+        rs.ObjectColor(trochoid[0],self.color_palette["cut"])
+        rs.SetUserText(trochoid[0],'lincam_turn','1' if turn > 0 else '-1')
+        if len(trochoid) > 1: rs.DeleteObjects(trochoid[1:])
+        return trochoid[0]
+    
+    def pocket_path_adaptive(self,sp,translation,pocket_list,safe_height=False,boundary=False):
+        #Starts and ends at the wall start point so the wall pass is left as a light finishing cut.
+        #Every ring is entered with a helix around its first loop from the level above.
+        pocket_path = []
+        last_point = sp
+        for trochoid in pocket_list:
+            level_trochoid = self.level_curve(trochoid,translation,"cut")
+            start_point = self.curve_start(level_trochoid)
+            entry_height = safe_height if safe_height is not False else self.clear_plane
+            entry_point = (start_point[0],start_point[1],entry_height)
+            pocket_path += self.link_curves(last_point,entry_point,max(entry_height,self.link_height(last_point,entry_point,safe_height,boundary)))
+            if entry_height > start_point[2]:
+                radius = self.general_input["cut_diam"] * TROCHOID_LOOP_RADIUS
+                center = (start_point[0]-radius,start_point[1],start_point[2])
+                ramp_angle = self.get_ramp_angle(entry_height-start_point[2],self.input_data["plunge"],helix=True)
+                pocket_path += self.make_helix_curves(center,radius,entry_height-start_point[2],ramp_angle,int(rs.GetUserText(trochoid,'lincam_turn') or 1))
+            pocket_path.append(level_trochoid)
+            last_point = self.curve_end(level_trochoid)
+        pocket_path += self.link_curves(last_point,sp,self.link_height(last_point,sp,safe_height,boundary))
+        return pocket_path
+    
     def get_pocketing_crvs_offset(self,crv):
         crv_pocket = self.make_pocket_curves(crv)
         if crv_pocket[0] != "sec_plane":
             return self.finish_pocket_curves(crv_pocket)
     
-    def make_pocket_curves(self,level_cut):
+    def make_pocket_curves(self,level_cut,offset_distance=False):
         #
         cut_curves = []
-        offset_curves = self.OffsetCurve(level_cut)
+        offset_curves = self.OffsetCurve(level_cut,offset_distance)
         if offset_curves:
             for offset_curve in offset_curves:
                 cut_curves.append(offset_curve)
                 if offset_curve != "sec_plane":
-                    deep_curve = self.make_pocket_curves(offset_curve)
+                    deep_curve = self.make_pocket_curves(offset_curve,offset_distance)
                     if deep_curve:
                         cut_curves += deep_curve
             
@@ -1702,6 +4681,93 @@ class g_curve():
                     pass
         return block_curves
                                       
+    def get_ramp_angle(self,level_height,plunge_distance,helix=False):
+        #Max ramp angle in degrees, without it the plunge distance sets the ramp as before
+        ramp_angle = self.input_data.get("ramp_angle",0)
+        if not ramp_angle and helix: ramp_angle = math.degrees(math.atan(level_height/plunge_distance))
+        return ramp_angle
+    
+    def get_helix(self,crv):
+        #Helix center and radius inside the contour, small holes fall back to the ramp.
+        #Inside cuts only take it in holes that fit around the helix, in larger ones the way out to the contour
+        #would slot through the part at full depth, pockets clear that way anyway.
+        z = rs.CurveStartPoint(crv)[2]
+        center = self.point if rs.PointInPlanarClosedCurve(self.point,crv) == 1 else self.find_point_in_curve(crv)
+        center = (center[0],center[1],z)
+        wall_distance = rs.Distance(center,rs.EvaluateCurve(crv,rs.CurveClosestPoint(crv,center)))
+        radius = min(self.general_input['cut_diam']*.4,wall_distance*.8)
+        if radius < self.general_input['cut_diam']*.05: return False
+        if not self.pocketing:
+            contour_points = rs.DivideCurve(crv,36,create_points=False,return_points=True) or []
+            if max([rs.Distance(center,pt) for pt in contour_points] or [0]) > radius + self.general_input['cut_diam']*.5: return False
+        return center,radius
+    
+    def add_helical_arc(self,center,start,sweep,z_end):
+        #Preview polyline of an arc going down in Z, the user text keeps what is needed for the G02/G03 line
+        radius = math.hypot(start[0]-center[0],start[1]-center[1])
+        start_angle = math.atan2(start[1]-center[1],start[0]-center[0])
+        steps = max(4,int(abs(sweep)*radius/self.general_input['tolerance']))
+        arc_points = []
+        for i in range(steps+1):
+            angle = start_angle + sweep*i/float(steps)
+            arc_points.append((center[0]+radius*math.cos(angle),center[1]+radius*math.sin(angle),start[2]+(z_end-start[2])*i/float(steps)))
+        arc = rs.AddPolyline(arc_points)
+        rs.ObjectColor(arc,self.color_palette["plunge"])
+        rs.SetUserText(arc,'lincam_arc','%s,%s,%s' % ('G03' if sweep > 0 else 'G02',center[0]-start[0],center[1]-start[1]))
+        return arc
+    
+    def make_helix_curves(self,center,radius,level_height,ramp_angle,orientation):
+        #Full turns around the center going down one level without passing the max ramp angle
+        sweep = 2*math.pi if orientation == 1 else -2*math.pi
+        turn_height = 2*math.pi*radius*math.tan(math.radians(ramp_angle))
+        turns = max(1,int(math.ceil(level_height/turn_height)))
+        helix_curves = []
+        for turn in range(turns):
+            z_start = center[2] + level_height*(1-turn/float(turns))
+            z_end = center[2] + level_height*(1-(turn+1)/float(turns))
+            helix_curves.append(self.add_helical_arc(center,(center[0]+radius,center[1],z_start),sweep,z_end))
+        return helix_curves
+    
+    def make_ramp_segment(self,segment,z_start,z_end):
+        sp = rs.CurveStartPoint(segment)
+        ep = rs.CurveEndPoint(segment)
+        if rs.IsLine(segment):
+            ramp = rs.AddLine((sp[0],sp[1],sp[2]+z_start),(ep[0],ep[1],ep[2]+z_end))
+            rs.ObjectColor(ramp,self.color_palette["plunge"])
+            return ramp
+        if rs.IsArc(segment) or rs.IsCircle(segment):
+            rc,arc = rs.coercecurve(segment).TryGetArc()
+            if rc:
+                sweep = arc.AngleRadians if arc.Plane.Normal.Z > 0 else -arc.AngleRadians
+                return self.add_helical_arc(arc.Center,(sp[0],sp[1],sp[2]+z_start),sweep,ep[2]+z_end)
+        #Free form segments are resampled with the curve tolerance
+        no_points = max(1,int(rs.CurveLength(segment)/self.general_input['tolerance']))
+        ramp_points = rs.DivideCurve(segment,no_points,create_points=False,return_points=True)
+        if rs.IsCurveClosed(segment): ramp_points.append(sp)
+        ramp_moved_points = []
+        for i,pt in enumerate(ramp_points):
+            ramp_moved_points.append((pt[0],pt[1],pt[2]+z_start+(z_end-z_start)*i/float(len(ramp_points)-1)))
+        ramp = rs.AddPolyline(ramp_moved_points)
+        rs.ObjectColor(ramp,self.color_palette["plunge"])
+        return ramp
+    
+    def make_ramp_curves(self,planar_crv,level_height,laps=1):
+        #Follows the contour segments going down one level, lines stay lines and arcs become helical arcs
+        segments = rs.ExplodeCurves(planar_crv,delete_input=False)
+        if not segments: segments = [rs.CopyObject(planar_crv)]
+        lengths = [rs.CurveLength(segment) for segment in segments]
+        total_length = sum(lengths)*laps
+        ramp_curves = []
+        walked = 0
+        for lap in range(laps):
+            for segment,length in zip(segments,lengths):
+                z_start = level_height*(1-walked/total_length)
+                z_end = level_height*(1-(walked+length)/total_length)
+                ramp_curves.append(self.make_ramp_segment(segment,z_start,z_end))
+                walked += length
+        rs.DeleteObjects(segments)
+        return ramp_curves
+    
     def get_cut_path_closed(self,main_crv,no_entries=False,plunge_distance=False,finish_pass=False,omit_box=False):
         
         if finish_pass: crv = self.get_cut_curve(compensation=self.compensation,offset_distance=finish_pass,nurbs_curve=main_crv)
@@ -1711,37 +4777,39 @@ class g_curve():
         plunge_distance = self.input_data["plunge"] if not plunge_distance else plunge_distance
         no_entries = no_entries if no_entries else self.input_data["entries"]
         level_depth = self.input_data["depth"]/ no_entries
-        crv_domain = rs.CurveDomain(crv)
         crv_length = rs.CurveLength(crv)
-        if plunge_distance >= crv_length: plunge_distance = crv_length*.8
-        
-        plunge_end_point = rs.DivideCurveLength(crv, plunge_distance, create_points=False, return_points=True)[1]
-        split_param = rs.CurveClosestPoint(crv,plunge_end_point)
-        planar_plunge_crv,cut_crv = rs.SplitCurve(rs.CopyObject(crv),split_param)
-        
-        #crv_domain_param = crv_domain[1]-crv_domain[0]
-        #trim_domain =  (plunge_distance*crv_domain_param)/crv_length
-        #planar_plunge_crv,cut_crv = rs.SplitCurve(rs.CopyObject(crv),rs.CurveDomain(crv)[0]+trim_domain)
-        
-        no_points = int(rs.CurveLength(planar_plunge_crv)/self.general_input['tolerance'])
-        if not no_points: 
-            no_points =1
-        
-        plunge_pts = rs.DivideCurve(planar_plunge_crv,no_points, create_points=False, return_points=True)
-        plunge_moved_pts = []
-        z_count = abs(level_depth)
-        z_pass = abs(level_depth/no_points)
-        for pt in plunge_pts:
-            new_point = pt[0],pt[1],pt[2]+z_count
-            plunge_moved_pts.append(new_point)
-            z_count -= z_pass
-            
-        plunge_crv = rs.AddPolyline(plunge_moved_pts)
-        rs.SimplifyCurve(plunge_crv)
+        
+        helix = self.get_helix(crv) if self.input_data.get("helical_entry",0) and self.compensation == -1 else False
+        planar_plunge_crv = None
+        ramp_laps = 1
+        if helix:
+            #Helical entry inside pockets and small holes, the whole contour is cut on every level
+            ramp_angle = self.get_ramp_angle(abs(level_depth),plunge_distance,helix=True)
+            cut_crv = rs.CopyObject(crv)
+            plunge_crvs = self.make_helix_curves(helix[0],helix[1],abs(level_depth),ramp_angle,rs.ClosedCurveOrientation(crv,direction=(0,0,1)))
+            entry_end_point = (helix[0][0]+helix[1],helix[0][1],helix[0][2])
+        else:
+            ramp_angle = self.get_ramp_angle(abs(level_depth),plunge_distance)
+            if ramp_angle: plunge_distance = max(plunge_distance,abs(level_depth)/math.tan(math.radians(ramp_angle)))
+            if ramp_angle and plunge_distance >= crv_length*.8:
+                #The ramp does not fit in the contour so it goes around it as many times as needed
+                ramp_laps = int(math.ceil(plunge_distance/crv_length))
+                planar_plunge_crv = rs.CopyObject(crv)
+                cut_crv = rs.CopyObject(crv)
+            else:
+                if plunge_distance >= crv_length: plunge_distance = crv_length*.8
+                plunge_end_point = rs.DivideCurveLength(crv, plunge_distance, create_points=False, return_points=True)[1]
+                split_param = rs.CurveClosestPoint(crv,plunge_end_point)
+                planar_plunge_crv,cut_crv = rs.SplitCurve(rs.CopyObject(crv),split_param)
+            plunge_crvs = self.make_ramp_curves(planar_plunge_crv,abs(level_depth),ramp_laps)
+            entry_end_point = rs.CurveStartPoint(planar_plunge_crv)
         
         #Creates cutting curves for pocketing if required
         if self.pocketing and not omit_box:
-            if self.input_data["circular_pocketing"]:
+            if self.pocket_strategy() == "adaptive":
+                pocketing_crvs = self.get_pocketing_crvs_adaptive(crv)
+                self.pocketing = False if not pocketing_crvs else self.pocketing
+            elif self.pocket_strategy() == "circular":
                 pocketing_crvs = self.get_pocketing_crvs_circular(crv)
                 self.pocketing = False if not pocketing_crvs else self.pocketing
             else:
@@ -1751,61 +4819,73 @@ class g_curve():
         #Final operating checklist for curve cutter
         curves_cut_path = [] 
         
-        #adds cutter input
-        entry_end_point = rs.CurveStartPoint(planar_plunge_crv)
-        sec_plane = self.general_input["sec_plane"]
-        in_curve = rs.AddLine((entry_end_point[0],entry_end_point[1],sec_plane),entry_end_point)
-    
-        domain = rs.CurveDomain(in_curve)
-        parameter = domain[1] * .8
-        in_curve_rapid,in_curve_plunge = rs.SplitCurve(in_curve,parameter, delete_input=True)
-        
-        rs.ObjectColor(in_curve_rapid,self.color_palette["rapid"])
-        curves_cut_path.append(in_curve_rapid)
-        rs.ObjectColor(in_curve_plunge,self.color_palette["plunge"])
-        curves_cut_path.append(in_curve_plunge)
+        #adds cutter input, the rapid approach ends at the clearance plane
+        in_curve = rs.AddLine((entry_end_point[0],entry_end_point[1],self.clear_plane),entry_end_point)
+        rs.ObjectColor(in_curve,self.color_palette["plunge"])
+        curves_cut_path.append(in_curve)
         
         
         #general list of curves and sorts them by level, differentiating between plunge and cut by color.
         for entrie in range(1,int(no_entries)+1):
             z_level = level_depth*entrie
             translation = rs.VectorAdd((0,0,0),(0,0,z_level))
-            level_plunge= rs.CopyObject(plunge_crv,translation)
-            level_cut = rs.CopyObject(cut_crv,translation)
-            rs.ObjectColor(level_plunge,self.color_palette["plunge"])
-            rs.ObjectColor(level_cut,self.color_palette["cut"])
-            curves_cut_path.append(level_plunge)
+            level_plunges = [self.level_curve(plunge_crv,translation,"plunge") for plunge_crv in plunge_crvs]
+            level_cut = self.level_curve(cut_crv,translation,"cut")
+            if helix:
+                #Goes back to the helix through the slot of the level above and then out to the contour
+                last_point = self.curve_end(curves_cut_path[-1])
+                helix_start = self.curve_start(level_plunges[0])
+                if rs.Distance(last_point,helix_start) > 0:
+                    back_curve = rs.AddLine(last_point,helix_start)
+                    rs.ObjectColor(back_curve,self.color_palette["cut"])
+                    curves_cut_path.append(back_curve)
+                curves_cut_path += level_plunges
+                out_helix_curve = rs.AddLine(self.curve_end(level_plunges[-1]),self.curve_start(level_cut))
+                rs.ObjectColor(out_helix_curve,self.color_palette["plunge"])
+                curves_cut_path.append(out_helix_curve)
+            else:
+                curves_cut_path += level_plunges
+            #From the second level the level above is already cleared inside the pocket, links stay just over its floor
+            safe_height = z_level - level_depth + LINK_CLEARANCE if entrie > 1 else False
+            if self.pocketing and not omit_box and pocketing_crvs and self.pocket_strategy() == "adaptive":
+                #Clears the level with the trochoids before the wall pass
+                curves_cut_path += self.pocket_path_adaptive(self.curve_start(level_cut),translation,pocketing_crvs,safe_height,crv)
+                curves_cut_path.append(level_cut)
+                continue
             curves_cut_path.append(level_cut)
             if self.pocketing and not omit_box and pocketing_crvs:
                 if self.input_data["circular_pocketing"]:
-                    pocket_path = self.pocket_path_circular(rs.CurveEndPoint(level_cut),translation,pocketing_crvs)
+                    pocket_path = self.pocket_path_circular(self.curve_end(level_cut),translation,pocketing_crvs,safe_height,crv)
                 else:
-                    pocket_path = self.pocket_path_offset(z_level,translation,pocketing_crvs)
+                    pocket_path = self.pocket_path_offset(z_level,translation,pocketing_crvs,safe_height,crv)
                 curves_cut_path += pocket_path
-                
-        #add the last cut line as a plunge to avoid generating such an abrupt piece bounce.
-        #final_cut = rs.CopyObject(planar_plunge_crv,translation)
-       
-        # Uses final cut as bridge. Cancel = 0 Experimental. 
-        bridge_height = 0
-        if bridge_height:
-            start_final_cut = (rs.CurveStartPoint(planar_plunge_crv)[0],rs.CurveStartPoint(planar_plunge_crv)[1],z_level)
-            up_final_cut = rs.AddLine(start_final_cut,(start_final_cut[0],start_final_cut[1],z_level+bridge_height))
-            rs.ObjectColor(up_final_cut,self.color_palette["cut"])
-            curves_cut_path.append(up_final_cut)
-
-        final_cut_translation = rs.VectorAdd((0,0,0),(0,0,z_level+bridge_height))
-        final_cut = rs.CopyObject(planar_plunge_crv,final_cut_translation)
         
-        rs.ObjectColor(final_cut,self.color_palette["cut"])
-        curves_cut_path.append(final_cut)
+        if helix or ramp_laps > 1:
+            #The whole contour was already cut on the last level
+            final_point = self.curve_end(curves_cut_path[-1])
+        else:
+            #add the last cut line as a plunge to avoid generating such an abrupt piece bounce.
+            #final_cut = rs.CopyObject(planar_plunge_crv,translation)
+           
+            # Uses final cut as bridge. Cancel = 0 Experimental. 
+            bridge_height = 0
+            if bridge_height:
+                start_final_cut = (rs.CurveStartPoint(planar_plunge_crv)[0],rs.CurveStartPoint(planar_plunge_crv)[1],z_level)
+                up_final_cut = rs.AddLine(start_final_cut,(start_final_cut[0],start_final_cut[1],z_level+bridge_height))
+                rs.ObjectColor(up_final_cut,self.color_palette["cut"])
+                curves_cut_path.append(up_final_cut)
+    
+            final_cut_translation = rs.VectorAdd((0,0,0),(0,0,z_level+bridge_height))
+            final_cut = self.level_curve(planar_plunge_crv,final_cut_translation,"cut")
+            curves_cut_path.append(final_cut)
+            final_point = self.curve_end(final_cut)
         
         #adds finishing pass
         if finish_pass:
             finish_cut_curve = rs.CopyObject(main_crv,translation)
-            rs.CurveSeam(finish_cut_curve,rs.CurveClosestPoint(finish_cut_curve , rs.CurveEndPoint(final_cut)))
-            in_finish_curve = rs.AddLine(rs.CurveEndPoint(final_cut),rs.CurveEndPoint(finish_cut_curve))
-            out_finish_curve = rs.AddLine(rs.CurveEndPoint(finish_cut_curve),rs.CurveEndPoint(final_cut))
+            rs.CurveSeam(finish_cut_curve,rs.CurveClosestPoint(finish_cut_curve , final_point))
+            in_finish_curve = rs.AddLine(final_point,rs.CurveEndPoint(finish_cut_curve))
+            out_finish_curve = rs.AddLine(rs.CurveEndPoint(finish_cut_curve),final_point)
             rs.ObjectColor(in_finish_curve,self.color_palette["cut"])
             rs.ObjectColor(out_finish_curve,self.color_palette["cut"])
             rs.ObjectColor(finish_cut_curve,self.color_palette["cut"])
@@ -1814,55 +4894,54 @@ class g_curve():
             curves_cut_path.append(out_finish_curve)
          
         #adds cutter output
-        final_point = rs.CurveEndPoint(final_cut)
-        out_curve = rs.AddLine(final_point,(final_point[0],final_point[1],sec_plane))
+        out_curve = rs.AddLine(final_point,(final_point[0],final_point[1],self.clear_plane))
         rs.ObjectColor(out_curve,self.color_palette["rapid"])
         curves_cut_path.append(out_curve)
         
-        rs.DeleteObjects([planar_plunge_crv,plunge_crv,cut_crv,crv,main_crv])
+        self.discard_curves([planar_plunge_crv,cut_crv,crv,main_crv] + plunge_crvs)
         
         #Deletes pocketing curves at level zero that are only used for copying
         if self.pocketing and not omit_box and pocketing_crvs:
-            if self.input_data["circular_pocketing"]:
+            if self.pocket_strategy() == "adaptive":
+                self.discard_curves(pocketing_crvs)
+            elif self.input_data["circular_pocketing"]:
                 for p in pocketing_crvs:
-                    if p:
-                        rs.DeleteObjects(p)
+                    if p: self.discard_curves(p)
             else:
-                for p in pocketing_crvs:
-                    if p != 'sec_plane': rs.DeleteObject(p)
+                self.discard_curves(pocketing_crvs)
         
         return curves_cut_path
     
-    def pocket_path_offset(self,z_level,translation,pocket_list):
+    def pocket_path_offset(self,z_level,translation,pocket_list,safe_height=False,boundary=False):
         
         revised_list = []
         last_obj = None
         for obj in pocket_list:
             
             if obj != "sec_plane":
-                revised_list.append(rs.CopyObject(obj,translation))
+                revised_list.append(self.level_curve(obj,translation))
             else:
                 if last_obj != obj:
                     revised_list.append(obj)
             last_obj = obj
         pocket_list = revised_list
+        pocket_path = []
         for i in range(0,len(pocket_list)):
             crv = pocket_list[i]
             if crv == "sec_plane": #Intermediate shift
-                pep = rs.CurveEndPoint(pocket_list[i-1])
+                pep = self.curve_end(pocket_list[i-1])
                 try:
-                    nsp = rs.CurveStartPoint(pocket_list[i+1])
+                    nsp = self.curve_start(pocket_list[i+1])
                 except:
                     
                     npt = rs.CurveStartPoint(self.cut_curve)
                     nsp = (npt[0],npt[1],z_level)
-                   
-                points = [rs.CurveEndPoint(pocket_list[i-1]),(pep[0],pep[1],self.general_input["sec_plane"]),(nsp[0],nsp[1],self.general_input["sec_plane"]),nsp]
-                travel_line = rs.AddPolyline(points)
-                rs.ObjectColor(travel_line,self.color_palette["cut"])
-                pocket_list[i] = travel_line
+                
+                pocket_path += self.link_curves(pep,nsp,self.link_height(pep,nsp,safe_height,boundary))
+            else:
+                pocket_path.append(crv)
                         
-        return pocket_list
+        return pocket_path
             
     def find_point_in_curve(self,crv):
         offset_points = rs.BoundingBox(crv)
@@ -1927,10 +5006,24 @@ class g_curve():
             return None
 
 
+def ServeJobs():
+    #Headless job server, LINCAM_SERVER holds host:port and LINCAM_WORKERS the number of worker processes
+    settings_folder = os.environ.get('LINCAM_SETTINGS') or os.path.join(os.path.dirname(os.path.realpath(__file__)),"res","Settings")
+    with open(os.path.join(settings_folder,"MachiningSettings.json"),'r') as f:
+        machining_settings = json.loads(f.read())
+    with open(os.path.join(settings_folder,"Postprocessors.json"),'r') as f:
+        postprocessors = json.loads(f.read())
+    host,port = os.environ['LINCAM_SERVER'].split(':')
+    workers = int(os.environ.get('LINCAM_WORKERS',DEFAULT_WORKERS))
+    #With workers every worker logs the jobs it makes
+    server = camServer(machining_settings,postprocessors,(host,int(port)),metrics_file=os.path.join(settings_folder,"Metrics.jsonl") if not workers else False,workers=workers)
+    server.Serve()
+
 # The script that will be using the dialog.
 def Main():
     
     #if not check_language_and_conditions(): return
+    if os.environ.get('LINCAM_SERVER'): return ServeJobs()
     
     #Starts UI
     if sc.sticky.has_key(COMMAND_NAME):
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015,2016,2017,2018 Daniel Fernandez MD (daniel@dfmd.mx), Saul Pilatowsky C (saul@dfmd.mx)
+# distributed by www.ingenierialinarand.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+#Metrics log without Rhino, the logs of several stations can be read from any Python:
+#    python lincam_metrics.py Metrics.jsonl other/Metrics.jsonl --days 90 --by preset --period week
+
+import argparse
+import datetime
+import json
+import os
+import time
+
+#Time buckets of the summaries, each gives the label of a record time
+PERIODS = {"day":lambda date: date.strftime('%Y-%m-%d'),
+           "week":lambda date: '%d-W%02d' % date.isocalendar()[:2],
+           "month":lambda date: date.strftime('%Y-%m')}
+
+def append_metrics(file_path,record):
+    #One JSON record per line so every run is a single append
+    with open(file_path,'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def read_metrics(file_paths,days=0):
+    #Records of one or more metrics logs, the last days only when given
+    since = time.time() - days*86400 if days else 0
+    records = []
+    for file_path in file_paths:
+        if not os.path.isfile(file_path): continue
+        with open(file_path,'r') as f:
+            for line in f:
+                try: record = json.loads(line)
+                except ValueError: continue
+                if record.get('time',0) >= since: records.append(record)
+    return records
+
+def get_period(record,period):
+    #Day, week or month of the record in local time
+    return PERIODS[period](datetime.date.fromtimestamp(record.get('time',0)))
+
+def summarize_metrics(records,group_by='preset',period=None):
+    #Runs, objects, compute seconds and machine minutes per preset, post, station or operation, slowest first.
+    #With a period the rows are per (period,name) instead, oldest period first and slowest first within it
+    summary = {}
+    for record in records:
+        if group_by == 'operation':
+            rows = [(name,values['objects'],values['compute_ms'],values['minutes']) for name,values in record['operations'].items()]
+        else:
+            rows = [(record.get(group_by),record['objects'],record['compute_ms'],sum(record['machine_minutes'].values()))]
+        for name,objects,compute_ms,minutes in rows:
+            key = (get_period(record,period),name) if period else name
+            row = summary.setdefault(key,{'runs':0,'objects':0,'compute_s':0,'machine_min':0})
+            row['runs'] += 1
+            row['objects'] += objects
+            row['compute_s'] += compute_ms/1000.0
+            row['machine_min'] += minutes
+    if period: return sorted(summary.items(),key=lambda item:(item[0][0],-item[1]['machine_min']))
+    return sorted(summary.items(),key=lambda item:item[1]['machine_min'],reverse=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Summary of LinCAM metrics logs')
+    parser.add_argument('files',nargs='+',help='Metrics.jsonl files of one or more stations')
+    parser.add_argument('--days',type=int,default=0,help='only the last days, all by default')
+    parser.add_argument('--by',default='preset',help='preset, post, station or operation')
+    parser.add_argument('--period',choices=sorted(PERIODS),help='one row per day, week or month')
+    args = parser.parse_args()
+    for key,row in summarize_metrics(read_metrics(args.files,args.days),args.by,args.period):
+        name = '%s %s' % key if args.period else key
+        print('%s: %s runs, %s objects, %s s, %s min' % (name,row['runs'],row['objects'],round(row['compute_s'],1),round(row['machine_min'],1)))
+
+if __name__ == '__main__':
+    main()
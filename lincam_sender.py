@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015,2016,2017,2018 Daniel Fernandez MD (daniel@dfmd.mx), Saul Pilatowsky C (saul@dfmd.mx) 
+# distributed by www.ingenierialinarand.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+#GRBL streaming without Rhino, the port is any object with write(text) and readline()
+
+from collections import deque
+
+#Size of the GRBL serial receive buffer
+GRBL_RX_BUFFER = 128
+
+class g_sender(object):
+    #Streams a program to GRBL counting the characters still waiting in the controller buffer,
+    #lines are sent while they fit so the planner never runs empty on short segments.
+    
+    def __init__(self,port,log=False,txt=False,interrupt=False,on_hold=False,rx_buffer=GRBL_RX_BUFFER,max_timeouts=30):
+        self.port = port
+        self.log = log if log else self.print_log
+        self.txt = txt if txt else self.no_translation
+        self.interrupt = interrupt
+        self.on_hold = on_hold
+        self.rx_buffer = rx_buffer
+        self.max_timeouts = max_timeouts
+        self.pending = deque()
+        self.pending_size = 0
+        self.sent = 0
+        self.acknowledged = 0
+        self.errors = []
+        self.stopped = False
+    
+    def print_log(self,text):
+        print(text)
+    
+    def no_translation(self,text):
+        return text
+    
+    @staticmethod
+    def clean_line(line):
+        #Comments and spaces take buffer space and GRBL ignores them
+        line = line.split(';')[0]
+        while '(' in line and ')' in line[line.index('('):]:
+            start = line.index('(')
+            line = line[:start] + line[line.index(')',start)+1:]
+        return line.replace(' ','').strip().upper()
+    
+    def wake_up(self):
+        #GRBL resets when the port opens and prints its welcome line
+        self.port.write('\r\n\r\n')
+        for i in range(3):
+            response = self.port.readline().strip()
+            if response.startswith('Grbl'):
+                self.log(response)
+                break
+    
+    def stream(self,lines,total=0):
+        #Returns True when every line was sent and acknowledged
+        progress_step = max(1,int(total/20)) if total else 500
+        for line in lines:
+            line = self.clean_line(line)
+            if not line: continue
+            size = len(line) + 1
+            while self.pending and self.pending_size + size > self.rx_buffer:
+                if not self.read_response(): return False
+            if self.interrupt and not self.sent % 10 and self.interrupt() and not self.hold(self.txt('Detenido por el usuario')): return False
+            self.port.write(line + '\n')
+            self.pending.append((size,line))
+            self.pending_size += size
+            self.sent += 1
+            if not self.sent % progress_step:
+                self.log('%s: %s/%s' % (self.txt('Enviando'),self.sent,total) if total else '%s: %s' % (self.txt('Enviando'),self.sent))
+        while self.pending:
+            if not self.read_response(): return False
+        return not self.stopped
+    
+    def read_response(self):
+        #Waits for one answer, ok and error free their line from the count
+        timeouts = 0
+        while True:
+            if self.stopped: return False
+            response = self.port.readline().strip()
+            if not response:
+                timeouts += 1
+                if timeouts >= self.max_timeouts:
+                    self.log('Error: %s' % self.txt('El controlador no responde'))
+                    self.stop()
+                    return False
+                continue
+            if response == 'ok' or response.startswith('error'):
+                size,line = self.pending.popleft()
+                self.pending_size -= size
+                self.acknowledged += 1
+                if response == 'ok': return True
+                self.errors.append((self.acknowledged,line,response))
+                self.log('%s %s: %s (%s)' % (self.txt('Linea'),self.acknowledged,response,line))
+                return self.hold(response)
+            if response.startswith('ALARM'):
+                self.log(response)
+                self.stop()
+                return False
+            if response.startswith('<Hold'): self.log(self.txt('Pausa (feed hold)'))
+            elif response.startswith('[') or response.startswith('Grbl'): self.log(response)
+    
+    def hold(self,reason):
+        #Feed hold, the stream goes on only if on_hold answers True
+        self.port.write('!')
+        self.log('%s: %s' % (self.txt('Pausa (feed hold)'),reason))
+        if self.on_hold and self.on_hold(reason):
+            self.port.write('~')
+            return True
+        self.stop()
+        return False
+    
+    def stop(self):
+        #Soft reset empties the controller buffer
+        self.port.write('\x18')
+        self.pending.clear()
+        self.pending_size = 0
+        self.stopped = True
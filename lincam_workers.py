@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015,2016,2017,2018 Daniel Fernandez MD (daniel@dfmd.mx), Saul Pilatowsky C (saul@dfmd.mx)
+# distributed by www.ingenierialinarand.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+#Jobs sent to worker job servers without Rhino. Each worker is a Rhino process serving jobs one at a time
+#in its own document, the job server of the box hands every worker one job at a time from its queue.
+
+import json
+import time
+try:
+    from urllib2 import Request, urlopen, URLError
+except ImportError:
+    from urllib.request import Request, urlopen
+    from urllib.error import URLError
+
+#Seconds between the status requests of a running job
+WORKER_POLL_SECONDS = .5
+#Seconds a new worker process has to start answering
+WORKER_START_SECONDS = 180
+#Fields of a worker job that belong to the worker and not to the result
+WORKER_JOB_FIELDS = ('status','submitted','started','finished')
+
+def worker_url(address,path):
+    return 'http://%s:%s%s' % (address[0],address[1],path)
+
+def request_json(url,data=None,timeout=30):
+    #GET, or POST when data is given, of a JSON body
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    request = Request(url,body,{'Content-Type':'application/json'})
+    response = urlopen(request,timeout=timeout)
+    try: return json.loads(response.read().decode('utf-8'))
+    finally: response.close()
+
+def wait_for_worker(address,timeout=WORKER_START_SECONDS,stop=None):
+    #True once the worker answers its status, False when it does not start in time or the pool is stopped
+    limit = time.time() + timeout
+    while time.time() < limit:
+        if stop is not None and stop.is_set(): return False
+        try:
+            request_json(worker_url(address,'/status'),timeout=5)
+            return True
+        except (URLError,IOError,ValueError): time.sleep(WORKER_POLL_SECONDS)
+    return False
+
+def run_remote_job(address,data,poll=WORKER_POLL_SECONDS):
+    #Sends the job to the worker and waits for it, returns the result fields and raises RuntimeError on job errors
+    job_id = request_json(worker_url(address,'/jobs'),data)['id']
+    while True:
+        job = request_json(worker_url(address,'/jobs/%s' % job_id))
+        if job['status'] == 'done': return dict((key,value) for key,value in job.items() if key not in WORKER_JOB_FIELDS)
+        if job['status'] == 'error': raise RuntimeError(job.get('message','error'))
+        time.sleep(poll)
@@ -0,0 +1,40 @@
+# DXF and SVG reading, runs only inside Rhino where rhinoscriptsyntax is available
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import rhinoscriptsyntax as rs
+    import LinCAM3
+except ImportError:
+    rs = None
+
+
+@unittest.skipIf(rs is None,'needs Rhino')
+class ImporterTest(unittest.TestCase):
+
+    def test_svg_subpaths_stay_apart(self):
+        importer = LinCAM3.g_importer('drawing.svg')
+        subpaths = importer.svg_path('M0 0 L10 0 L10 10 L0 10 Z M3 3 L6 3 L6 6 Z',lambda x,y: (x,y,0))
+        self.assertEqual(len(subpaths),2)
+        self.assertTrue(all(closed for segments,closed in subpaths))
+        self.assertEqual(subpaths[1][0][0][1],(3,3,0))
+
+    def test_dxf_block_polylines_are_not_read(self):
+        def polyline(x):
+            return [(0,'POLYLINE'),(8,'0'),(70,1),(0,'VERTEX'),(10,x),(20,0),(0,'VERTEX'),(10,x+5),(20,0),(0,'VERTEX'),(10,x+5),(20,5),(0,'SEQEND')]
+        pairs = [(0,'SECTION'),(2,'BLOCKS'),(0,'BLOCK'),(2,'B1')] + polyline(100) + [(0,'ENDBLK'),(0,'ENDSEC'),
+                 (0,'SECTION'),(2,'ENTITIES')] + polyline(0) + [(0,'ENDSEC'),(0,'EOF')]
+        handle,file_path = tempfile.mkstemp('.dxf')
+        with os.fdopen(handle,'w') as f:
+            f.write(''.join(['%s\n%s\n' % pair for pair in pairs]))
+        try: entities = list(LinCAM3.g_importer(file_path).iter_dxf_entities())
+        finally: os.remove(file_path)
+        self.assertEqual(len(entities),1)
+        self.assertEqual(entities[0][1][0][1],(0,0,0))
+
+
+if __name__ == '__main__':
+    unittest.main()
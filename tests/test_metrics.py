@@ -0,0 +1,51 @@
+# Metrics log summaries, works without Rhino
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lincam_metrics import read_metrics, summarize_metrics
+
+DAY = 86400
+
+
+class MetricsTest(unittest.TestCase):
+
+    def record(self,days_ago,preset,minutes):
+        return {'time':time.time() - days_ago*DAY,'preset':preset,'objects':2,'compute_ms':500,
+                'machine_minutes':{'cut':minutes},'operations':{'corte':{'objects':2,'compute_ms':500,'minutes':minutes}}}
+
+    def write(self,records):
+        handle,file_path = tempfile.mkstemp('.jsonl')
+        with os.fdopen(handle,'w') as f:
+            f.write(''.join([json.dumps(record) + '\n' for record in records]) + 'not json\n')
+        self.addCleanup(os.remove,file_path)
+        return file_path
+
+    def test_logs_of_several_stations_are_read_together(self):
+        first = self.write([self.record(1,'a',10),self.record(40,'a',5)])
+        second = self.write([self.record(2,'b',20)])
+        self.assertEqual(len(read_metrics([first,second])),3)
+        summary = summarize_metrics(read_metrics([first,second],30))
+        self.assertEqual([name for name,row in summary],['b','a'])
+        self.assertEqual(summary[1][1]['runs'],1)
+
+    def test_rows_per_day_oldest_first(self):
+        records = [self.record(0,'a',10),self.record(0,'b',30),self.record(3,'a',5)]
+        summary = summarize_metrics(records,'preset','day')
+        self.assertEqual([name for (day,name),row in summary],['a','b','a'])
+        self.assertEqual(len(set([day for (day,name),row in summary])),2)
+        self.assertEqual(summary[1][1]['machine_min'],30)
+
+    def test_weeks_by_operation(self):
+        records = [self.record(0,'a',10),self.record(0,'b',30),self.record(14,'a',5)]
+        summary = dict(summarize_metrics(records,'operation','week'))
+        self.assertEqual(sorted([row['machine_min'] for row in summary.values()]),[5,40])
+        self.assertTrue(all(name == 'corte' and '-W' in week for week,name in summary))
+
+
+if __name__ == '__main__':
+    unittest.main()
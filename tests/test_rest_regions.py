@@ -0,0 +1,39 @@
+# Rest machining regions, runs only inside Rhino where rhinoscriptsyntax is available
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import rhinoscriptsyntax as rs
+    import LinCAM3
+except ImportError:
+    rs = None
+
+
+@unittest.skipIf(rs is None,'needs Rhino')
+class RestRegionsTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.curve = rs.AddPolyline([(0,0,0),(100,0,0),(100,60,0),(0,60,0),(0,0,0)])
+        self.job = LinCAM3.camJob({},{},{},{},log=lambda text: None)
+        self.job.CleanHiddenLayer(self.job.layer_rest)
+    
+    def tearDown(self):
+        rs.DeleteObject(self.curve)
+        self.job.CleanHiddenLayer(self.job.layer_rest)
+    
+    def test_rectangle_gives_four_corners(self):
+        pocket = LinCAM3.g_curve(self.curve,{},{'cut_diam':12.0,'sec_plane':10},-1,True,(0,0,0),"curves_pocketing")
+        regions = self.job.GetRestRegions(pocket,3.0)
+        self.assertEqual(len(regions),4)
+        corners = [(0,0),(100,0),(100,60),(0,60)]
+        for region in regions:
+            center = rs.CurveAreaCentroid(region)[0]
+            #Each region is small and next to one corner, not a ring around the pocket
+            self.assertLess(rs.CurveArea(region)[0],6.0*6.0+3.0*12.0)
+            self.assertLess(min([((center[0]-x)**2+(center[1]-y)**2)**.5 for x,y in corners]),6.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
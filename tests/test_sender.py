@@ -0,0 +1,150 @@
+# GRBL streaming against a simulated controller on a pseudo terminal, works without Rhino
+import os
+import select
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lincam_sender import g_sender, GRBL_RX_BUFFER
+try:
+    import pty
+    import tty
+except ImportError:
+    pty = None
+
+#Realtime commands are single characters outside the line buffer
+REALTIME = '!~\x18'
+
+
+class pty_port(object):
+    #Same interface as the serial port, readline returns empty text on timeout
+
+    def __init__(self,fd,timeout=.2):
+        self.fd = fd
+        self.timeout = timeout
+        self.buffer = ''
+
+    def write(self,text):
+        os.write(self.fd,text.encode('ascii'))
+
+    def readline(self):
+        while '\n' not in self.buffer:
+            if not select.select([self.fd],[],[],self.timeout)[0]: return ''
+            self.buffer += os.read(self.fd,1024).decode('ascii')
+        line,self.buffer = self.buffer.split('\n',1)
+        return line
+
+
+class grbl_simulator(threading.Thread):
+    #Keeps the received lines in a buffer of GRBL size and answers them only once it fills or the sender waits
+
+    def __init__(self,fd,answers={}):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fd = fd
+        self.answers = answers
+        self.lines = []
+        self.realtime = []
+        self.waiting = []
+        self.buffered = 0
+        self.max_buffered = 0
+        self.running = True
+
+    def send(self,text):
+        os.write(self.fd,(text + '\r\n').encode('ascii'))
+
+    def run(self):
+        self.send("Grbl 1.1h ['$' for help]")
+        line = ''
+        while self.running:
+            if select.select([self.fd],[],[],.02)[0]:
+                for char in os.read(self.fd,1024).decode('ascii'):
+                    if char in REALTIME:
+                        self.realtime.append(char)
+                        if char == '\x18': self.waiting,self.buffered = [],0
+                    elif char == '\n':
+                        line = line.strip()
+                        if line:
+                            self.waiting.append(line)
+                            self.buffered += len(line) + 1
+                            self.max_buffered = max(self.max_buffered,self.buffered)
+                        line = ''
+                    else: line += char
+                if self.buffered < GRBL_RX_BUFFER - 20: continue
+            if self.waiting:
+                done = self.waiting.pop(0)
+                self.buffered -= len(done) + 1
+                self.lines.append(done)
+                self.send(self.answers.get(done,'ok'))
+
+    def stop(self):
+        self.running = False
+        self.join(1)
+
+
+@unittest.skipIf(pty is None,'needs a pseudo terminal')
+class SenderTest(unittest.TestCase):
+
+    def start(self,answers={}):
+        master,slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        self.addCleanup(os.close,master)
+        self.addCleanup(os.close,slave)
+        simulator = grbl_simulator(master,answers)
+        simulator.start()
+        self.addCleanup(simulator.stop)
+        return simulator,pty_port(slave)
+
+    def realtime(self,simulator,count):
+        #The last realtime command may still be on its way to the simulator
+        for i in range(50):
+            if len(simulator.realtime) >= count: break
+            time.sleep(.02)
+        return simulator.realtime
+
+    def program(self,count=200):
+        return ['G1 X%s Y%s F1000 (cut)\n' % (i,i*.5) for i in range(count)]
+
+    def test_lines_fit_in_the_controller_buffer(self):
+        simulator,port = self.start()
+        grbl = g_sender(port,log=lambda text: None,max_timeouts=10)
+        grbl.wake_up()
+        self.assertTrue(grbl.stream(self.program(),200))
+        self.assertEqual(grbl.acknowledged,200)
+        self.assertEqual(simulator.lines,[g_sender.clean_line(line) for line in self.program()])
+        self.assertLessEqual(simulator.max_buffered,GRBL_RX_BUFFER)
+        self.assertGreater(simulator.max_buffered,GRBL_RX_BUFFER/2)
+
+    def test_error_holds_and_resumes(self):
+        simulator,port = self.start({'G1X50Y25.0F1000':'error:20'})
+        reasons = []
+        grbl = g_sender(port,log=lambda text: None,on_hold=lambda reason: reasons.append(reason) or True,max_timeouts=10)
+        self.assertTrue(grbl.stream(self.program(),200))
+        self.assertEqual(reasons,['error:20'])
+        self.assertEqual(grbl.errors,[(51,'G1X50Y25.0F1000','error:20')])
+        self.assertEqual(grbl.acknowledged,200)
+        self.assertEqual(self.realtime(simulator,2),['!','~'])
+
+    def test_error_without_resume_stops(self):
+        simulator,port = self.start({'G1X50Y25.0F1000':'error:20'})
+        grbl = g_sender(port,log=lambda text: None,max_timeouts=10)
+        self.assertFalse(grbl.stream(self.program(),200))
+        self.assertTrue(grbl.stopped)
+        self.assertEqual(self.realtime(simulator,2),['!','\x18'])
+
+    def test_alarm_stops(self):
+        simulator,port = self.start({'G1X20Y10.0F1000':'ALARM:2'})
+        logs = []
+        grbl = g_sender(port,log=logs.append,max_timeouts=10)
+        self.assertFalse(grbl.stream(self.program(),200))
+        self.assertTrue(grbl.stopped)
+        self.assertIn('ALARM:2',logs)
+        self.assertEqual(self.realtime(simulator,1),['\x18'])
+        self.assertLess(grbl.acknowledged,200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Jobs handed to worker job servers, a fake worker stands in for the Rhino process so it works without Rhino
+import json
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lincam_workers import wait_for_worker, run_remote_job
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class fake_worker(HTTPServer):
+    #Answers the job server API, a job is running on its first status request and then done or failed
+
+    def __init__(self):
+        HTTPServer.__init__(self,('127.0.0.1',0),worker_handler)
+        self.jobs = {}
+        self.received = []
+        threading.Thread(target=self.serve_forever).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class worker_handler(BaseHTTPRequestHandler):
+
+    def send_json(self,data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        self.server.received.append(data)
+        job_id = str(len(self.server.received))
+        self.server.jobs[job_id] = {'status':'running','submitted':1,'data':data}
+        self.send_json({'id':job_id})
+
+    def do_GET(self):
+        if self.path == '/status': return self.send_json({'queued':0})
+        job = self.server.jobs[self.path.split('/')[-1]]
+        answer = dict(job)
+        if job['status'] == 'running':
+            job['status'] = 'error' if job['data'].get('fail') else 'done'
+            if not job['data'].get('fail'): job.update({'gcode':'G0 X1','time':2.5})
+            else: job['message'] = 'bad preset'
+        del answer['data']
+        self.send_json(answer)
+
+    def log_message(self,format,*args):
+        pass
+
+
+class WorkersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = fake_worker()
+        self.addCleanup(self.worker.stop)
+        self.address = self.worker.server_address
+
+    def test_result_comes_back_without_the_worker_fields(self):
+        self.assertTrue(wait_for_worker(self.address,timeout=5))
+        result = run_remote_job(self.address,{'preset':'a'},poll=.01)
+        self.assertEqual(result,{'gcode':'G0 X1','time':2.5})
+        self.assertEqual(self.worker.received,[{'preset':'a'}])
+
+    def test_job_error_is_raised(self):
+        with self.assertRaises(RuntimeError) as context:
+            run_remote_job(self.address,{'fail':True},poll=.01)
+        self.assertIn('bad preset',str(context.exception))
+
+    def test_worker_that_is_not_running(self):
+        self.assertFalse(wait_for_worker(('127.0.0.1',1),timeout=.3))
+
+
+if __name__ == '__main__':
+    unittest.main()